@@ -0,0 +1,56 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+"""
+Compares strptime with the specialised parsers of ew.converter.get_datetime_parser.
+
+    python -m benchmarks.converter [-n NUMBER]
+"""
+
+import ew.converter
+import argparse
+import datetime
+import timeit
+
+
+samples = (
+    ("%Y-%m-%dT%H:%M:%S.%fZ", "2022-02-09T10:01:01.781Z"),
+    ("%Y-%m-%dT%H:%M:%SZ", "2022-02-09T10:01:01Z"),
+    ("%Y-%m-%dT%H:%M:%S", "2022-02-09T10:01:01"),
+    ("%Y-%m-%d %H:%M:%S.%f", "2022-02-09 10:01:01.781123"),
+    ("%Y-%m-%dT%H:%M:%S%z", "2022-02-09T10:01:01+01:00"),
+    ("%Y-%m-%dT%H:%M:%S.%f%z", "2022-02-09T10:01:01.781Z"),
+    ("%Y-%m-%d", "2022-02-09"),
+    ("%A, %d-%b-%y %H:%M:%S UTC", "Monday, 07-Mar-22 14:22:07 UTC"),
+)
+
+
+def run(number: int):
+    print(f"{'format':<28} {'strptime µs':>12} {'parser µs':>10} {'cached µs':>10} {'speedup':>8}")
+    for fmt, val in samples:
+        strptime = datetime.datetime.strptime
+        parser = ew.converter.get_datetime_parser(fmt)
+        cached_parser = ew.converter.get_datetime_parser(fmt, cache_size=128)
+        t_strptime = timeit.timeit(lambda: strptime(val, fmt), number=number) / number * 1e6
+        t_parser = timeit.timeit(lambda: parser(val), number=number) / number * 1e6
+        t_cached = timeit.timeit(lambda: cached_parser(val), number=number) / number * 1e6
+        print(f"{fmt:<28} {t_strptime:>12.3f} {t_parser:>10.3f} {t_cached:>10.3f} {t_strptime / t_parser:>7.1f}x")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-n", "--number", type=int, default=100000)
+    run(number=arg_parser.parse_args().number)
@@ -0,0 +1,54 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+"""
+Compares the stdlib json decoder with the decoder selected by ew.get_json_codec on message payloads shaped like
+tests/resources/data.json, as decoded by the data client for every consumed message.
+
+    python -m benchmarks.json_codec [-n NUMBER] [--codec auto]
+"""
+
+import ew.json_codec
+import argparse
+import json
+import os
+import timeit
+
+
+data_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "tests", "resources", "data.json")
+
+
+def run(number: int, codec_name: str):
+    codec = ew.json_codec.get_json_codec(codec_name)
+    with open(data_path) as file:
+        payloads = [json.dumps(item).encode() for item in json.load(file)]
+    size = sum(len(payload) for payload in payloads)
+    print(f"codec: {codec.name}, payloads: {len(payloads)}, avg size: {size / len(payloads):.0f} bytes")
+    print(f"{'decoder':<10} {'µs/msg':>8} {'MB/s':>8} {'speedup':>8}")
+    stdlib_loads = json.loads
+    results = dict()
+    for name, loads in (("json", stdlib_loads), (codec.name, codec.loads)):
+        duration = timeit.timeit(lambda: [loads(payload) for payload in payloads], number=number)
+        results[name] = duration
+        print(f"{name:<10} {duration / (number * len(payloads)) * 1e6:>8.3f} {size * number / duration / 1e6:>8.1f} {results['json'] / duration:>7.1f}x")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-n", "--number", type=int, default=20000)
+    arg_parser.add_argument("--codec", default="auto")
+    arguments = arg_parser.parse_args()
+    run(number=arguments.number, codec_name=arguments.codec)
@@ -16,4 +16,17 @@
 
 from .worker import *
 from .table_manager import *
+from .table_catalog import *
+from .offset_tracker import *
+from .writer import *
+from .async_writer import *
+from .dedup import *
+from .metrics import *
+from .batch_control import *
+from .error_reporter import *
+from .spool import *
+from .filter_snapshot import *
+from .json_codec import *
+from .profiler import *
 from .util import validate_filter
+from .model import Engine
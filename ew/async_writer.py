@@ -0,0 +1,195 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("AsyncWriterPool", )
+
+from .util import *
+from .model import *
+from .metrics import *
+from .writer import BatchState
+import util
+import asyncio
+import collections
+import datetime
+import threading
+import time
+import typing
+import zoneinfo
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+
+_utc_names = ("UTC", "ETC/UTC", "UCT", "ETC/UCT", "GMT", "ETC/GMT", "UNIVERSAL", "ZULU")
+
+
+def _to_naive(val, tz: datetime.tzinfo):
+    # psycopg2 sends aware datetimes as timestamptz literals, which are converted to the session time zone
+    if isinstance(val, datetime.datetime) and val.tzinfo:
+        return val.astimezone(tz).replace(tzinfo=None)
+    return val
+
+
+def _to_aware(val, tz: datetime.tzinfo):
+    # psycopg2 sends naive datetimes as timestamp literals, which are interpreted in the session time zone
+    if isinstance(val, datetime.datetime) and not val.tzinfo:
+        return val.replace(tzinfo=tz)
+    return val
+
+
+def _get_timezone(name: str) -> datetime.tzinfo:
+    if name.upper() in _utc_names:
+        return datetime.timezone.utc
+    try:
+        return zoneinfo.ZoneInfo(name)
+    except Exception as ex:
+        raise RuntimeError(f"time zone '{name}' of the database session is unknown: {get_exception_str(ex)}")
+
+
+_adapters = {
+    "timestamp": _to_naive,
+    "timestamptz": _to_aware
+}
+
+
+class AsyncWriterPool:
+    """
+    Writes batches with asyncpg on an event loop running in its own thread. Tables of a batch are written
+    concurrently, each in its own transaction on a connection of the pool. Tables without a unique column are
+    written with the binary COPY protocol if write_mode is 'copy', other tables with pipelined prepared inserts.
+    Provides the interface of WriterPool, so offsets of a batch are stored only after all its tables have committed.
+    Writes of a table are serialized in batch order and a table that fails with a connection error is rejected
+    until unblock is called. Datetimes are adapted to the time zone of the database session as psycopg2 literals
+    are cast by the database, so both engines store the same values.
+    """
+    def __init__(self, connect_kwargs: typing.Dict, pool_size: int = 4, write_mode: str = WriteMode.insert, metrics: typing.Optional[Metrics] = None, timeout: float = 60):
+        if asyncpg is None:
+            raise RuntimeError("asyncpg is required by the asyncio engine")
+        self.__connect_kwargs = connect_kwargs
+        self.__pool_size = pool_size
+        self.__write_mode = write_mode
+        self.__metrics = metrics
+        self.__timeout = timeout
+        self.__pool = None
+        self.__adapters = dict()
+        self.__tz = datetime.timezone.utc
+        self.__table_locks = collections.defaultdict(asyncio.Lock)
+        self.__blocked = dict()
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self._run, name="async-writer", daemon=True)
+        self.__conn_errors = (asyncpg.PostgresConnectionError, asyncpg.InterfaceError, asyncpg.exceptions.OperatorInterventionError, OSError, asyncio.TimeoutError)
+
+    def _run(self):
+        asyncio.set_event_loop(self.__loop)
+        self.__loop.run_forever()
+
+    async def _create_pool(self):
+        self.__pool = await asyncpg.create_pool(min_size=1, max_size=self.__pool_size, **self.__connect_kwargs)
+        async with self.__pool.acquire(timeout=self.__timeout) as conn:
+            self.__tz = _get_timezone(await conn.fetchval("SHOW TimeZone"))
+
+    async def _get_adapters(self, conn, table_name, columns, stmt):
+        key = (table_name, columns)
+        try:
+            return self.__adapters[key]
+        except KeyError:
+            prepared = await conn.prepare(stmt)
+            adapters = tuple(_adapters.get(param.name) for param in prepared.get_parameters())
+            self.__adapters[key] = adapters if any(adapters) else None
+            return self.__adapters[key]
+
+    async def _write_table(self, table_name, item) -> typing.Optional[str]:
+        export_id, unique_col, batches = item
+        async with self.__table_locks[table_name]:
+            if table_name in self.__blocked:
+                raise self.__blocked[table_name]
+            try:
+                await self._write_batches(table_name, unique_col, batches)
+            except self.__conn_errors as ex:
+                self.__blocked[table_name] = WriteRowsError(sum(len(b[1]) for b in batches), export_id, ex)
+                raise self.__blocked[table_name]
+            except Exception as ex:
+                row_count = sum(len(b[1]) for b in batches)
+                util.logger.error("writing rows", {"error": get_exception_str(ex), "row_count": row_count, "export_id": export_id})
+                if self.__metrics:
+                    self.__metrics.rolled_back_rows.inc(row_count, (table_name, ))
+                return table_name
+
+    async def _write_batches(self, table_name, unique_col, batches):
+        start = time.perf_counter() if self.__metrics else 0
+        async with self.__pool.acquire(timeout=self.__timeout) as conn:
+            async with conn.transaction():
+                for columns, rows in (split for batch in batches for split in split_default_rows(*batch)):
+                    stmt = gen_insert_into_table_stmt(table_name, columns, unique_col, values=gen_placeholders(len(columns)))
+                    adapters = await self._get_adapters(conn, table_name, columns, stmt)
+                    if adapters:
+                        rows = [tuple(adapter(val, self.__tz) if adapter else val for adapter, val in zip(adapters, row)) for row in rows]
+                    if unique_col or self.__write_mode != WriteMode.copy:
+                        await conn.executemany(stmt, rows, timeout=self.__timeout)
+                    else:
+                        await conn.copy_records_to_table(table_name, records=rows, columns=columns, timeout=self.__timeout)
+        if self.__metrics:
+            self.__metrics.write_stmt.observe(time.perf_counter() - start, ("asyncpg", ))
+
+    async def _write(self, rows_batch: typing.Dict, state: BatchState):
+        try:
+            results = await asyncio.gather(*(self._write_table(table_name, item) for table_name, item in rows_batch.items()), return_exceptions=True)
+            error = None
+            failed_tables = set()
+            error_tables = set()
+            for table_name, result in zip(rows_batch, results):
+                if isinstance(result, BaseException):
+                    error = error or result
+                    error_tables.add(table_name)
+                elif result:
+                    failed_tables.add(result)
+            state.set_done(error=error, failed_tables=failed_tables, error_tables=error_tables)
+        except Exception as ex:
+            state.set_done(error=ex)
+
+    def _evict_table(self, table_name: str):
+        for key in [key for key in self.__adapters if key[0] == table_name]:
+            del self.__adapters[key]
+
+    def submit(self, rows_batch: typing.Dict) -> BatchState:
+        state = BatchState(1 if rows_batch else 0)
+        if rows_batch:
+            asyncio.run_coroutine_threadsafe(self._write(rows_batch=rows_batch, state=state), self.__loop)
+        return state
+
+    def unblock(self):
+        self.__loop.call_soon_threadsafe(self.__blocked.clear)
+
+    def evict_table(self, table_name: str):
+        self.__loop.call_soon_threadsafe(self._evict_table, table_name)
+
+    def start(self):
+        self.__thread.start()
+        asyncio.run_coroutine_threadsafe(self._create_pool(), self.__loop).result()
+
+    def stop(self):
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+
+    def is_alive(self) -> bool:
+        return self.__thread.is_alive()
+
+    def join(self):
+        self.__thread.join()
+        if self.__pool:
+            self.__loop.run_until_complete(self.__pool.close())
+        self.__loop.close()
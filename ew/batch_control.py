@@ -0,0 +1,76 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("BatchController", )
+
+from .model import *
+import threading
+
+
+class BatchController:
+    """
+    Adjusts the batch limit and the poll timeout of the export worker within the given bounds.
+
+    latency mode: the poll timeout is set to the latency target minus the average write duration and the limit
+    is reduced if writing alone takes more than half of the target.
+    throughput mode: the poll timeout is raised while batches are not filled, so writes carry as many rows as
+    possible, and lowered again once batches are filled before it expires.
+
+    In both modes a batch that reaches at least 90% of the limit is taken as backlog and the limit is doubled.
+    """
+    def __init__(self, mode: str, limit: int, timeout: float, min_limit: int, max_limit: int, min_timeout: float, max_timeout: float, target_latency: float = 1.0, smoothing: float = 0.3):
+        if mode not in (BatchControlMode.latency, BatchControlMode.throughput):
+            raise ValueError(f"unknown batch control mode '{mode}'")
+        self.__mode = mode
+        self.__min_limit = min_limit
+        self.__max_limit = max_limit
+        self.__min_timeout = min_timeout
+        self.__max_timeout = max_timeout
+        self.__target_latency = target_latency
+        self.__smoothing = smoothing
+        self.__write_duration = None
+        self.__lock = threading.Lock()
+        self.limit = min(max(limit, min_limit), max_limit)
+        self.timeout = min(max(timeout, min_timeout), max_timeout)
+
+    def _set_limit(self, limit: float):
+        self.limit = int(min(max(limit, self.__min_limit), self.__max_limit))
+
+    def _set_timeout(self, timeout: float):
+        self.timeout = min(max(timeout, self.__min_timeout), self.__max_timeout)
+
+    def observe_batch(self, msg_count: int, limit: int):
+        with self.__lock:
+            fill = msg_count / limit if limit else 0
+            if fill >= 0.9:
+                if self.__mode == BatchControlMode.latency and self.__write_duration and self.__write_duration > self.__target_latency / 2:
+                    return
+                self._set_limit(self.limit * 2)
+                if self.__mode == BatchControlMode.throughput:
+                    self._set_timeout(self.timeout / 1.5)
+            elif self.__mode == BatchControlMode.throughput and fill < 0.5:
+                self._set_timeout(self.timeout * 1.5)
+
+    def observe_write(self, duration: float):
+        with self.__lock:
+            if self.__write_duration is None:
+                self.__write_duration = duration
+            else:
+                self.__write_duration = self.__smoothing * duration + (1 - self.__smoothing) * self.__write_duration
+            if self.__mode == BatchControlMode.latency:
+                self._set_timeout(self.__target_latency - self.__write_duration)
+                if self.__write_duration > self.__target_latency / 2:
+                    self._set_limit(self.limit * self.__target_latency / 2 / self.__write_duration)
@@ -15,6 +15,8 @@
 """
 
 import datetime
+import functools
+import typing
 
 
 def to_float(val, *args):
@@ -40,11 +42,119 @@ def to_str(val, *args):
 
 
 def to_datetime(val, fmt: str):
+    return get_datetime_parser(fmt)(val)
+
+
+def _from_timestamp(val, *args):
+    return datetime.datetime.fromtimestamp(val)
+
+
+_tz_cache = dict()
+
+
+def _get_tz(val: str):
+    try:
+        return _tz_cache[val]
+    except KeyError:
+        tz = datetime.datetime.strptime(val, "%z").tzinfo
+        _tz_cache[val] = tz
+        return tz
+
+
+def _parse_iso_format(fmt: str):
+    """
+    Splits formats like '%Y-%m-%dT%H:%M:%S.%fZ' into date/time separator, fraction flag and suffix. Returns None
+    if the format is not covered by the fast path.
+    """
+    if not fmt.startswith("%Y-%m-%d"):
+        return None
+    rest = fmt[8:]
+    if not rest:
+        return "", False, ""
+    if rest[0] not in ("T", " ") or not rest[1:].startswith("%H:%M:%S"):
+        return None
+    sep = rest[0]
+    rest = rest[9:]
+    fraction = rest.startswith(".%f")
+    if fraction:
+        rest = rest[3:]
+    if rest != "%z" and "%" in rest:
+        return None
+    return sep, fraction, rest
+
+
+def _gen_iso_parser(fmt: str, sep: str, fraction: bool, suffix: str):
+    # Only canonical values are parsed with fromisoformat, everything else is handed to strptime so results and
+    # errors stay the same as with strptime.
+    from_iso_format = datetime.datetime.fromisoformat
+    strptime = datetime.datetime.strptime
+    utc_offset = suffix == "%z"
+    suffix_len = len(suffix)
+
+    def parse(val, *args):
+        try:
+            tz = None
+            if utc_offset:
+                if val[-1] == "Z":
+                    core = val[:-1]
+                    tz = datetime.timezone.utc
+                elif val[-6] in "+-" and val[-3] == ":":
+                    core = val[:-6]
+                    tz = _get_tz(val[-6:])
+                else:
+                    return strptime(val, fmt)
+            elif suffix_len:
+                if not val.endswith(suffix):
+                    return strptime(val, fmt)
+                core = val[:-suffix_len]
+            else:
+                core = val
+            length = len(core)
+            if not sep:
+                valid = length == 10
+            elif fraction:
+                valid = 21 <= length <= 26 and core[19] == "." and core[20:].isdigit()
+            else:
+                valid = length == 19
+            if valid and core[4] == "-" and core[7] == "-" and (not sep or (core[10] == sep and core[13] == ":" and core[16] == ":" and core[11:13] < "24")):
+                time_obj = from_iso_format(core)
+                return time_obj.replace(tzinfo=tz) if tz else time_obj
+        except (ValueError, TypeError, AttributeError, IndexError):
+            pass
+        return strptime(val, fmt)
+
+    return parse
+
+
+def _gen_strptime_parser(fmt: str):
+    strptime = datetime.datetime.strptime
+
+    def parse(val, *args):
+        return strptime(val, fmt)
+
+    return parse
+
+
+@functools.lru_cache(maxsize=None)
+def _gen_datetime_parser(fmt: str):
     if fmt == "unix":
-        time_obj = datetime.datetime.fromtimestamp(val)
-    else:
-        time_obj = datetime.datetime.strptime(val, fmt)
-    return time_obj
+        return _from_timestamp
+    if isinstance(fmt, str):
+        iso_format = _parse_iso_format(fmt)
+        if iso_format:
+            return _gen_iso_parser(fmt, *iso_format)
+    return _gen_strptime_parser(fmt)
+
+
+def get_datetime_parser(fmt: str, cache_size: int = 0) -> typing.Callable:
+    """
+    Returns a parser specialised for the given time format. ISO 8601 like formats are parsed via fromisoformat,
+    other formats via strptime. If cache_size is set, results for repeated values are kept in a LRU cache.
+    """
+    parser = _gen_datetime_parser(fmt)
+    if cache_size > 0:
+        parser = functools.lru_cache(maxsize=cache_size)(parser)
+    return parser
 
 
 type_map = {
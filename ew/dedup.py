@@ -0,0 +1,87 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("DedupCache", )
+
+import collections
+import threading
+import time
+import typing
+
+
+class DedupCache:
+    """
+    Remembers the rows of time_unique tables that have been committed. Rows that match a committed row of the same
+    time are dropped, so replayed messages do not reach the database again. Entries per table are evicted in LRU
+    order once window_size is exceeded or, if ttl is set, once they are older than ttl seconds.
+    """
+    def __init__(self, window_size: int, ttl: float = 0):
+        self.__window_size = window_size
+        self.__ttl = ttl
+        self.__tables = dict()
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _evict(self, keys: collections.OrderedDict, now: float):
+        while len(keys) > self.__window_size:
+            keys.popitem(last=False)
+        if self.__ttl:
+            while keys and now - next(iter(keys.values()))[1] > self.__ttl:
+                keys.popitem(last=False)
+
+    def filter(self, table_name: str, unique_col: str, data: typing.List) -> typing.List:
+        with self.__lock:
+            keys = self.__tables.get(table_name)
+            if not keys:
+                for _, row_data in data:
+                    self.misses += len(row_data)
+                return data
+            self._evict(keys, time.monotonic())
+            new_batch = list()
+            for row_cols, row_data in data:
+                t_pos = row_cols.index(unique_col)
+                new_row_data = [row for row in row_data if keys.get(row[t_pos], (None, ))[0] != (row_cols, row)]
+                self.hits += len(row_data) - len(new_row_data)
+                self.misses += len(new_row_data)
+                if new_row_data:
+                    new_batch.append((row_cols, new_row_data))
+            return new_batch
+
+    def update(self, rows_batch: typing.Dict, failed_tables: typing.Optional[typing.Set] = None):
+        now = time.monotonic()
+        with self.__lock:
+            for table_name, item in rows_batch.items():
+                if not item[1] or (failed_tables and table_name in failed_tables):
+                    continue
+                if table_name not in self.__tables:
+                    self.__tables[table_name] = collections.OrderedDict()
+                keys = self.__tables[table_name]
+                for row_cols, row_data in item[2]:
+                    t_pos = row_cols.index(item[1])
+                    for row in row_data:
+                        timestamp = row[t_pos]
+                        keys[timestamp] = ((row_cols, row), now)
+                        keys.move_to_end(timestamp)
+                self._evict(keys, now)
+
+    def evict_table(self, table_name: str):
+        with self.__lock:
+            self.__tables.pop(table_name, None)
+
+    def get_hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,105 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("ErrorReporter", )
+
+from .util import *
+from .metrics import *
+from .json_codec import *
+import util
+import confluent_kafka
+import json
+import threading
+import time
+import typing
+
+
+class ErrorReporter:
+    """
+    Aggregates conversion errors per export ID and error type and logs them once per log_interval seconds with
+    their counts. If a Kafka producer and a dead letter topic are given, the affected data is produced to the topic.
+    Messages are buffered by the producer, so the hot path does not wait for deliveries. Errors can be reported
+    from several threads, e.g. the convert stage and the writers of lazy rows batches.
+    """
+    def __init__(self, log_interval: float = 10, kafka_producer: typing.Optional[confluent_kafka.Producer] = None, dead_letter_topic: typing.Optional[str] = None, metrics: typing.Optional[Metrics] = None, json_codec: typing.Optional[JSONCodec] = None):
+        self.__log_interval = log_interval
+        self.__kafka_producer = kafka_producer if dead_letter_topic else None
+        self.__dead_letter_topic = dead_letter_topic
+        self.__metrics = metrics
+        self.__json_dumps = json_codec.dumps if json_codec else json.dumps
+        self.__errors = dict()
+        self.__lock = threading.Lock()
+        self.__last_log = time.monotonic()
+        self.dead_letter_count = 0
+        self.dead_letter_dropped = 0
+
+    def _on_delivery(self, err, msg):
+        if err:
+            with self.__lock:
+                self.dead_letter_dropped += 1
+
+    def _produce(self, export_id, ex, ex_str, data):
+        try:
+            self.__kafka_producer.produce(
+                topic=self.__dead_letter_topic,
+                key=export_id,
+                value=self.__json_dumps({"export_id": export_id, "error_type": type(ex).__name__, "error": ex_str, "data": data, "time": time.time()}, default=str),
+                on_delivery=self._on_delivery
+            )
+            with self.__lock:
+                self.dead_letter_count += 1
+        except Exception:
+            # the local queue of the producer is full or the data is not serializable, losing a dead letter must
+            # not block the export
+            with self.__lock:
+                self.dead_letter_dropped += 1
+
+    def report(self, export_id: typing.Optional[str], ex: Exception, data: typing.Optional[typing.Dict] = None):
+        ex_str = get_exception_str(ex)
+        key = (export_id, type(ex).__name__)
+        with self.__lock:
+            try:
+                self.__errors[key][0] += 1
+            except KeyError:
+                self.__errors[key] = [1, ex_str]
+        if self.__metrics:
+            self.__metrics.conversion_errors.inc(1, (key[1], ))
+        if self.__kafka_producer:
+            self._produce(export_id, ex, ex_str, data)
+        if not self.__log_interval:
+            self.log()
+
+    def log(self):
+        """
+        Logs the aggregated errors since the last call and serves delivery callbacks of the producer.
+        """
+        with self.__lock:
+            self.__last_log = time.monotonic()
+            errors = self.__errors
+            self.__errors = dict()
+        for key, item in errors.items():
+            util.logger.error("generating rows", {"export_id": key[0], "error_type": key[1], "count": item[0], "error": item[1]})
+        if self.__kafka_producer:
+            self.__kafka_producer.poll(0)
+
+    def tick(self):
+        if time.monotonic() - self.__last_log >= self.__log_interval:
+            self.log()
+
+    def close(self):
+        self.log()
+        if self.__kafka_producer:
+            self.__kafka_producer.flush(5)
@@ -0,0 +1,208 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("FilterSnapshot", "SnapshotConsumer")
+
+from .util import *
+import util
+import confluent_kafka
+import json
+import os
+import pickle
+import time
+import typing
+import zlib
+
+
+_version = 1
+
+
+class _SnapshotMessage:
+    __slots__ = ("__topic", "__partition", "__offset", "__value", "__timestamp")
+
+    def __init__(self, topic, partition, offset, value, timestamp):
+        self.__topic = topic
+        self.__partition = partition
+        self.__offset = offset
+        self.__value = value
+        self.__timestamp = timestamp
+
+    def error(self):
+        return None
+
+    def value(self):
+        return self.__value
+
+    def key(self):
+        return None
+
+    def headers(self):
+        return None
+
+    def topic(self):
+        return self.__topic
+
+    def partition(self):
+        return self.__partition
+
+    def offset(self):
+        return self.__offset
+
+    def timestamp(self):
+        return self.__timestamp
+
+
+class FilterSnapshot:
+    """
+    Compact local copy of the filter topic. Keeps the latest put message of every filter, deleted filters are
+    removed, and the next offset of every filter topic partition. Saved atomically to a single file with a crc32
+    checksum, a missing or corrupt file results in an empty snapshot and a full replay of the filter topic.
+    """
+    def __init__(self, path: str, filter_topic: str, interval: float = 60):
+        self.__path = path
+        self.__filter_topic = filter_topic
+        self.__interval = interval
+        self.__filters = dict()
+        self.__offsets = dict()
+        self.__changed = False
+        self.__last_save = time.monotonic()
+
+    def load(self) -> bool:
+        try:
+            with open(self.__path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return False
+        try:
+            checksum = int.from_bytes(data[:4], "little")
+            if zlib.crc32(data[4:]) != checksum:
+                raise ValueError("checksum mismatch")
+            snapshot = pickle.loads(data[4:])
+            if snapshot["version"] != _version or snapshot["filter_topic"] != self.__filter_topic:
+                raise ValueError("version or filter topic mismatch")
+        except Exception as ex:
+            util.logger.warning("discarding filter snapshot", {"path": self.__path, "error": get_exception_str(ex)})
+            return False
+        self.__filters = snapshot["filters"]
+        self.__offsets = snapshot["offsets"]
+        util.logger.info("loaded filter snapshot", {"path": self.__path, "filters": len(self.__filters), "offsets": self.__offsets})
+        return True
+
+    def save(self):
+        if not self.__changed:
+            return
+        data = pickle.dumps({"version": _version, "filter_topic": self.__filter_topic, "filters": self.__filters, "offsets": self.__offsets}, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path = self.__path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(zlib.crc32(data).to_bytes(4, "little"))
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.__path)
+        self.__changed = False
+        self.__last_save = time.monotonic()
+        util.logger.debug("saved filter snapshot", {"path": self.__path, "filters": len(self.__filters)})
+
+    def tick(self):
+        if self.__interval and time.monotonic() - self.__last_save >= self.__interval:
+            self.save()
+
+    def record(self, msg):
+        """
+        Applies a message consumed from the filter topic. Messages are keyed by the filter id of their payload,
+        messages without one are not retained but still advance the offset.
+        """
+        try:
+            value = json.loads(msg.value())
+            filter_id = value["payload"]["id"]
+            if value["method"] == "delete":
+                self.__filters.pop(filter_id, None)
+            else:
+                self.__filters[filter_id] = (msg.partition(), msg.offset(), msg.value(), msg.timestamp())
+        except Exception as ex:
+            util.logger.debug("filter message not retained in snapshot", {"error": get_exception_str(ex), "partition": msg.partition(), "offset": msg.offset()})
+        self.__offsets[msg.partition()] = msg.offset() + 1
+        self.__changed = True
+
+    def get_messages(self) -> typing.List[_SnapshotMessage]:
+        """
+        Returns the retained messages in their original order.
+        """
+        return [_SnapshotMessage(self.__filter_topic, partition, offset, value, timestamp) for partition, offset, value, timestamp in sorted(self.__filters.values(), key=lambda item: item[:2])]
+
+    def get_offset(self, partition: int) -> typing.Optional[int]:
+        return self.__offsets.get(partition)
+
+    def __len__(self):
+        return len(self.__filters)
+
+
+class SnapshotConsumer:
+    """
+    Wraps the filter consumer of a FilterClient. Replays the messages of a loaded snapshot before any message of
+    the filter topic, starts assigned partitions at the offsets stored in the snapshot and records every consumed
+    message in the snapshot.
+    """
+    def __init__(self, kafka_consumer: confluent_kafka.Consumer, snapshot: FilterSnapshot):
+        self.__consumer = kafka_consumer
+        self.__snapshot = snapshot
+        self.__replay = snapshot.get_messages()
+        self.__assigned = False
+
+    def __getattr__(self, item):
+        return getattr(self.__consumer, item)
+
+    def _set_offsets(self, partitions: typing.List[confluent_kafka.TopicPartition]):
+        for partition in partitions:
+            offset = self.__snapshot.get_offset(partition.partition)
+            if offset is not None:
+                partition.offset = offset
+        return partitions
+
+    def _record(self, msg):
+        if msg is not None and not msg.error() and msg.value() is not None:
+            self.__snapshot.record(msg)
+        return msg
+
+    def subscribe(self, topics, on_assign=None, *args, **kwargs):
+        def _on_assign(_, partitions):
+            self.__assigned = False
+            if on_assign:
+                on_assign(self, partitions)
+            if not self.__assigned:
+                self.assign(partitions)
+        return self.__consumer.subscribe(topics, *args, on_assign=_on_assign, **kwargs)
+
+    def assign(self, partitions):
+        self.__assigned = True
+        return self.__consumer.assign(self._set_offsets(partitions))
+
+    def poll(self, *args, **kwargs):
+        if self.__replay:
+            return self.__replay.pop(0)
+        self.__snapshot.tick()
+        return self._record(self.__consumer.poll(*args, **kwargs))
+
+    def consume(self, num_messages=1, *args, **kwargs):
+        if self.__replay:
+            msgs = self.__replay[:num_messages]
+            del self.__replay[:num_messages]
+            return msgs
+        self.__snapshot.tick()
+        msgs = self.__consumer.consume(num_messages, *args, **kwargs)
+        for msg in msgs:
+            self._record(msg)
+        return msgs
@@ -0,0 +1,124 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("JSONCodec", "get_json_codec", "install_json_decoder")
+
+from .util import get_exception_str
+import util
+import importlib
+import json
+import pkgutil
+import sys
+import types
+import typing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONCodec:
+    __slots__ = ("name", "loads", "dumps")
+
+    def __init__(self, name: str, loads: typing.Callable, dumps: typing.Callable):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+
+def _json_dumps(obj, default=None):
+    return json.dumps(obj, default=default)
+
+
+def _orjson_loads(data):
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        # orjson rejects NaN, Infinity and integers beyond 64 bit, which the stdlib decoder accepts
+        return json.loads(data)
+
+
+def _orjson_dumps(obj, default=None):
+    return orjson.dumps(obj, default=default)
+
+
+def get_json_codec(name: str = "auto") -> JSONCodec:
+    """
+    Returns the codec for 'json', 'orjson' or 'auto', which selects orjson if it is installed. Falls back to the
+    stdlib codec if orjson is requested but not installed.
+    """
+    if name not in ("auto", "json", "orjson"):
+        raise ValueError(f"unknown json codec '{name}'")
+    if name != "json" and orjson:
+        return JSONCodec(name="orjson", loads=_orjson_loads, dumps=_orjson_dumps)
+    if name == "orjson":
+        util.logger.warning("orjson not installed, using stdlib json codec")
+    return JSONCodec(name="json", loads=json.loads, dumps=_json_dumps)
+
+
+class _JSONModule(types.ModuleType):
+    def __init__(self, codec: JSONCodec):
+        super().__init__(json.__name__)
+        self.__codec = codec
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return self.__codec.loads(s)
+
+    def __getattr__(self, name):
+        return getattr(json, name)
+
+
+def _import_package(package: str):
+    module = importlib.import_module(package)
+    for info in pkgutil.walk_packages(getattr(module, "__path__", ()), package + ".", onerror=lambda _: None):
+        try:
+            importlib.import_module(info.name)
+        except Exception as ex:
+            util.logger.warning("could not import module for json decoder", {"module": info.name, "error": get_exception_str(ex)})
+
+
+def install_json_decoder(codec: JSONCodec, package: str = "ew_lib") -> int:
+    """
+    Lets the modules of a package that decode with the stdlib json module use the decoder of the given codec.
+    The package does not provide a decoder option, so all of its modules are imported and their references to
+    the json module and to json.loads are replaced, calls with keyword arguments keep using the stdlib decoder.
+    Should be called after the clients of the package have been created. Returns the number of patched modules.
+    """
+    if codec.loads is json.loads:
+        return 0
+    _import_package(package)
+    json_module = _JSONModule(codec)
+    count = 0
+    for name, module in list(sys.modules.items()):
+        if not (name == package or name.startswith(package + ".")) or module is None:
+            continue
+        patched = False
+        for attr, value in list(vars(module).items()):
+            if value is json:
+                setattr(module, attr, json_module)
+                patched = True
+            elif value is json.loads:
+                setattr(module, attr, json_module.loads)
+                patched = True
+        count += patched
+    if count:
+        util.logger.info("installed json decoder", {"codec": codec.name, "package": package, "modules": count})
+    else:
+        util.logger.warning("json decoder not installed, no module uses the json module", {"codec": codec.name, "package": package})
+    return count
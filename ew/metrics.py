@@ -0,0 +1,173 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("Metrics", "MetricsServer")
+
+import util
+import bisect
+import threading
+import http.server
+import typing
+
+
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+size_buckets = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(label_names: typing.Tuple, label_values: typing.Tuple, extra: typing.Tuple = ()):
+    items = [f"{name}=\"{_escape_label_value(value)}\"" for name, value in zip(label_names + extra[:1], label_values + extra[1:])]
+    return "{" + ",".join(items) + "}" if items else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: typing.Tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.__label_names = label_names
+        self.__values = dict()
+        self.__lock = threading.Lock()
+
+    def inc(self, value: float = 1, labels: typing.Tuple = ()):
+        with self.__lock:
+            self.__values[labels] = self.__values.get(labels, 0) + value
+
+    def collect(self) -> typing.List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.__lock:
+            for labels, value in self.__values.items():
+                lines.append(f"{self.name}{_format_labels(self.__label_names, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, func: typing.Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.__func = func
+
+    def collect(self) -> typing.List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {self.__func()}"]
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: typing.Tuple, label_names: typing.Tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.__buckets = buckets
+        self.__label_names = label_names
+        self.__values = dict()
+        self.__lock = threading.Lock()
+
+    def observe(self, value: float, labels: typing.Tuple = ()):
+        pos = bisect.bisect_left(self.__buckets, value)
+        with self.__lock:
+            try:
+                item = self.__values[labels]
+            except KeyError:
+                item = [[0] * (len(self.__buckets) + 1), 0, 0]
+                self.__values[labels] = item
+            item[0][pos] += 1
+            item[1] += value
+            item[2] += 1
+
+    def collect(self) -> typing.List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.__lock:
+            for labels, (counts, total, count) in self.__values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.__buckets + ("+Inf", ), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(self.__label_names, labels, ('le', bound))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.__label_names, labels)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.__label_names, labels)} {count}")
+        return lines
+
+
+class Metrics:
+    """
+    Counters and histograms of the export hot path. Components only record values if a Metrics object has been
+    passed to them, so there is no overhead if metrics are disabled.
+    """
+    def __init__(self):
+        self.poll_wait = Histogram("ew_poll_wait_seconds", "Time spent waiting for a batch of messages.", latency_buckets)
+        self.batch_messages = Histogram("ew_batch_messages", "Messages per consumed batch.", size_buckets)
+        self.conversion = Histogram("ew_conversion_seconds", "Time spent converting a batch of messages to rows.", latency_buckets)
+        self.conversion_errors = Counter("ew_conversion_errors_total", "Messages that could not be converted to rows per error type.", ("error_type", ))
+        self.table_rows = Counter("ew_table_rows_total", "Rows handed to the writers per table.", ("table", ))
+        self.write_stmt = Histogram("ew_write_statement_seconds", "Latency of row write calls per write mode.", latency_buckets, ("mode", ))
+        self.rolled_back_rows = Counter("ew_rolled_back_rows_total", "Rows discarded by rolling back a failed table write.", ("table", ))
+        self.commit = Histogram("ew_commit_seconds", "Latency of write transaction commits.", latency_buckets)
+        self.offset_store = Histogram("ew_offset_store_seconds", "Latency of storing offsets.", latency_buckets)
+        self.ddl = Histogram("ew_ddl_seconds", "Latency of table manager statements.", latency_buckets)
+        self.__collectors = [self.poll_wait, self.batch_messages, self.conversion, self.conversion_errors, self.table_rows, self.write_stmt, self.rolled_back_rows, self.commit, self.offset_store, self.ddl]
+        self.__lock = threading.Lock()
+
+    def add_gauge(self, name: str, documentation: str, func: typing.Callable[[], float]):
+        with self.__lock:
+            self.__collectors.append(Gauge(name, documentation, func))
+
+    def collect(self) -> str:
+        lines = list()
+        with self.__lock:
+            collectors = list(self.__collectors)
+        for collector in collectors:
+            lines.extend(collector.collect())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Exposes metrics in the Prometheus text format at /metrics.
+    """
+    def __init__(self, metrics: Metrics, port: int = 9100, host: str = ""):
+        metrics_ = metrics
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics_.collect().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.__server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="metrics-server", daemon=True)
+
+    def start(self):
+        util.logger.info("starting metrics server", {"address": self.__server.server_address})
+        self.__thread.start()
+
+    def stop(self):
+        # shutdown waits for serve_forever and would block if the server has not been started
+        if self.__thread.is_alive():
+            self.__server.shutdown()
+
+    def join(self):
+        if self.__thread.ident is not None:
+            self.__thread.join()
+        self.__server.server_close()
@@ -21,3 +21,27 @@ class ExportArgs:
     time_column = "time_column"
     time_format = "time_format"
     time_unique = "time_unique"
+    chunk_time_interval = "chunk_time_interval"
+    partition_column = "partition_column"
+    partition_count = "partition_count"
+    compress_segmentby = "compress_segmentby"
+    compress_orderby = "compress_orderby"
+    compress_after = "compress_after"
+    drop_after = "drop_after"
+    aggregates = "aggregates"
+
+
+class WriteMode:
+    insert = "insert"
+    copy = "copy"
+    prepared = "prepared"
+
+
+class Engine:
+    threaded = "threaded"
+    asyncio = "asyncio"
+
+
+class BatchControlMode:
+    latency = "latency"
+    throughput = "throughput"
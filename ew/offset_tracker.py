@@ -0,0 +1,99 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("OffsetTracker", )
+
+import util
+import confluent_kafka
+import threading
+import typing
+
+
+class OffsetTracker:
+    """
+    Wraps the data consumer and records the next offset of every consumed partition, so offsets can be
+    stored per batch even if further batches have already been consumed. Also counts consumed messages and the
+    bytes of their values.
+    """
+    def __init__(self, kafka_consumer: confluent_kafka.Consumer):
+        self.__consumer = kafka_consumer
+        self.__offsets = dict()
+        self.__lock = threading.Lock()
+        self.messages = 0
+        self.bytes = 0
+
+    def __getattr__(self, item):
+        return getattr(self.__consumer, item)
+
+    def __track(self, msg_obj):
+        if msg_obj is not None and not msg_obj.error():
+            self.__offsets[(msg_obj.topic(), msg_obj.partition())] = msg_obj.offset() + 1
+            self.messages += 1
+            if msg_obj.value() is not None:
+                self.bytes += len(msg_obj.value())
+
+    def poll(self, *args, **kwargs):
+        msg_obj = self.__consumer.poll(*args, **kwargs)
+        with self.__lock:
+            self.__track(msg_obj)
+        return msg_obj
+
+    def consume(self, *args, **kwargs):
+        msg_objs = self.__consumer.consume(*args, **kwargs)
+        with self.__lock:
+            for msg_obj in msg_objs:
+                self.__track(msg_obj)
+        return msg_objs
+
+    def pop_offsets(self) -> typing.List[confluent_kafka.TopicPartition]:
+        with self.__lock:
+            offsets = [confluent_kafka.TopicPartition(topic, partition, offset) for (topic, partition), offset in self.__offsets.items()]
+            self.__offsets.clear()
+        return offsets
+
+    def pause_assignment(self) -> typing.List[confluent_kafka.TopicPartition]:
+        partitions = self.__consumer.assignment()
+        if partitions:
+            self.__consumer.pause(partitions)
+        return partitions
+
+    def resume(self, partitions: typing.List[confluent_kafka.TopicPartition]):
+        try:
+            self.__consumer.resume(partitions)
+        except confluent_kafka.KafkaException:
+            # partitions may have been revoked meanwhile
+            pass
+
+    def store_offsets(self, offsets: typing.List[confluent_kafka.TopicPartition]):
+        """
+        Offsets of partitions that have been revoked by a rebalance while their batch was pending are dropped,
+        the new owner of a partition continues from the last stored offset.
+        """
+        if not offsets:
+            return
+        assignment = {(tp.topic, tp.partition) for tp in self.__consumer.assignment()}
+        revoked = [tp for tp in offsets if (tp.topic, tp.partition) not in assignment]
+        if revoked:
+            offsets = [tp for tp in offsets if (tp.topic, tp.partition) in assignment]
+            util.logger.debug("dropping offsets of revoked partitions", {"partitions": [(tp.topic, tp.partition) for tp in revoked]})
+        if offsets:
+            try:
+                self.__consumer.store_offsets(offsets=offsets)
+            except confluent_kafka.KafkaException as ex:
+                # partitions revoked after the assignment has been checked, other offsets have been stored
+                if not ex.args or not isinstance(ex.args[0], confluent_kafka.KafkaError) or ex.args[0].code() not in (confluent_kafka.KafkaError._STATE, confluent_kafka.KafkaError._UNKNOWN_PARTITION):
+                    raise
+                util.logger.debug("dropping offsets of revoked partitions", {"error": ex.args[0].str()})
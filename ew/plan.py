@@ -0,0 +1,89 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("ConversionPlan", "PlanCache")
+
+from .model import *
+from .converter import *
+from .util import DEFAULT
+import ew_lib
+import typing
+
+
+class ConversionPlan:
+    """
+    Export args resolved once per export: converter callables per column in table order and the table metadata
+    needed to place a row in a batch.
+    """
+    __slots__ = ("export_id", "table_name", "unique_col", "time_format", "columns", "column_names")
+
+    def __init__(self, export_id: str, export_args: typing.Dict, datetime_cache_size: int = 0):
+        self.export_id = export_id
+        self.table_name = export_args[ExportArgs.table_name]
+        self.unique_col = export_args[ExportArgs.time_column] if export_args.get(ExportArgs.time_unique) is True else None
+        self.time_format = export_args.get(ExportArgs.time_format)
+        columns = list()
+        for i in export_args[ExportArgs.table_columns]:
+            func = type_map[i[1]]
+            if func is to_datetime:
+                func = get_datetime_parser(self.time_format, cache_size=datetime_cache_size)
+            columns.append((i[0], func))
+        self.columns = tuple(columns)
+        self.column_names = tuple(i[0] for i in columns)
+
+    def gen_row(self, data: typing.Dict) -> typing.Tuple[typing.Tuple, typing.Tuple]:
+        time_format = self.time_format
+        row_cols = list()
+        row_data = list()
+        for name, func in self.columns:
+            if name in data:
+                row_cols.append(name)
+                row_data.append(func(data[name], time_format))
+        return tuple(row_cols), tuple(row_data)
+
+    def gen_full_row(self, data: typing.Dict) -> typing.Tuple[typing.Tuple, typing.Tuple]:
+        # missing columns are set to DEFAULT, so all rows of an export share one column set
+        time_format = self.time_format
+        return self.column_names, tuple(func(data[name], time_format) if name in data else DEFAULT for name, func in self.columns)
+
+
+class PlanCache:
+    """
+    Plans are stored with the generation of their export at build time. Invalidations bump the generation, so a plan
+    built from args that were replaced meanwhile is rebuilt on its next use instead of being served until the next
+    invalidation.
+    """
+    def __init__(self, filter_client: ew_lib.FilterClient, datetime_cache_size: int = 0):
+        self.__filter_client = filter_client
+        self.__datetime_cache_size = datetime_cache_size
+        self.__plans = dict()
+        self.__generations = dict()
+
+    def get(self, export_id: str) -> ConversionPlan:
+        generation = self.__generations.get(export_id, 0)
+        try:
+            plan_generation, plan = self.__plans[export_id]
+            if plan_generation == generation:
+                return plan
+        except KeyError:
+            pass
+        plan = ConversionPlan(export_id=export_id, export_args=self.__filter_client.handler.get_filter_args(id=export_id), datetime_cache_size=self.__datetime_cache_size)
+        self.__plans[export_id] = (generation, plan)
+        return plan
+
+    def invalidate(self, export_id: str):
+        self.__generations[export_id] = self.__generations.get(export_id, 0) + 1
+        self.__plans.pop(export_id, None)
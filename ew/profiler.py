@@ -0,0 +1,164 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("Profiler", )
+
+from .util import *
+import util
+import cProfile
+import collections
+import itertools
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+
+
+class Profiler:
+    """
+    Profiles a running worker on demand and writes the results to files in path.
+
+    SIGUSR1 starts a profiling session and stops it on the next signal. In 'sampling' mode the stacks of all threads
+    are sampled every sample_interval seconds and written as collapsed stacks, in 'cprofile' mode the main thread,
+    which runs ExportWorker.run, is profiled with cProfile and written in pstats format.
+    SIGUSR2 writes the stacks of all threads and a tracemalloc snapshot. The first SIGUSR2 starts tracemalloc, so
+    snapshots only cover allocations made after it.
+    """
+    def __init__(self, path: str, mode: str = "sampling", sample_interval: float = 0.01, tracemalloc_frames: int = 25):
+        if mode not in ("sampling", "cprofile"):
+            raise ValueError(f"unknown profiling mode '{mode}'")
+        self.__path = path
+        self.__mode = mode
+        self.__sample_interval = sample_interval
+        self.__tracemalloc_frames = tracemalloc_frames
+        self.__lock = threading.Lock()
+        self.__profile = None
+        self.__sampler = None
+        self.__sampler_stop = threading.Event()
+        self.__samples = collections.Counter()
+        self.__file_count = itertools.count()
+        os.makedirs(path, exist_ok=True)
+
+    def _get_file_path(self, kind: str, ext: str):
+        return os.path.join(self.__path, f"{kind}-{os.getpid()}-{time.strftime('%Y%m%dT%H%M%S')}-{next(self.__file_count)}.{ext}")
+
+    def _sample(self):
+        own_ident = threading.get_ident()
+        while not self.__sampler_stop.wait(self.__sample_interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = list()
+                while frame:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stack.reverse()
+                self.__samples[";".join(stack)] += 1
+
+    def start_profile(self):
+        with self.__lock:
+            if self.__profile or self.__sampler:
+                return
+            if self.__mode == "cprofile":
+                self.__profile = cProfile.Profile()
+                self.__profile.enable()
+            else:
+                self.__samples.clear()
+                self.__sampler_stop.clear()
+                self.__sampler = threading.Thread(target=self._sample, name="profiler-sampler", daemon=True)
+                self.__sampler.start()
+        util.logger.info("started profiling", {"mode": self.__mode})
+
+    def stop_profile(self):
+        with self.__lock:
+            if self.__profile:
+                self.__profile.disable()
+                file_path = self._get_file_path("profile", "prof")
+                self.__profile.dump_stats(file_path)
+                self.__profile = None
+            elif self.__sampler:
+                self.__sampler_stop.set()
+                self.__sampler.join()
+                self.__sampler = None
+                file_path = self._get_file_path("samples", "txt")
+                with open(file_path, "w") as file:
+                    for stack, count in self.__samples.most_common():
+                        file.write(f"{stack} {count}\n")
+            else:
+                return
+        util.logger.info("stopped profiling", {"mode": self.__mode, "file": file_path})
+
+    def toggle_profile(self):
+        if self.__profile or self.__sampler:
+            self.stop_profile()
+        else:
+            self.start_profile()
+
+    def dump_stacks(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        file_path = self._get_file_path("stacks", "txt")
+        with open(file_path, "w") as file:
+            for ident, frame in sys._current_frames().items():
+                file.write(f"thread {names.get(ident, '')} ({ident}):\n")
+                file.writelines(traceback.format_stack(frame))
+                file.write("\n")
+        util.logger.info("dumped thread stacks", {"threads": len(names), "file": file_path})
+
+    def snapshot_memory(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.__tracemalloc_frames)
+            util.logger.info("started tracemalloc", {"frames": self.__tracemalloc_frames})
+            return
+        file_path = self._get_file_path("tracemalloc", "snapshot")
+        snapshot = tracemalloc.take_snapshot()
+        snapshot.dump(file_path)
+        current, peak = tracemalloc.get_traced_memory()
+        top = [str(stat) for stat in snapshot.statistics("lineno")[:5]]
+        util.logger.info("dumped tracemalloc snapshot", {"file": file_path, "current_bytes": current, "peak_bytes": peak, "top": top})
+
+    def _call(self, func):
+        try:
+            func()
+        except Exception as ex:
+            util.logger.error("profiling", {"error": get_exception_str(ex)})
+
+    def _call_async(self, func):
+        threading.Thread(target=self._call, args=(func, ), name="profiler", daemon=True).start()
+
+    def _handle_usr1(self, *_):
+        if self.__mode == "cprofile":
+            # cProfile profiles the thread it is enabled in, signal handlers run in the main thread
+            self._call(self.toggle_profile)
+        else:
+            self._call_async(self.toggle_profile)
+
+    def _handle_usr2(self, *_):
+        # stacks are taken in the handler, so the main thread shows where it has been interrupted
+        self._call(self.dump_stacks)
+        self._call_async(self.snapshot_memory)
+
+    def install(self):
+        """
+        Registers the SIGUSR1 and SIGUSR2 handlers, must be called from the main thread.
+        """
+        signal.signal(signal.SIGUSR1, self._handle_usr1)
+        signal.signal(signal.SIGUSR2, self._handle_usr2)
+        util.logger.info("installed profiling signal handlers", {"path": self.__path, "mode": self.__mode})
@@ -0,0 +1,323 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("Spool", "SpoolFullError")
+
+from .util import *
+import util
+import datetime
+import os
+import struct
+import threading
+import time
+import typing
+import zlib
+
+
+_header = struct.Struct("<II")
+_segment_suffix = ".seg"
+_version = 1
+_u8 = struct.Struct("<B")
+_u32 = struct.Struct("<I")
+_i64 = struct.Struct("<q")
+_f64 = struct.Struct("<d")
+_datetime = struct.Struct("<qq")
+_epoch = datetime.datetime(1970, 1, 1)
+_microsecond = datetime.timedelta(microseconds=1)
+_i64_range = range(-2 ** 63, 2 ** 63)
+
+# returned for records that are skipped
+_skip = object()
+
+# value types
+_none, _default, _false, _true, _int, _big_int, _float, _str, _naive_datetime, _datetime_tz = range(10)
+
+
+def _encode_str(buffer: bytearray, val: typing.Optional[str]):
+    if val is None:
+        buffer += _u32.pack(0xFFFFFFFF)
+    else:
+        data = val.encode()
+        buffer += _u32.pack(len(data))
+        buffer += data
+
+
+def _encode_value(buffer: bytearray, val):
+    if val is None:
+        buffer += _u8.pack(_none)
+    elif val is DEFAULT:
+        buffer += _u8.pack(_default)
+    elif val is True or val is False:
+        buffer += _u8.pack(_true if val else _false)
+    elif isinstance(val, int):
+        if val in _i64_range:
+            buffer += _u8.pack(_int)
+            buffer += _i64.pack(val)
+        else:
+            buffer += _u8.pack(_big_int)
+            _encode_str(buffer, str(val))
+    elif isinstance(val, float):
+        buffer += _u8.pack(_float)
+        buffer += _f64.pack(val)
+    elif isinstance(val, str):
+        buffer += _u8.pack(_str)
+        _encode_str(buffer, val)
+    elif isinstance(val, datetime.datetime):
+        # wall time and UTC offset, so values are restored as converted
+        offset = val.utcoffset()
+        buffer += _u8.pack(_naive_datetime if offset is None else _datetime_tz)
+        buffer += _datetime.pack((val.replace(tzinfo=None) - _epoch) // _microsecond, offset // _microsecond if offset is not None else 0)
+    else:
+        raise TypeError(f"can't spool value of type '{type(val).__name__}'")
+
+
+def encode_batch(rows_batch: typing.Dict) -> bytes:
+    """
+    Encodes a rows batch with typed fields: table name, export ID, unique column and column sets with their rows.
+    Values can be None, DEFAULT, bool, int, float, str or datetime.
+    """
+    buffer = bytearray(_u8.pack(_version))
+    items = list(rows_batch.items())
+    buffer += _u32.pack(len(items))
+    for table_name, (export_id, unique_col, batches) in items:
+        _encode_str(buffer, table_name)
+        _encode_str(buffer, export_id)
+        _encode_str(buffer, unique_col)
+        buffer += _u32.pack(len(batches))
+        for columns, rows in batches:
+            buffer += _u32.pack(len(columns))
+            for column in columns:
+                _encode_str(buffer, column)
+            buffer += _u32.pack(len(rows))
+            for row in rows:
+                for val in row:
+                    _encode_value(buffer, val)
+    return bytes(buffer)
+
+
+class _Decoder:
+    __slots__ = ("data", "pos")
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def unpack(self, fmt: struct.Struct):
+        vals = fmt.unpack_from(self.data, self.pos)
+        self.pos += fmt.size
+        return vals
+
+    def str(self) -> typing.Optional[str]:
+        length = self.unpack(_u32)[0]
+        if length == 0xFFFFFFFF:
+            return None
+        self.pos += length
+        return self.data[self.pos - length:self.pos].decode()
+
+    def value(self):
+        kind = self.unpack(_u8)[0]
+        if kind == _none:
+            return None
+        if kind == _default:
+            return DEFAULT
+        if kind == _false:
+            return False
+        if kind == _true:
+            return True
+        if kind == _int:
+            return self.unpack(_i64)[0]
+        if kind == _big_int:
+            return int(self.str())
+        if kind == _float:
+            return self.unpack(_f64)[0]
+        if kind == _str:
+            return self.str()
+        if kind in (_naive_datetime, _datetime_tz):
+            wall_time, offset = self.unpack(_datetime)
+            val = _epoch + wall_time * _microsecond
+            return val.replace(tzinfo=datetime.timezone(offset * _microsecond)) if kind == _datetime_tz else val
+        raise ValueError(f"unknown value type {kind}")
+
+
+def decode_batch(payload: bytes) -> typing.Dict:
+    decoder = _Decoder(payload)
+    version = decoder.unpack(_u8)[0]
+    if version != _version:
+        raise ValueError(f"unknown spool record version {version}")
+    rows_batch = dict()
+    for _ in range(decoder.unpack(_u32)[0]):
+        table_name, export_id, unique_col = decoder.str(), decoder.str(), decoder.str()
+        batches = list()
+        for _ in range(decoder.unpack(_u32)[0]):
+            columns = tuple(decoder.str() for _ in range(decoder.unpack(_u32)[0]))
+            batches.append((columns, [tuple(decoder.value() for _ in columns) for _ in range(decoder.unpack(_u32)[0])]))
+        rows_batch[table_name] = (export_id, unique_col, batches)
+    return rows_batch
+
+
+class SpoolFullError(Exception):
+    def __init__(self, size, max_size):
+        super().__init__(f"spool size of {size} bytes exceeds {max_size} bytes")
+
+
+class Spool:
+    """
+    Bounded on-disk queue of rows batches. Batches are appended to segment files in the order they are spooled and
+    read back in the same order. A record consists of the payload length, a crc32 checksum and the encoded batch.
+    Segments are rotated once they exceed segment_size and removed once they have been drained. Records of an
+    interrupted append are cut off at the end of a segment and discarded, corrupt records are skipped. Appends are
+    fsynced together at most every sync_interval seconds, callers must not rely on a batch being on disk before
+    append or sync returned True.
+    """
+    def __init__(self, path: str, max_size: int = 1024 ** 3, segment_size: int = 64 * 1024 ** 2, sync_interval: float = 1.0):
+        self.__path = path
+        self.__max_size = max_size
+        self.__segment_size = segment_size
+        self.__sync_interval = sync_interval
+        self.__synced = time.monotonic()
+        self.__unsynced = False
+        self.__lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.__segments = sorted(int(name[:-len(_segment_suffix)]) for name in os.listdir(path) if name.endswith(_segment_suffix))
+        self.__size = sum(os.path.getsize(self._get_segment_path(seq)) for seq in self.__segments)
+        self.__write_file = None
+        self.__read_file = None
+        self.__read_seq = None
+        self.__read_next = None
+        if self.__segments:
+            util.logger.info("found spooled batches", {"path": path, "segments": len(self.__segments), "bytes": self.__size})
+
+    def _get_segment_path(self, seq: int):
+        return os.path.join(self.__path, f"{seq:012d}{_segment_suffix}")
+
+    def _open_write_segment(self):
+        seq = self.__segments[-1] + 1 if self.__segments else 0
+        self.__write_file = open(self._get_segment_path(seq), "ab")
+        self.__segments.append(seq)
+
+    def _close_read_segment(self, remove: bool):
+        self.__read_file.close()
+        if remove:
+            os.remove(self._get_segment_path(self.__read_seq))
+            self.__segments.remove(self.__read_seq)
+        self.__read_file = None
+        self.__read_seq = None
+
+    def _read_record(self):
+        """
+        Returns the next batch of the read segment, None at the end of the segment or _skip for a corrupt record.
+        A record cut off by an interrupted append can only be at the end of a segment.
+        """
+        start = self.__read_file.tell()
+        header = self.__read_file.read(_header.size)
+        if not header:
+            return None
+        payload = b""
+        if len(header) == _header.size:
+            length, checksum = _header.unpack(header)
+            payload = self.__read_file.read(length)
+        if len(header) < _header.size or len(payload) < length:
+            util.logger.error("discarding torn spool record", {"segment": self.__read_seq, "bytes": self.__read_file.tell() - start})
+            return None
+        if zlib.crc32(payload) != checksum:
+            util.logger.error("discarding corrupt spool record", {"segment": self.__read_seq, "bytes": self.__read_file.tell() - start})
+            return _skip
+        try:
+            return decode_batch(payload)
+        except Exception as ex:
+            util.logger.error("discarding undecodable spool record", {"segment": self.__read_seq, "bytes": self.__read_file.tell() - start, "error": get_exception_str(ex)})
+            return _skip
+
+    def _sync(self, force: bool) -> bool:
+        if self.__unsynced and (force or time.monotonic() - self.__synced >= self.__sync_interval):
+            os.fsync(self.__write_file.fileno())
+            self.__synced = time.monotonic()
+            self.__unsynced = False
+        return not self.__unsynced
+
+    def _close_write_segment(self):
+        self._sync(force=True)
+        self.__write_file.close()
+        self.__write_file = None
+
+    def append(self, rows_batch: typing.Dict) -> bool:
+        """
+        Appends a batch. Returns True if it has been written to disk together with all previous batches.
+        """
+        payload = encode_batch(rows_batch)
+        with self.__lock:
+            if self.__size + len(payload) + _header.size > self.__max_size:
+                raise SpoolFullError(self.__size + len(payload) + _header.size, self.__max_size)
+            if not self.__write_file or self.__write_file.tell() >= self.__segment_size:
+                if self.__write_file:
+                    self._close_write_segment()
+                self._open_write_segment()
+            self.__write_file.write(_header.pack(len(payload), zlib.crc32(payload)))
+            self.__write_file.write(payload)
+            self.__write_file.flush()
+            self.__unsynced = True
+            self.__size += len(payload) + _header.size
+            return self._sync(force=False)
+
+    def sync(self, force: bool = False) -> bool:
+        """
+        Writes appended batches to disk if sync_interval has passed or force is set. Returns True if all batches
+        are on disk.
+        """
+        with self.__lock:
+            return self._sync(force=force)
+
+    def peek(self) -> typing.Optional[typing.Dict]:
+        """
+        Returns the oldest batch without removing it or None if the spool is empty.
+        """
+        with self.__lock:
+            while self.__read_next is None and self.__segments:
+                if not self.__read_file:
+                    self.__read_seq = self.__segments[0]
+                    self.__read_file = open(self._get_segment_path(self.__read_seq), "rb")
+                record = self._read_record()
+                if record is _skip:
+                    continue
+                self.__read_next = record
+                if self.__read_next is None:
+                    if self.__write_file and self.__segments[-1] == self.__read_seq:
+                        # the segment is still written to, the next segment is started by the next append
+                        self._close_write_segment()
+                    self._close_read_segment(remove=True)
+                    self.__size = sum(os.path.getsize(self._get_segment_path(seq)) for seq in self.__segments)
+            return self.__read_next
+
+    def pop(self):
+        """
+        Removes the batch returned by the last peek.
+        """
+        with self.__lock:
+            self.__read_next = None
+
+    def is_empty(self) -> bool:
+        with self.__lock:
+            return not self.__segments and self.__read_next is None
+
+    def get_size(self) -> int:
+        return self.__size
+
+    def close(self):
+        with self.__lock:
+            if self.__write_file:
+                self._close_write_segment()
+            if self.__read_file:
+                self._close_read_segment(remove=False)
@@ -0,0 +1,135 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("TableCatalog", "TableInfo")
+
+from .model import *
+from .util import normalize_orderby
+import threading
+import typing
+
+
+settings_keys = (
+    ExportArgs.chunk_time_interval,
+    ExportArgs.partition_column,
+    ExportArgs.partition_count,
+    ExportArgs.compress_segmentby,
+    ExportArgs.compress_orderby,
+    ExportArgs.compress_after,
+    ExportArgs.drop_after,
+    ExportArgs.aggregates
+)
+
+
+def _gen_settings(row) -> typing.Optional[typing.Dict]:
+    if len(row) <= 3 or not row[1]:
+        return None
+    settings = dict(zip(settings_keys, row[3:]))
+    settings[ExportArgs.compress_segmentby] = tuple(settings[ExportArgs.compress_segmentby]) if settings[ExportArgs.compress_segmentby] else None
+    settings[ExportArgs.compress_orderby] = normalize_orderby(settings[ExportArgs.compress_orderby])
+    # continuous aggregates are identified by view name
+    settings[ExportArgs.aggregates] = frozenset(settings[ExportArgs.aggregates] or ())
+    return settings
+
+
+class TableInfo:
+    __slots__ = ("name", "hypertable", "columns", "options", "settings", "version")
+
+    def __init__(self, name: str, hypertable: bool, columns: typing.Tuple[str, ...], options: typing.Optional[typing.Dict] = None, settings: typing.Optional[typing.Dict] = None, version: int = 0):
+        self.name = name
+        self.hypertable = hypertable
+        self.columns = columns
+        # hypertable options applied by the table manager, None if unknown
+        self.options = options
+        # hypertable settings read from the database, None if not loaded or outdated by applied options
+        self.settings = settings
+        # catalog version of the last change by this process
+        self.version = version
+
+
+class TableCatalog:
+    """
+    In-memory view of the tables in the database, so existence checks do not require a round trip. Every change
+    increments the catalog version, so a load can retain changes made while its query was running.
+    """
+    def __init__(self):
+        self.__tables = dict()
+        self.__removed = dict()
+        self.__version = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        return self.__version
+
+    def _gen_infos(self, rows: typing.Optional[typing.List]):
+        return {row[0]: TableInfo(name=row[0], hypertable=bool(row[1]), columns=tuple(row[2] or ()), settings=_gen_settings(row)) for row in rows or ()}
+
+    def load(self, rows: typing.Optional[typing.List], version: typing.Optional[int] = None):
+        """
+        Replaces the catalog with rows of (table name, is hypertable, column names, hypertable settings, ...) as
+        selected by gen_select_table_catalog_stmt. Applied options of tables that
+        are still present are retained. Tables added or removed after version, the catalog version read before the
+        rows were queried, are kept as they are.
+        """
+        tables = self._gen_infos(rows)
+        with self.__lock:
+            if version is None:
+                version = self.__version
+            for name, info in self.__tables.items():
+                if info.version > version:
+                    tables[name] = info
+                elif name in tables:
+                    tables[name].options = info.options
+            for name, removed in self.__removed.items():
+                if removed > version:
+                    tables.pop(name, None)
+            self.__tables = tables
+            self.__removed.clear()
+
+    def merge(self, rows: typing.Optional[typing.List]):
+        """
+        Adds or updates the tables of rows without removing other tables. Applied options are retained.
+        """
+        with self.__lock:
+            self.__version += 1
+            for name, info in self._gen_infos(rows).items():
+                if name in self.__tables:
+                    info.options = self.__tables[name].options
+                info.version = self.__version
+                self.__tables[name] = info
+                self.__removed.pop(name, None)
+
+    def add(self, name: str, hypertable: bool, columns: typing.Iterable[str], options: typing.Optional[typing.Dict] = None):
+        with self.__lock:
+            self.__version += 1
+            self.__tables[name] = TableInfo(name=name, hypertable=hypertable, columns=tuple(columns), options=options, version=self.__version)
+            self.__removed.pop(name, None)
+
+    def remove(self, name: str):
+        with self.__lock:
+            self.__version += 1
+            self.__tables.pop(name, None)
+            self.__removed[name] = self.__version
+
+    def exists(self, name: str) -> bool:
+        return name in self.__tables
+
+    def get(self, name: str) -> typing.Optional[TableInfo]:
+        return self.__tables.get(name)
+
+    def __len__(self):
+        return len(self.__tables)
@@ -18,41 +18,93 @@ __all__ = ("TableManager", )
 
 from .util import *
 from .model import *
+from .metrics import *
+from .table_catalog import *
+from .json_codec import *
 import util
 import ew_lib
 import psycopg2
+import psycopg2.errors
 import threading
 import queue
 import confluent_kafka
 import json
+import time
+import zlib
 import mf_lib.exceptions
 
 logger = util.logger.getChild("table_manager")
 logger.propagate = False
 
-class TableManager:
+hypertable_options = (
+    ExportArgs.chunk_time_interval,
+    ExportArgs.partition_column,
+    ExportArgs.partition_count,
+    ExportArgs.compress_segmentby,
+    ExportArgs.compress_orderby,
+    ExportArgs.compress_after,
+    ExportArgs.drop_after,
+    ExportArgs.aggregates
+)
 
-    def __init__(self, db_conn: psycopg2._psycopg.connection, filter_client: ew_lib.FilterClient, kafka_producer: typing.Optional[confluent_kafka.Producer] = None, metrics_topic: typing.Optional[str] = None, distributed_hypertables: bool = False, hypertable_replication_factor: int = 2, timeout: int = 1, retries: int = 2, retry_delay: int = 2):
-        self.__db_conn = db_conn
+class TableManager:
+    """
+    Creates and drops the tables of exports. Statements are executed by DDL workers, each with its own database
+    connection and queue. Exports are assigned to workers by table name, so all statements of a table are executed
+    in order, also for exports that share a table, while independent tables are processed in parallel.
+    """
+    def __init__(self, db_conn: psycopg2._psycopg.connection, filter_client: ew_lib.FilterClient, kafka_producer: typing.Optional[confluent_kafka.Producer] = None, metrics_topic: typing.Optional[str] = None, distributed_hypertables: bool = False, hypertable_replication_factor: int = 2, timeout: int = 1, retries: int = 2, retry_delay: int = 2, catalog_refresh_interval: float = 0, ddl_db_conns: typing.Optional[typing.List[psycopg2._psycopg.connection]] = None, hypertable_defaults: typing.Optional[typing.Dict] = None, aggregate_buckets: typing.Tuple[str, ...] = ("1 minute", "1 hour"), metrics: typing.Optional[Metrics] = None, json_codec: typing.Optional[JSONCodec] = None):
+        self.__metrics = metrics
         self.__filter_client = filter_client
         self.__kafka_producer = kafka_producer
         self.__metrics_topic = metrics_topic
+        self.__json_dumps = json_codec.dumps if json_codec else json.dumps
         self.__distributed_hypertables = distributed_hypertables
         self.__hypertable_replication_factor = hypertable_replication_factor
+        self.__hypertable_defaults = hypertable_defaults or dict()
+        self.__aggregate_buckets = tuple(aggregate_buckets)
+        if not validate_hypertable_args(self.__hypertable_defaults) or not validate_hypertable_args({ExportArgs.aggregates: self.__aggregate_buckets}):
+            raise ValueError(f"invalid hypertable defaults: {self.__hypertable_defaults} {self.__aggregate_buckets}")
         self.__timeout = timeout
         self.__retries = retries
         self.__retry_delay = retry_delay
-        self.__queue = queue.Queue()
+        self.__catalog = TableCatalog()
+        self.__catalog_refresh_interval = catalog_refresh_interval
+        self.__catalog_loaded = 0
+        self.__catalog_event = threading.Event()
+        if metrics:
+            metrics.add_gauge("ew_catalog_tables", "Tables in the table catalog of the table manager.", lambda: len(self.__catalog))
+        self.__queues = list()
+        self.__threads = list()
+        for num, conn in enumerate([db_conn] + list(ddl_db_conns or ())):
+            self.__queues.append(queue.Queue())
+            self.__threads.append(threading.Thread(target=self._run, name=f"ddl-worker-{num}", args=(num, conn, self.__queues[-1]), daemon=True))
         self.__sleeper = threading.Event()
-        self.__thread = threading.Thread(target=self._run, daemon=True)
         self.__stop = False
 
-    def _run(self):
+    def _run(self, num, db_conn, _queue: queue.Queue):
+        try:
+            if num == 0:
+                self._load_catalog(db_conn=db_conn)
+                self.__catalog_event.set()
+            else:
+                while not self.__catalog_event.wait(self.__timeout) and not self.__stop:
+                    pass
+        except TableManagerError as ex:
+            logger.critical(ex.msg, ex.kwargs)
+            self.__stop = True
         while not self.__stop:
+            if num == 0 and self.__catalog_refresh_interval and time.monotonic() - self.__catalog_loaded >= self.__catalog_refresh_interval:
+                try:
+                    self._load_catalog(db_conn=db_conn)
+                except TableManagerError as ex:
+                    logger.critical(ex.msg, ex.kwargs)
+                    self.__stop = True
+                    break
             try:
-                func, args = self.__queue.get(timeout=self.__timeout)
+                func, args = _queue.get(timeout=self.__timeout)
                 try:
-                    func(**args)
+                    func(db_conn=db_conn, **args)
                 except TableManagerError as ex:
                     logger.critical(ex.msg, ex.kwargs)
                     self.__stop = True
@@ -64,102 +116,255 @@ class TableManager:
         if self.__kafka_producer:
             self.__kafka_producer.flush()
 
-    def _execute_stmt(self, stmt: str, commit=False, retry=0):
+    def _execute_stmt(self, db_conn, stmt: str, commit=False, retry=0, raise_errors: typing.Tuple = ()):
+        """
+        Retries after errors with a reset connection. Errors in raise_errors are expected by the caller and raised
+        after a rollback without retrying.
+        """
         logger.debug("executing statement", {"statement": stmt, "retries": self.__retries - retry})
         try:
+            start = time.perf_counter() if self.__metrics else 0
             rows = None
-            with self.__db_conn.cursor() as cursor:
+            with db_conn.cursor() as cursor:
                 cursor.execute(query=stmt)
                 if cursor.rowcount > 0:
                     rows = cursor.fetchall()
             if commit:
-                self.__db_conn.commit()
+                db_conn.commit()
+            if self.__metrics:
+                self.__metrics.ddl.observe(time.perf_counter() - start)
             return rows
+        except raise_errors:
+            db_conn.rollback()
+            raise
         except (psycopg2.InterfaceError, psycopg2.OperationalError, psycopg2.InternalError, psycopg2.DatabaseError) as ex:
             if retry < self.__retries:
                 logger.warning("executing statement", {"error": get_exception_str(ex), "statement": stmt, "retries": self.__retries - retry})
-                self.__db_conn.reset()
+                db_conn.reset()
                 self.__sleeper.wait(self.__retry_delay)
                 if not self.__stop:
-                    self._execute_stmt(stmt=stmt, commit=commit, retry=retry + 1)
+                    return self._execute_stmt(db_conn=db_conn, stmt=stmt, commit=commit, retry=retry + 1, raise_errors=raise_errors)
             else:
                 raise
 
-    def _create_table(self, export_id):
+    def _get_queue(self, table_name) -> queue.Queue:
+        return self.__queues[zlib.crc32(table_name.encode()) % len(self.__queues)]
+
+    def _get_hypertable_options(self, export_args) -> typing.Dict:
+        options = {key: export_args[key] if export_args.get(key) is not None else self.__hypertable_defaults.get(key) for key in hypertable_options}
+        aggregates = options[ExportArgs.aggregates]
+        if aggregates is True:
+            aggregates = self.__aggregate_buckets
+        elif isinstance(aggregates, str):
+            aggregates = (aggregates, )
+        # continuous aggregates require numeric columns
+        if not aggregates or not any(i[1] in numeric_types and i[0] != export_args[ExportArgs.time_column] for i in export_args[ExportArgs.table_columns]):
+            aggregates = None
+        options[ExportArgs.aggregates] = tuple(aggregates) if aggregates else None
+        return options
+
+    def _gen_aggregate_stmts(self, name, export_args, buckets):
+        return [gen_create_aggregate_stmt(name=name, bucket=bucket, time_column=export_args[ExportArgs.time_column], columns=export_args[ExportArgs.table_columns]) for bucket in buckets]
+
+    def _gen_compression_stmts(self, name, options):
+        if not options[ExportArgs.compress_after]:
+            return [gen_remove_compression_policy_stmt(name=name)]
+        return [
+            gen_set_compression_stmt(name=name, segmentby=options[ExportArgs.compress_segmentby], orderby=options[ExportArgs.compress_orderby]),
+            gen_remove_compression_policy_stmt(name=name),
+            gen_add_compression_policy_stmt(name=name, compress_after=options[ExportArgs.compress_after])
+        ]
+
+    def _gen_retention_stmts(self, name, options):
+        stmts = [gen_remove_retention_policy_stmt(name=name)]
+        if options[ExportArgs.drop_after]:
+            stmts.append(gen_add_retention_policy_stmt(name=name, drop_after=options[ExportArgs.drop_after]))
+        return stmts
+
+    def _get_changed_options(self, db_conn, info: TableInfo, options: typing.Dict) -> typing.Set[str]:
+        """
+        Returns the options that differ from the hypertable. Set options are compared with the settings read from
+        the database if available, otherwise with the options applied by this process. Unset options are only
+        reverted if this process has applied them.
+        """
+        applied = info.options or {key: None for key in hypertable_options}
+        if info.settings is None:
+            return {key for key in hypertable_options if options[key] != applied[key]}
+        desired = dict(options)
+        interval_keys = [key for key in (ExportArgs.chunk_time_interval, ExportArgs.compress_after, ExportArgs.drop_after) if options[key]]
+        if interval_keys:
+            # intervals are normalized by the database
+            desired.update(zip(interval_keys, self._execute_stmt(db_conn=db_conn, stmt=gen_select_intervals_stmt(options[key] for key in interval_keys), commit=True)[0]))
+        segmentby = options[ExportArgs.compress_segmentby]
+        desired[ExportArgs.compress_segmentby] = tuple([segmentby] if isinstance(segmentby, str) else segmentby) if segmentby else None
+        desired[ExportArgs.compress_orderby] = normalize_orderby(options[ExportArgs.compress_orderby])
+        desired[ExportArgs.aggregates] = frozenset(gen_aggregate_name(name=info.name, bucket=bucket) for bucket in options[ExportArgs.aggregates] or ())
+        changed = set()
+        for key in hypertable_options:
+            if desired[key]:
+                if desired[key] != info.settings[key] and not (key == ExportArgs.aggregates and desired[key] <= info.settings[key]):
+                    changed.add(key)
+            elif applied[key]:
+                changed.add(key)
+        return changed
+
+    def _reconcile_hypertable(self, db_conn, export_id, export_args, info: TableInfo, options: typing.Dict):
+        changed = self._get_changed_options(db_conn=db_conn, info=info, options=options)
+        prev_options = info.options or {key: None for key in hypertable_options}
+        groups = list()
+        if options[ExportArgs.chunk_time_interval] and ExportArgs.chunk_time_interval in changed:
+            groups.append([gen_set_chunk_time_interval_stmt(name=info.name, chunk_time_interval=options[ExportArgs.chunk_time_interval])])
+        if changed.intersection((ExportArgs.compress_segmentby, ExportArgs.compress_orderby, ExportArgs.compress_after)):
+            if options[ExportArgs.compress_after] or info.options:
+                groups.append(self._gen_compression_stmts(name=info.name, options=options))
+        if ExportArgs.drop_after in changed:
+            if options[ExportArgs.drop_after] or info.options:
+                groups.append(self._gen_retention_stmts(name=info.name, options=options))
+        if ExportArgs.aggregates in changed:
+            buckets = options[ExportArgs.aggregates] or ()
+            prev_buckets = prev_options[ExportArgs.aggregates] or ()
+            if info.settings is not None:
+                # buckets of existing views are not created again
+                prev_buckets = tuple(bucket for bucket in buckets if gen_aggregate_name(name=info.name, bucket=bucket) in info.settings[ExportArgs.aggregates]) + tuple(prev_buckets)
+            stmts = [gen_drop_aggregate_stmt(name=info.name, bucket=bucket) for bucket in prev_buckets if bucket not in buckets]
+            stmts += self._gen_aggregate_stmts(name=info.name, export_args=export_args, buckets=(bucket for bucket in buckets if bucket not in prev_buckets))
+            if stmts:
+                groups.append(stmts)
+        if (info.options or info.settings is not None) and changed.intersection((ExportArgs.partition_column, ExportArgs.partition_count)):
+            logger.warning("space partitioning of existing tables can't be changed", {"export_id": export_id, "table": info.name})
+        for stmts in groups:
+            try:
+                # errors other than connection errors are expected and not retried
+                self._execute_stmt(db_conn=db_conn, stmt=" ".join(stmts), commit=True, raise_errors=(psycopg2.ProgrammingError, psycopg2.NotSupportedError, psycopg2.DataError, psycopg2.IntegrityError))
+            except (psycopg2.InterfaceError, psycopg2.OperationalError):
+                raise
+            except psycopg2.DatabaseError as ex:
+                # e.g. compression settings of tables with compressed chunks can't be altered
+                db_conn.rollback()
+                logger.error("reconciling hypertable", {"error": get_exception_str(ex), "export_id": export_id, "table": info.name})
+        info.options = options
+        if groups:
+            info.settings = None
+
+    def _create_table(self, db_conn, export_id, export_args):
         try:
-            export_args = self.__filter_client.handler.get_filter_args(id=export_id)
-            if not self._table_exists(name=export_args[ExportArgs.table_name]):
-                if self.__kafka_producer:
-                    self._publish_metric("put", [export_args[ExportArgs.table_name]])
-                self._execute_stmt(
-                    stmt=gen_create_table_stmt(
-                        name=export_args[ExportArgs.table_name],
-                        columns=export_args[ExportArgs.table_columns],
-                        unique_col=export_args[ExportArgs.time_column] if export_args.get(ExportArgs.time_unique) is True else None,
-                    ),
-                    commit=True
+            options = self._get_hypertable_options(export_args)
+            info = self.__catalog.get(export_args[ExportArgs.table_name])
+            if info:
+                if info.hypertable and options != info.options:
+                    self._reconcile_hypertable(db_conn=db_conn, export_id=export_id, export_args=export_args, info=info, options=options)
+                return
+            if self.__kafka_producer:
+                self._publish_metric("put", [export_args[ExportArgs.table_name]])
+            stmts = [
+                gen_create_table_stmt(
+                    name=export_args[ExportArgs.table_name],
+                    columns=export_args[ExportArgs.table_columns],
+                    unique_col=export_args[ExportArgs.time_column] if export_args.get(ExportArgs.time_unique) is True else None,
+                ),
+                gen_create_hypertable_stmt(
+                    name=export_args[ExportArgs.table_name],
+                    time_column=export_args[ExportArgs.time_column],
+                    is_distributed=self.__distributed_hypertables,
+                    chunk_time_interval=options[ExportArgs.chunk_time_interval],
+                    partition_column=options[ExportArgs.partition_column],
+                    partition_count=options[ExportArgs.partition_count]
                 )
-                self._execute_stmt(
-                    stmt=gen_create_hypertable_stmt(
+            ]
+            if self.__distributed_hypertables:
+                stmts.append(
+                    gen_set_replication_factor_stmt(
                         name=export_args[ExportArgs.table_name],
-                        time_column=export_args[ExportArgs.time_column],
-                        is_distributed=self.__distributed_hypertables
-                    ),
-                    commit=True
-                )
-                if self.__distributed_hypertables:
-                    self._execute_stmt(
-                        stmt=gen_set_replication_factor_stmt(
-                            name=export_args[ExportArgs.table_name],
-                            factor=self.__hypertable_replication_factor
-                        ),
-                        commit=True
+                        factor=self.__hypertable_replication_factor
                     )
-        except mf_lib.exceptions.UnknownFilterIDError:
-            pass
+                )
+            if options[ExportArgs.compress_after]:
+                stmts += self._gen_compression_stmts(name=export_args[ExportArgs.table_name], options=options)
+            if options[ExportArgs.drop_after]:
+                stmts.append(gen_add_retention_policy_stmt(name=export_args[ExportArgs.table_name], drop_after=options[ExportArgs.drop_after]))
+            if options[ExportArgs.aggregates]:
+                stmts += self._gen_aggregate_stmts(name=export_args[ExportArgs.table_name], export_args=export_args, buckets=options[ExportArgs.aggregates])
+            try:
+                # executed as one transaction in a single round trip
+                self._execute_stmt(db_conn=db_conn, stmt=" ".join(stmts), commit=True, raise_errors=(psycopg2.errors.DuplicateTable, ))
+            except psycopg2.errors.DuplicateTable:
+                # created by another instance after the catalog has been loaded
+                logger.info("table already exists", {"export_id": export_id, "table": export_args[ExportArgs.table_name]})
+                self.__catalog.merge(self._execute_stmt(db_conn=db_conn, stmt=gen_select_table_catalog_stmt(name=export_args[ExportArgs.table_name]), commit=True))
+                info = self.__catalog.get(export_args[ExportArgs.table_name])
+                if info and info.hypertable and options != info.options:
+                    self._reconcile_hypertable(db_conn=db_conn, export_id=export_id, export_args=export_args, info=info, options=options)
+                return
+            self.__catalog.add(
+                name=export_args[ExportArgs.table_name],
+                hypertable=True,
+                columns=(i[0] for i in export_args[ExportArgs.table_columns]),
+                options=options
+            )
         except Exception as ex:
             raise CreateTableError(export_id, ex)
 
-    def _drop_table(self, export_id, export_args):
+    def _drop_table(self, db_conn, export_id, export_args):
         try:
             if self.__kafka_producer:
                 self._publish_metric("delete", [export_args[ExportArgs.table_name]])
+            buckets = set(self._get_hypertable_options(export_args)[ExportArgs.aggregates] or ())
+            info = self.__catalog.get(export_args[ExportArgs.table_name])
+            if info and info.options:
+                buckets.update(info.options[ExportArgs.aggregates] or ())
+            stmts = [gen_drop_aggregate_stmt(name=export_args[ExportArgs.table_name], bucket=bucket) for bucket in sorted(buckets)]
+            stmts.append(gen_drop_table_stmt(name=export_args[ExportArgs.table_name]))
             self._execute_stmt(
-                stmt=gen_drop_table_stmt(name=export_args[ExportArgs.table_name]),
+                db_conn=db_conn,
+                stmt=" ".join(stmts),
                 commit=True
             )
+            self.__catalog.remove(name=export_args[ExportArgs.table_name])
         except mf_lib.exceptions.UnknownFilterIDError:
             pass
         except Exception as ex:
             raise DropTableError(export_id, ex)
 
-    def _table_exists(self, name):
-        return all(self._execute_stmt(gen_select_exists_table_stmt(name))[0])
+    def _load_catalog(self, db_conn):
+        try:
+            version = self.__catalog.version
+            self.__catalog.load(self._execute_stmt(db_conn=db_conn, stmt=gen_select_table_catalog_stmt(), commit=True), version=version)
+            self.__catalog_loaded = time.monotonic()
+            logger.debug("loaded table catalog", {"tables": len(self.__catalog)})
+        except Exception as ex:
+            raise LoadCatalogError(ex)
 
     def _publish_metric(self, method: str, tables: typing.List[str]):
         try:
-            self.__kafka_producer.produce(topic=self.__metrics_topic, value=json.dumps({"method": method, "tables": tables}))
+            self.__kafka_producer.produce(topic=self.__metrics_topic, value=self.__json_dumps({"method": method, "tables": tables}))
         except Exception as ex:
             logger.warning("publishing metric", {"error": get_exception_str(ex), "method": method, "tables": tables})
 
     def create_table(self, export_id):
-        self.__queue.put((self._create_table, {"export_id": export_id}))
+        try:
+            export_args = self.__filter_client.handler.get_filter_args(id=export_id)
+            self._get_queue(export_args[ExportArgs.table_name]).put((self._create_table, {"export_id": export_id, "export_args": export_args}))
+        except mf_lib.exceptions.UnknownFilterIDError:
+            pass
 
     def drop_table(self, export_id):
         try:
-            self.__queue.put((self._drop_table, {"export_id": export_id, "export_args": self.__filter_client.handler.get_filter_args(id=export_id)}))
+            export_args = self.__filter_client.handler.get_filter_args(id=export_id)
+            self._get_queue(export_args[ExportArgs.table_name]).put((self._drop_table, {"export_id": export_id, "export_args": export_args}))
         except mf_lib.exceptions.UnknownFilterIDError:
             pass
 
     def start(self):
-        self.__thread.start()
+        for thread in self.__threads:
+            thread.start()
 
     def stop(self):
         self.__stop = True
         self.__sleeper.set()
 
     def is_alive(self) -> bool:
-        return self.__thread.is_alive()
+        return all(thread.is_alive() for thread in self.__threads)
 
     def join(self):
-        self.__thread.join()
+        for thread in self.__threads:
+            thread.join()
@@ -17,8 +17,13 @@
 from .model import *
 from .converter import *
 import base64
+import datetime
+import hashlib
+import io
+import re
 import traceback
 import typing
+import psycopg2.extensions
 
 
 def get_exception_str(ex):
@@ -33,6 +38,37 @@ class WriteRowsError(Exception):
         self.kwargs = {"error": ex_str, "row_count": row_count, "export_id": export_id}
 
 
+class _Default:
+    """
+    Value of a column missing from a message, the column is written with its DEFAULT.
+    """
+    def __repr__(self):
+        return "DEFAULT"
+
+    def __reduce__(self):
+        return "DEFAULT"
+
+
+DEFAULT = _Default()
+psycopg2.extensions.register_adapter(_Default, lambda _: psycopg2.extensions.AsIs("DEFAULT"))
+
+
+def split_default_rows(columns, rows: typing.List[typing.Tuple]) -> typing.List[typing.Tuple[typing.Tuple, typing.List[typing.Tuple]]]:
+    """
+    Groups rows by their columns without DEFAULT values and omits those columns, for statements and protocols that
+    only take parameters.
+    """
+    if not any(DEFAULT in row for row in rows):
+        return [(columns, rows)]
+    groups = dict()
+    for row in rows:
+        mask = tuple(val is not DEFAULT for val in row)
+        if mask not in groups:
+            groups[mask] = list()
+        groups[mask].append(tuple(val for val in row if val is not DEFAULT))
+    return [(tuple(col for col, keep in zip(columns, mask) if keep), group) for mask, group in groups.items()]
+
+
 class ValidateFilterError(Exception):
     def __init__(self, ex):
         super().__init__(get_exception_str(ex))
@@ -56,6 +92,78 @@ class DropTableError(TableManagerError):
         super().__init__('drop', export_id, ex)
 
 
+class LoadCatalogError(TableManagerError):
+    def __init__(self, ex):
+        super().__init__('load', None, ex)
+        self.msg = "loading table catalog"
+
+
+_interval_units = "microseconds?|us|usecs?|milliseconds?|ms|msecs?|seconds?|secs?|s|minutes?|mins?|m|hours?|hrs?|h|days?|d|weeks?|w|months?|mons?|years?|yrs?|y|decades?|centuries|century|millenniums?|millennia"
+_interval_re = re.compile(r"^\s*(?:[+-]?\d+(?:\.\d+)?\s*(?:{})\s*)*(?:[+-]?\d+:\d{{2}}(?::\d{{2}}(?:\.\d+)?)?\s*)?$".format(_interval_units), re.IGNORECASE)
+_orderby_re = re.compile(r"^\s*(\"(?:[^\"]|\"\")+\"|[^\s\"]+)((?:\s+(?:ASC|DESC))?(?:\s+NULLS\s+(?:FIRST|LAST))?)\s*$", re.IGNORECASE)
+
+
+def is_interval(value) -> bool:
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, (int, float)):
+        return value > 0
+    return isinstance(value, str) and bool(value.strip()) and bool(_interval_re.match(value))
+
+
+def parse_orderby(orderby) -> typing.List[typing.Tuple[str, str]]:
+    """
+    Splits compression order by expressions into column names and modifiers. Raises ValueError for expressions
+    other than a column with an optional sort direction and null ordering.
+    """
+    items = list()
+    for item in (orderby.split(",") if isinstance(orderby, str) else orderby):
+        match = _orderby_re.match(item) if isinstance(item, str) else None
+        if not match:
+            raise ValueError(f"invalid order by expression: {item!r}")
+        col = match.group(1)
+        items.append((col[1:-1].replace("\"\"", "\"") if col.startswith("\"") else col, " ".join(match.group(2).upper().split())))
+    return items
+
+
+def validate_hypertable_args(args: typing.Dict, cols: typing.Optional[typing.List] = None) -> bool:
+    """
+    Checks the hypertable options of export args. Columns are only checked if cols is given.
+    """
+    for key in (ExportArgs.chunk_time_interval, ExportArgs.compress_after, ExportArgs.drop_after):
+        if args.get(key) is not None and not is_interval(args[key]):
+            return False
+    partition_column = args.get(ExportArgs.partition_column)
+    partition_count = args.get(ExportArgs.partition_count)
+    if partition_column is not None:
+        if not isinstance(partition_column, str) or (cols is not None and partition_column not in cols):
+            return False
+        if partition_count is None:
+            return False
+    if partition_count is not None and (isinstance(partition_count, bool) or not isinstance(partition_count, int) or partition_count < 1):
+        return False
+    segmentby = args.get(ExportArgs.compress_segmentby)
+    if segmentby is not None:
+        segmentby = [segmentby] if isinstance(segmentby, str) else segmentby
+        if not isinstance(segmentby, (list, tuple)) or any(not isinstance(i, str) or (cols is not None and i not in cols) for i in segmentby):
+            return False
+    orderby = args.get(ExportArgs.compress_orderby)
+    if orderby is not None:
+        if not isinstance(orderby, (str, list, tuple)):
+            return False
+        try:
+            if any(cols is not None and col not in cols for col, _ in parse_orderby(orderby)):
+                return False
+        except ValueError:
+            return False
+    aggregates = args.get(ExportArgs.aggregates)
+    if aggregates is not None and not isinstance(aggregates, bool):
+        aggregates = [aggregates] if isinstance(aggregates, str) else aggregates
+        if not isinstance(aggregates, (list, tuple)) or not all(isinstance(i, str) and is_interval(i) for i in aggregates):
+            return False
+    return True
+
+
 def validate_filter(filter: dict):
     try:
         cols = [i[0] for i in filter["args"][ExportArgs.table_columns]]
@@ -68,6 +176,9 @@ def validate_filter(filter: dict):
                 return False
         if not filter["args"][ExportArgs.time_column] in cols:
             return False
+        # invalid options would fail the creation of the table
+        if not validate_hypertable_args(filter["args"], cols):
+            return False
         return True
     except Exception as ex:
         print(ex)
@@ -83,30 +194,214 @@ def gen_create_table_stmt(name: str, columns: typing.List, unique_col: str):
     return "CREATE TABLE \"{}\" ({}{});".format(name, ", ".join(f"\"{i[0]}\" {' '.join(i[1:])}" for i in columns), ", UNIQUE ({})".format(unique_col) if unique_col else "")
 
 
-def gen_insert_into_table_stmt(name, columns, unique_col: str):
-    stmt = "INSERT INTO \"{}\" ({}) VALUES %s".format(name, ", ".join(f"\"{i}\"" for i in columns))
+def gen_on_conflict_clause(columns, unique_col: str):
+    update_cols = [i for i in columns if i != unique_col]
+    if not update_cols:
+        return " ON CONFLICT (\"{}\") DO NOTHING".format(unique_col)
+    return " ON CONFLICT (\"{}\") DO UPDATE SET {}".format(unique_col, ", ".join(f"\"{i}\"=EXCLUDED.\"{i}\"" for i in update_cols))
+
+
+def gen_insert_into_table_stmt(name, columns, unique_col: str, values: str = "%s"):
+    stmt = "INSERT INTO \"{}\" ({}) VALUES {}".format(name, ", ".join(f"\"{i}\"" for i in columns), values)
     if unique_col:
-        stmt += " ON CONFLICT (\"{}\") DO UPDATE SET {}".format(unique_col, ", ".join(f"\"{i}\"=EXCLUDED.\"{i}\"" for i in columns if i != unique_col))
+        stmt += gen_on_conflict_clause(columns=columns, unique_col=unique_col)
     return stmt
 
 
+def gen_prepare_insert_stmt(stmt_name: str, name, columns, unique_col: str, row_count: int):
+    col_count = len(columns)
+    values = ", ".join("({})".format(", ".join(f"${r * col_count + c + 1}" for c in range(col_count))) for r in range(row_count))
+    return f"PREPARE \"{stmt_name}\" AS " + gen_insert_into_table_stmt(name=name, columns=columns, unique_col=unique_col, values=values)
+
+
+def gen_placeholders(count: int):
+    return "({})".format(", ".join(f"${i}" for i in range(1, count + 1)))
+
+
+def gen_execute_stmt(stmt_name: str, param_count: int):
+    return "EXECUTE \"{}\" ({})".format(stmt_name, ", ".join("%s" for _ in range(param_count)))
+
+
+def gen_deallocate_stmt(stmt_name: typing.Optional[str] = None):
+    return f"DEALLOCATE \"{stmt_name}\"" if stmt_name else "DEALLOCATE ALL"
+
+
+def gen_savepoint_stmt(name: str, release: bool = False):
+    stmt = f"SAVEPOINT \"{name}\""
+    return f"RELEASE SAVEPOINT \"{name}\"; {stmt}" if release else stmt
+
+
+def gen_rollback_to_savepoint_stmt(name: str):
+    return f"ROLLBACK TO SAVEPOINT \"{name}\""
+
+
+def gen_copy_from_stdin_stmt(name: str, columns):
+    return "COPY \"{}\" ({}) FROM STDIN".format(name, ", ".join(f"\"{i}\"" for i in columns))
+
+
+def gen_stage_table_name(name: str):
+    return f"ew_stage_{hashlib.md5(name.encode()).hexdigest()}"
+
+
+def gen_drop_stage_table_stmt(stage_name: str):
+    return f"DROP TABLE IF EXISTS pg_temp.\"{stage_name}\";"
+
+
+def gen_create_stage_table_stmt(name: str, stage_name: str):
+    return gen_drop_stage_table_stmt(stage_name=stage_name) + f" CREATE TEMP TABLE \"{stage_name}\" (LIKE \"{name}\" INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;"
+
+
+def gen_merge_from_table_stmt(name: str, source: str, columns, unique_col: str):
+    cols = ", ".join(f"\"{i}\"" for i in columns)
+    return "INSERT INTO \"{}\" ({}) SELECT {} FROM \"{}\"{}; TRUNCATE \"{}\";".format(name, cols, cols, source, gen_on_conflict_clause(columns=columns, unique_col=unique_col), source)
+
+
+def _copy_value(val):
+    if val is None:
+        return "\\N"
+    if val is True:
+        return "t"
+    if val is False:
+        return "f"
+    if isinstance(val, datetime.datetime):
+        return val.isoformat()
+    return str(val).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def gen_copy_buffer(rows: typing.List[typing.Tuple]):
+    buffer = io.StringIO()
+    buffer.writelines("\t".join(_copy_value(val) for val in row) + "\n" for row in rows)
+    buffer.seek(0)
+    return buffer
+
+
 def gen_drop_table_stmt(name: str):
     return f"DROP TABLE IF EXISTS \"{name}\" CASCADE"
 
 
-def gen_create_hypertable_stmt(name: str, time_column, is_distributed: bool):
+def gen_literal(value):
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+def gen_identifier(value):
+    return "\"{}\"".format(str(value).replace("\"", "\"\""))
+
+
+def gen_interval(value):
+    return "INTERVAL '{}'".format(str(value).replace("'", "''"))
+
+
+def gen_create_hypertable_stmt(name: str, time_column, is_distributed: bool, chunk_time_interval=None, partition_column=None, partition_count=None):
     dist = ""
     if is_distributed:
         dist = "_distributed"
-    return f"SELECT create{dist}_hypertable('\"{name}\"', '{time_column}');"
+    args = ""
+    if partition_column:
+        args += f", partitioning_column => {gen_literal(partition_column)}"
+        if partition_count:
+            args += f", number_partitions => {int(partition_count)}"
+    if chunk_time_interval:
+        args += f", chunk_time_interval => {gen_interval(chunk_time_interval)}"
+    return f"SELECT create{dist}_hypertable('\"{name}\"', {gen_literal(time_column)}{args});"
+
+
+def gen_set_chunk_time_interval_stmt(name: str, chunk_time_interval):
+    return f"SELECT set_chunk_time_interval('\"{name}\"', {gen_interval(chunk_time_interval)});"
+
+
+def gen_set_compression_stmt(name: str, segmentby=None, orderby=None):
+    # an empty segmentby resets segments of previous settings
+    options = ["timescaledb.compress", "timescaledb.compress_segmentby = {}".format(gen_literal(", ".join(gen_identifier(i) for i in ([segmentby] if isinstance(segmentby, str) else segmentby or ()))))]
+    if orderby:
+        options.append("timescaledb.compress_orderby = {}".format(gen_literal(", ".join(" ".join(filter(None, (gen_identifier(col), modifiers))) for col, modifiers in parse_orderby(orderby)))))
+    return "ALTER TABLE \"{}\" SET ({});".format(name, ", ".join(options))
+
+
+def gen_add_compression_policy_stmt(name: str, compress_after):
+    return f"SELECT add_compression_policy('\"{name}\"', {gen_interval(compress_after)}, if_not_exists => true);"
+
+
+def gen_remove_compression_policy_stmt(name: str):
+    return f"SELECT remove_compression_policy('\"{name}\"', if_exists => true);"
+
+
+def gen_add_retention_policy_stmt(name: str, drop_after):
+    return f"SELECT add_retention_policy('\"{name}\"', {gen_interval(drop_after)}, if_not_exists => true);"
+
+
+def gen_remove_retention_policy_stmt(name: str):
+    return f"SELECT remove_retention_policy('\"{name}\"', if_exists => true);"
 
 
 def gen_set_replication_factor_stmt(name: str, factor: int):
     return f"SELECT set_replication_factor('\"{name}\"', {factor});"
 
 
-def gen_select_exists_table_stmt(name: str):
-    return f"SELECT EXISTS (SELECT FROM pg_tables WHERE tablename = '{name}');"
+numeric_types = ("real", "double", "smallint", "integer", "bigint")
+
+
+def gen_aggregate_name(name: str, bucket: str):
+    return "{}_{}".format(name, re.sub(r"\W+", "", bucket))
+
+
+def gen_create_aggregate_stmt(name: str, bucket: str, time_column: str, columns: typing.List, start_buckets: int = 10):
+    aggs = list()
+    for i in columns:
+        if i[1] in numeric_types and i[0] != time_column:
+            aggs.append(f"avg(\"{i[0]}\") AS \"{i[0]}_avg\"")
+            aggs.append(f"min(\"{i[0]}\") AS \"{i[0]}_min\"")
+            aggs.append(f"max(\"{i[0]}\") AS \"{i[0]}_max\"")
+            aggs.append(f"last(\"{i[0]}\", \"{time_column}\") AS \"{i[0]}_last\"")
+    agg_name = gen_aggregate_name(name=name, bucket=bucket)
+    interval = gen_interval(bucket)
+    return f"CREATE MATERIALIZED VIEW IF NOT EXISTS \"{agg_name}\" WITH (timescaledb.continuous) AS SELECT time_bucket({interval}, \"{time_column}\") AS \"{time_column}\", {', '.join(aggs)} FROM \"{name}\" GROUP BY 1 WITH NO DATA; " \
+           f"SELECT add_continuous_aggregate_policy('\"{agg_name}\"', start_offset => {interval} * {int(start_buckets)}, end_offset => {interval}, schedule_interval => {interval}, if_not_exists => true);"
+
+
+def gen_drop_aggregate_stmt(name: str, bucket: str):
+    return f"DROP MATERIALIZED VIEW IF EXISTS \"{gen_aggregate_name(name=name, bucket=bucket)}\";"
+
+
+def gen_select_table_catalog_stmt(name: typing.Optional[str] = None):
+    # hypertable settings follow the column names in the order of settings_keys of the table catalog
+    return "SELECT t.tablename, h.hypertable_name IS NOT NULL, array_remove(array_agg(c.column_name::text ORDER BY c.ordinal_position), NULL), " \
+           "(SELECT d.time_interval FROM timescaledb_information.dimensions d WHERE d.hypertable_schema = t.schemaname AND d.hypertable_name = t.tablename AND d.dimension_type = 'Time' LIMIT 1), " \
+           "(SELECT d.column_name::text FROM timescaledb_information.dimensions d WHERE d.hypertable_schema = t.schemaname AND d.hypertable_name = t.tablename AND d.dimension_type = 'Space' LIMIT 1), " \
+           "(SELECT d.num_partitions FROM timescaledb_information.dimensions d WHERE d.hypertable_schema = t.schemaname AND d.hypertable_name = t.tablename AND d.dimension_type = 'Space' LIMIT 1), " \
+           "(SELECT array_agg(s.attname::text ORDER BY s.segmentby_column_index) FROM timescaledb_information.compression_settings s WHERE s.hypertable_schema = t.schemaname AND s.hypertable_name = t.tablename AND s.segmentby_column_index IS NOT NULL), " \
+           "(SELECT array_agg(s.attname::text || CASE WHEN s.orderby_asc THEN '' ELSE ' DESC' END || CASE WHEN s.orderby_nullsfirst = s.orderby_asc THEN CASE WHEN s.orderby_nullsfirst THEN ' NULLS FIRST' ELSE ' NULLS LAST' END ELSE '' END ORDER BY s.orderby_column_index) " \
+           "FROM timescaledb_information.compression_settings s WHERE s.hypertable_schema = t.schemaname AND s.hypertable_name = t.tablename AND s.orderby_column_index IS NOT NULL), " \
+           "(SELECT (j.config->>'compress_after')::interval FROM timescaledb_information.jobs j WHERE j.hypertable_schema = t.schemaname AND j.hypertable_name = t.tablename AND j.proc_name = 'policy_compression' LIMIT 1), " \
+           "(SELECT (j.config->>'drop_after')::interval FROM timescaledb_information.jobs j WHERE j.hypertable_schema = t.schemaname AND j.hypertable_name = t.tablename AND j.proc_name = 'policy_retention' LIMIT 1), " \
+           "(SELECT array_agg(a.view_name::text) FROM timescaledb_information.continuous_aggregates a WHERE a.hypertable_schema = t.schemaname AND a.hypertable_name = t.tablename) " \
+           "FROM pg_tables t " \
+           "LEFT JOIN timescaledb_information.hypertables h ON h.hypertable_schema = t.schemaname AND h.hypertable_name = t.tablename " \
+           "LEFT JOIN information_schema.columns c ON c.table_schema = t.schemaname AND c.table_name = t.tablename " \
+           "WHERE t.schemaname = ANY (current_schemas(false)){} " \
+           "GROUP BY t.schemaname, t.tablename, h.hypertable_name;".format(" AND t.tablename = '{}'".format(name.replace("'", "''")) if name else "")
+
+
+def gen_select_intervals_stmt(values: typing.Iterable):
+    return "SELECT {};".format(", ".join(gen_interval(value) for value in values))
+
+
+def normalize_orderby(orderby) -> typing.Optional[typing.Tuple[str, ...]]:
+    """
+    Normalizes compression order by expressions, so export args can be compared with the settings of a table.
+    Default sort directions and null orderings are omitted.
+    """
+    if not orderby:
+        return None
+    normalized = list()
+    for item in (orderby.split(",") if isinstance(orderby, str) else orderby):
+        tokens = item.replace("\"", "").split()
+        if not tokens:
+            continue
+        modifiers = " ".join(tokens[1:]).upper()
+        desc = modifiers.startswith("DESC")
+        nulls_first = "NULLS FIRST" in modifiers if "NULLS" in modifiers else desc
+        normalized.append(tokens[0] + (" DESC" if desc else "") + ((" NULLS FIRST" if nulls_first else " NULLS LAST") if nulls_first != desc else ""))
+    return tuple(normalized)
 
 
 def gen_row(data, columns: typing.List, time_format):
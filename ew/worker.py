@@ -14,54 +14,104 @@
    limitations under the License.
 """
 
-__all__ = ("ExportWorker", )
+__all__ = ("ExportWorker", "LazyRowsBatch")
 
 from .util import *
 from .model import *
+from .offset_tracker import *
+from .writer import *
+from .async_writer import *
+from .plan import *
+from .dedup import *
+from .metrics import *
+from .batch_control import *
+from .error_reporter import *
+from .spool import *
 import util
 import ew_lib
 import mf_lib
+import mf_lib.exceptions
 import threading
+import queue
+import collections
 import typing
 import logging
+import time
+import random
 import psycopg2
-import psycopg2.extras
 
 
 class ExportWorker:
-    def __init__(self, db_conn: psycopg2._psycopg.connection, data_client: ew_lib.DataClient, filter_client: ew_lib.FilterClient, get_data_timeout: float = 5.0, get_data_limit: int = 10000, page_size: int = 100):
-        self.__db_conn = db_conn
+    def __init__(self, db_conn: psycopg2._psycopg.connection, data_client: ew_lib.DataClient, filter_client: ew_lib.FilterClient, get_data_timeout: float = 5.0, get_data_limit: int = 10000, page_size: int = 100, write_mode: str = WriteMode.insert, offset_tracker: typing.Optional[OffsetTracker] = None, pipeline: bool = False, pipeline_size: int = 2, writer_pool: typing.Optional[typing.Union[WriterPool, AsyncWriterPool]] = None, datetime_cache_size: int = 0, stmt_cache_size: int = 1024, fill_missing_columns: bool = False, dedup_window: int = 0, dedup_ttl: float = 0, metrics: typing.Optional[Metrics] = None, batch_controller: typing.Optional[BatchController] = None, error_reporter: typing.Optional[ErrorReporter] = None, spool: typing.Optional[Spool] = None, spool_retry_interval: float = 5, connect: typing.Optional[typing.Callable[[], psycopg2._psycopg.connection]] = None, reconnect_retries: int = 0, reconnect_delay: float = 0.5, reconnect_max_delay: float = 30, pause_partitions: bool = False, batch_max_bytes: int = 0, streaming: bool = False):
+        if pipeline and not offset_tracker:
+            raise RuntimeError("pipelined mode requires an offset tracker")
+        if batch_max_bytes and not offset_tracker:
+            raise RuntimeError("byte bounded batches require an offset tracker")
+        if streaming and (writer_pool or dedup_window > 0):
+            raise RuntimeError("streaming mode requires a single writer and no dedup cache")
+        self.__writer = Writer(db_conn=db_conn, page_size=page_size, write_mode=write_mode, stmt_cache_size=stmt_cache_size, metrics=metrics, connect=connect)
+        self.__metrics = metrics
+        self.__writer_pool = writer_pool
+        self.__pending = collections.deque()
         self.__data_client = data_client
         self.__filter_client = filter_client
+        self.__fill_missing_columns = fill_missing_columns
+        self.__dedup_cache = DedupCache(window_size=dedup_window, ttl=dedup_ttl) if dedup_window > 0 else None
+        if metrics and self.__dedup_cache:
+            metrics.add_gauge("ew_dedup_hits", "Rows dropped by the dedup cache.", lambda: self.__dedup_cache.hits)
+            metrics.add_gauge("ew_dedup_misses", "Rows passed by the dedup cache.", lambda: self.__dedup_cache.misses)
+            metrics.add_gauge("ew_dedup_hit_rate", "Share of rows dropped by the dedup cache.", self.__dedup_cache.get_hit_rate)
+        if metrics and batch_controller:
+            metrics.add_gauge("ew_batch_limit", "Current batch limit of the batch controller.", lambda: batch_controller.limit)
+            metrics.add_gauge("ew_batch_timeout_seconds", "Current poll timeout of the batch controller.", lambda: batch_controller.timeout)
+        self.__error_reporter = error_reporter or ErrorReporter(metrics=metrics)
+        self.__spool = spool
+        self.__spool_retry_interval = spool_retry_interval
+        self.__spool_retry = 0
+        self.__spool_offsets = collections.deque()
+        self.__reconnect_retries = reconnect_retries
+        self.__reconnect_delay = reconnect_delay
+        self.__reconnect_max_delay = reconnect_max_delay
+        self.__pause_partitions = pause_partitions
+        self.__sleeper = threading.Event()
+        if metrics and spool:
+            metrics.add_gauge("ew_spool_bytes", "Size of the spool on disk.", spool.get_size)
+        self.__plan_cache = PlanCache(filter_client=filter_client, datetime_cache_size=datetime_cache_size)
         self.__filter_sync_event = threading.Event()
         self.__get_data_timeout = get_data_timeout
         self.__get_data_limit = get_data_limit
-        self.__page_size = page_size
+        self.__batch_controller = batch_controller
+        self.__batch_max_bytes = batch_max_bytes
+        self.__msg_size = None
+        if metrics and batch_max_bytes:
+            metrics.add_gauge("ew_message_bytes", "Average message size used to bound batches.", lambda: self.__msg_size or 0)
+        self.__streaming = streaming
+        self.__offset_tracker = offset_tracker
+        self.__pipeline = pipeline
+        self.__pipeline_size = pipeline_size
+        self.__convert_queue = queue.Queue(maxsize=pipeline_size)
+        self.__write_queue = queue.Queue(maxsize=pipeline_size)
         self.__filter_sync_err = False
         self.__stop = False
         self.__stopped = False
 
     def _gen_rows_batch(self, exports_batch: typing.List[mf_lib.FilterResult]):
+        start = time.perf_counter() if self.__metrics else 0
         batches = dict()
         for result in exports_batch:
             if result.ex:
-                util.logger.error("generating rows", {"error": get_exception_str(result.ex), "export_ids": result.filter_ids})
+                for export_id in result.filter_ids or (None, ):
+                    self.__error_reporter.report(export_id, result.ex)
             else:
                 for export_id in result.filter_ids:
                     try:
-                        export_args = self.__filter_client.handler.get_filter_args(id=export_id)
-                        table_name = export_args[ExportArgs.table_name]
-                        table_columns = export_args[ExportArgs.table_columns]
-                        row_cols = tuple(i[0] for i in table_columns if i[0] in result.data)
-                        row_data = gen_row(
-                            data=result.data,
-                            columns=table_columns,
-                            time_format=export_args.get(ExportArgs.time_format)
-                        )
+                        plan = self.__plan_cache.get(export_id)
+                        table_name = plan.table_name
+                        row_cols, row_data = plan.gen_full_row(result.data) if self.__fill_missing_columns else plan.gen_row(result.data)
                         if table_name not in batches:
                             batches[table_name] = (
                                 export_id,
-                                export_args[ExportArgs.time_column] if export_args.get(ExportArgs.time_unique) is True else None,
+                                plan.unique_col,
                                 [(row_cols, [row_data])]
                             )
                         else:
@@ -70,34 +120,307 @@ class ExportWorker:
                             else:
                                 batches[table_name][2][-1][1].append(row_data)
                     except Exception as ex:
-                        util.logger.error("generating row", {"error": get_exception_str(ex), "export_id": export_id})
-        for table_name, item in batches.items():
-            if item[1]:
-                batches[table_name] = (item[0], item[1], remove_duplicates_from_batch(item[1], item[2]))
+                        self.__error_reporter.report(export_id, ex, result.data)
+        self.__error_reporter.tick()
+        for table_name, item in list(batches.items()):
+            data = self._dedup_rows(table_name=table_name, unique_col=item[1], data=item[2])
+            if data:
+                batches[table_name] = (item[0], item[1], data)
+            else:
+                del batches[table_name]
+        if self.__dedup_cache and util.logger.level == logging.DEBUG:
+            util.logger.debug("dedup cache", {"hits": self.__dedup_cache.hits, "misses": self.__dedup_cache.misses, "hit_rate": self.__dedup_cache.get_hit_rate()})
+        if self.__metrics:
+            self.__metrics.conversion.observe(time.perf_counter() - start)
+            for table_name, item in batches.items():
+                self.__metrics.table_rows.inc(sum(len(b[1]) for b in item[2]), (table_name, ))
         return batches
 
-    def _write_rows(self, rows_batch: typing.Dict):
-        if util.logger.level == logging.DEBUG:
-            rows_total = 0
-            for v in rows_batch.values():
-                for b in v[2]:
-                    rows_total += len(b[1])
-            util.logger.debug("writing rows", {"row_count": rows_total})
-        with self.__db_conn.cursor() as cursor:
-            for table_name, item in rows_batch.items():
-                for batch in item[2]:
+    def _convert(self, exports_batch: typing.List[mf_lib.FilterResult]):
+        if self.__streaming:
+            return self._group_results(exports_batch=exports_batch)
+        return self._gen_rows_batch(exports_batch=exports_batch)
+
+    def _dedup_rows(self, table_name: str, unique_col: typing.Optional[str], data):
+        if unique_col:
+            data = remove_duplicates_from_batch(unique_col, data)
+            if self.__dedup_cache:
+                data = self.__dedup_cache.filter(table_name, unique_col, data)
+                if not data:
+                    return None
+        return coalesce_batch(data)
+
+    def _group_results(self, exports_batch: typing.List[mf_lib.FilterResult]):
+        """
+        Groups the results of a batch by table without converting them, see LazyRowsBatch.
+        """
+        start = time.perf_counter() if self.__metrics else 0
+        groups = dict()
+        for result in exports_batch:
+            if result.ex:
+                for export_id in result.filter_ids or (None, ):
+                    self.__error_reporter.report(export_id, result.ex)
+            else:
+                for export_id in result.filter_ids:
                     try:
-                        psycopg2.extras.execute_values(
-                            cur=cursor,
-                            sql=gen_insert_into_table_stmt(name=table_name, columns=batch[0], unique_col=item[1]),
-                            argslist=batch[1],
-                            page_size=self.__page_size
-                        )
-                    except (psycopg2.InterfaceError, psycopg2.OperationalError, psycopg2.InternalError) as ex:
-                        raise WriteRowsError(len(batch[1]), item[0], ex)
+                        plan = self.__plan_cache.get(export_id)
                     except Exception as ex:
-                        util.logger.error("writing rows", {"error": get_exception_str(ex), "row_count": len(batch[1]), "export_id": item[0]})
-        self.__db_conn.commit()
+                        self.__error_reporter.report(export_id, ex, result.data)
+                        continue
+                    if plan.table_name not in groups:
+                        groups[plan.table_name] = (export_id, plan.unique_col, [])
+                    groups[plan.table_name][2].append((export_id, plan, result.data))
+        self.__error_reporter.tick()
+        if self.__metrics:
+            self.__metrics.conversion.observe(time.perf_counter() - start)
+        return LazyRowsBatch(groups=groups, gen_rows=self._gen_table_rows)
+
+    def _gen_table_rows(self, table_name: str, group):
+        data = list()
+        for export_id, plan, values in group[2]:
+            try:
+                row_cols, row_data = plan.gen_full_row(values) if self.__fill_missing_columns else plan.gen_row(values)
+                if data and row_cols == data[-1][0]:
+                    data[-1][1].append(row_data)
+                else:
+                    data.append((row_cols, [row_data]))
+            except Exception as ex:
+                self.__error_reporter.report(export_id, ex, values)
+        if data:
+            data = self._dedup_rows(table_name=table_name, unique_col=group[1], data=data)
+        if not data:
+            return None
+        if self.__metrics:
+            self.__metrics.table_rows.inc(sum(len(b[1]) for b in data), (table_name, ))
+        return group[0], group[1], data
+
+    def _write_rows(self, rows_batch: typing.Dict):
+        failed_tables = self.__writer.write(rows_batch=rows_batch)
+        if self.__dedup_cache:
+            self.__dedup_cache.update(rows_batch=rows_batch, failed_tables=failed_tables)
+
+    def _spool_rows(self, rows_batch: typing.Dict, offsets, ex: typing.Optional[WriteRowsError] = None) -> bool:
+        """
+        Appends a batch to the spool. Returns False if the worker has been stopped before the batch has been spooled.
+        """
+        if ex:
+            util.logger.warning(f"spooling rows: {ex.msg}", ex.kwargs)
+            self.__spool_retry = time.monotonic() + self.__spool_retry_interval
+        if rows_batch and not self._append_spool(rows_batch=dict(rows_batch.items()) if isinstance(rows_batch, LazyRowsBatch) else rows_batch):
+            return False
+        # offsets are stored once the rows are on disk, so the messages don't have to be consumed again
+        self.__spool_offsets.append(offsets)
+        self._store_spool_offsets()
+        return True
+
+    def _append_spool(self, rows_batch: typing.Dict) -> bool:
+        """
+        If the spool is full, partitions are paused and spooled batches are drained until the batch fits, retrying
+        after connection errors until the worker is stopped. A batch larger than the empty spool is written directly.
+        Returns False if the worker has been stopped meanwhile.
+        """
+        try:
+            self.__spool.append(rows_batch=rows_batch)
+            return True
+        except SpoolFullError as ex:
+            util.logger.warning("spool full, draining spool", {"error": get_exception_str(ex)})
+        paused = None
+        if self.__pause_partitions and self.__offset_tracker:
+            paused = self.__offset_tracker.pause_assignment()
+        try:
+            attempt = 0
+            while not self.__stop:
+                spooled_batch = self.__spool.peek()
+                try:
+                    if spooled_batch is None:
+                        return self._write_rows_sync(rows_batch=rows_batch)
+                    if not self._write_rows_sync(rows_batch=spooled_batch):
+                        return False
+                except WriteRowsError as ex:
+                    util.logger.warning(f"draining spool: {ex.msg}", dict(ex.kwargs, attempt=attempt + 1))
+                    if not self._backoff(min(attempt, 16)):
+                        return False
+                    attempt += 1
+                    continue
+                attempt = 0
+                self.__spool.pop()
+                try:
+                    self.__spool.append(rows_batch=rows_batch)
+                    return True
+                except SpoolFullError:
+                    # space is freed once a segment has been drained
+                    pass
+            return False
+        finally:
+            if paused:
+                self.__offset_tracker.resume(paused)
+
+    def _store_spool_offsets(self, force: bool = False):
+        if self.__spool_offsets and self.__spool.sync(force=force):
+            spool_offsets, self.__spool_offsets = self.__spool_offsets, collections.deque()
+            for offsets in spool_offsets:
+                self._store_offsets(offsets=offsets)
+
+    def _write_rows_sync(self, rows_batch: typing.Dict) -> bool:
+        """
+        Writes a batch and waits for the commit. Returns False if the worker has been stopped meanwhile.
+        """
+        if self.__writer_pool:
+            # no other batches are pending, writers blocked by an earlier error can accept rows again
+            self.__writer_pool.unblock()
+            state = self.__writer_pool.submit(rows_batch=rows_batch)
+            while not state.wait(timeout=self.__get_data_timeout):
+                if self.__stop:
+                    return False
+            if state.error:
+                raise state.error
+            failed_tables = state.failed_tables
+        else:
+            failed_tables = self.__writer.write(rows_batch=rows_batch)
+        if self.__dedup_cache:
+            self.__dedup_cache.update(rows_batch=rows_batch, failed_tables=failed_tables)
+        return True
+
+    def _backoff(self, attempt: int) -> bool:
+        delay = min(self.__reconnect_max_delay, self.__reconnect_delay * 2 ** attempt)
+        self.__sleeper.wait(delay / 2 + random.uniform(0, delay / 2))
+        return not self.__stop
+
+    def _retry_rows(self, rows_batch: typing.Dict, ex: WriteRowsError) -> bool:
+        """
+        Writes a batch again after a connection error, writers reconnect on their next write. Returns False if the
+        worker has been stopped meanwhile and raises the last error once all retries failed.
+        """
+        paused = None
+        if self.__pause_partitions and self.__offset_tracker and self.__reconnect_retries:
+            paused = self.__offset_tracker.pause_assignment()
+        try:
+            for attempt in range(self.__reconnect_retries):
+                util.logger.warning(f"retrying: {ex.msg}", dict(ex.kwargs, attempt=attempt + 1, retries=self.__reconnect_retries))
+                if not self._backoff(attempt):
+                    return False
+                try:
+                    return self._write_rows_sync(rows_batch=rows_batch)
+                except WriteRowsError as _ex:
+                    ex = _ex
+            raise ex
+        finally:
+            if paused:
+                self.__offset_tracker.resume(paused)
+
+    def _drain_spool(self):
+        # drains in order for at most get_data_timeout seconds, so messages are still consumed in between
+        if time.monotonic() < self.__spool_retry:
+            return
+        deadline = time.monotonic() + self.__get_data_timeout
+        while not self.__stop and time.monotonic() < deadline:
+            rows_batch = self.__spool.peek()
+            if rows_batch is None:
+                return
+            try:
+                if not self._write_rows_sync(rows_batch=rows_batch):
+                    return
+            except WriteRowsError as ex:
+                util.logger.warning(f"draining spool: {ex.msg}", ex.kwargs)
+                self.__spool_retry = time.monotonic() + self.__spool_retry_interval
+                return
+            self.__spool.pop()
+
+    def _submit_rows(self, rows_batch: typing.Dict, offsets):
+        if self.__spool and not self.__spool.is_empty():
+            # keeps the order of batches while the spool is drained
+            self._spool_rows(rows_batch=rows_batch, offsets=offsets)
+        elif self.__writer_pool:
+            self.__pending.append((self.__writer_pool.submit(rows_batch=rows_batch), offsets, rows_batch, time.monotonic()))
+        else:
+            start = time.monotonic()
+            try:
+                self._write_rows(rows_batch=rows_batch)
+            except WriteRowsError as ex:
+                if self.__spool:
+                    self._spool_rows(rows_batch=rows_batch, offsets=offsets, ex=ex)
+                    return
+                if not self._retry_rows(rows_batch=rows_batch, ex=ex):
+                    return
+            if self.__batch_controller:
+                self.__batch_controller.observe_write(time.monotonic() - start)
+            self._store_offsets(offsets=offsets)
+
+    def _complete_batches(self, max_pending: int):
+        # offsets are stored in batch order and only after every writer of a batch has committed
+        while self.__pending and not self.__stop:
+            state, offsets, rows_batch, submitted = self.__pending[0]
+            if len(self.__pending) > max_pending:
+                if not state.wait(timeout=self.__get_data_timeout):
+                    continue
+            elif not state.is_done():
+                break
+            if state.error:
+                if not isinstance(state.error, WriteRowsError):
+                    raise state.error
+                if not self._recover_batches():
+                    return
+                continue
+            self.__pending.popleft()
+            if self.__batch_controller:
+                self.__batch_controller.observe_write(time.monotonic() - submitted)
+            if self.__dedup_cache:
+                self.__dedup_cache.update(rows_batch=rows_batch, failed_tables=state.failed_tables)
+            self._store_offsets(offsets=offsets)
+
+    def _recover_batches(self) -> bool:
+        """
+        Writes the tables of pending batches that have not been committed because of a connection error again. Blocked
+        writers reject the tables of later batches, so all pending batches are completed first and then resolved in
+        order. Returns False if the worker has been stopped meanwhile.
+        """
+        for state, _, _, _ in self.__pending:
+            while not state.wait(timeout=self.__get_data_timeout):
+                if self.__stop:
+                    return False
+        while self.__pending:
+            state, offsets, rows_batch, _ = self.__pending[0]
+            if state.error and not isinstance(state.error, WriteRowsError):
+                raise state.error
+            if self.__dedup_cache:
+                self.__dedup_cache.update(rows_batch=rows_batch, failed_tables=state.failed_tables | state.error_tables)
+            if state.error_tables:
+                # only rows of tables that have not been committed are written again
+                error_batch = {table_name: item for table_name, item in rows_batch.items() if table_name in state.error_tables}
+                if self.__spool:
+                    if not self._spool_rows(rows_batch=error_batch, offsets=offsets, ex=state.error):
+                        return False
+                    self.__pending.popleft()
+                    continue
+                if not self._retry_rows(rows_batch=error_batch, ex=state.error):
+                    return False
+            self.__pending.popleft()
+            self._store_offsets(offsets=offsets)
+        return True
+
+    def _evict_table(self, table_name: str):
+        if self.__writer_pool:
+            self.__writer_pool.evict_table(table_name)
+        else:
+            self.__writer.evict_table(table_name)
+
+    def put_filter(self, export_id: str):
+        try:
+            # the table may have been re-created with other columns
+            self._evict_table(self.__filter_client.handler.get_filter_args(id=export_id)[ExportArgs.table_name])
+        except mf_lib.exceptions.UnknownFilterIDError:
+            pass
+        self.__plan_cache.invalidate(export_id)
+
+    def delete_filter(self, export_id: str):
+        try:
+            table_name = self.__filter_client.handler.get_filter_args(id=export_id)[ExportArgs.table_name]
+            self._evict_table(table_name)
+            if self.__dedup_cache:
+                self.__dedup_cache.evict_table(table_name)
+        except mf_lib.exceptions.UnknownFilterIDError:
+            pass
+        self.__plan_cache.invalidate(export_id)
 
     def set_filter_sync(self, err: bool):
         self.__filter_sync_err = err
@@ -105,37 +428,188 @@ class ExportWorker:
 
     def stop(self):
         self.__stop = True
+        self.__sleeper.set()
 
     def is_alive(self):
         return not self.__stopped
 
+    def _get_exports_batch(self):
+        start = time.perf_counter() if self.__metrics else 0
+        if self.__batch_controller:
+            timeout, limit = self.__batch_controller.timeout, self.__batch_controller.limit
+        else:
+            timeout, limit = self.__get_data_timeout, self.__get_data_limit
+        if self.__batch_max_bytes:
+            # bounded by the average message size of previous batches, a small first batch provides the estimate
+            limit = max(min(limit, int(self.__batch_max_bytes / self.__msg_size) if self.__msg_size else 100), 1)
+        if self.__offset_tracker:
+            msgs, msg_bytes = self.__offset_tracker.messages, self.__offset_tracker.bytes
+        exports_batch = self.__data_client.get_exports_batch(
+            timeout=timeout,
+            limit=limit,
+            data_ignore_missing_keys=True
+        )
+        if self.__batch_max_bytes and self.__offset_tracker.messages > msgs:
+            msg_size = (self.__offset_tracker.bytes - msg_bytes) / (self.__offset_tracker.messages - msgs)
+            self.__msg_size = msg_size if self.__msg_size is None else 0.3 * msg_size + 0.7 * self.__msg_size
+        # the limit applies to consumed messages, a message can yield no or several filter results
+        if self.__offset_tracker:
+            msg_count = self.__offset_tracker.messages - msgs
+        else:
+            msg_count = len(exports_batch[0]) if exports_batch else 0
+        if self.__batch_controller:
+            self.__batch_controller.observe_batch(msg_count=msg_count, limit=limit)
+        if self.__metrics:
+            self.__metrics.poll_wait.observe(time.perf_counter() - start)
+            if msg_count:
+                self.__metrics.batch_messages.observe(msg_count)
+        offsets = self.__offset_tracker.pop_offsets() if self.__offset_tracker else None
+        if exports_batch:
+            if exports_batch[1]:
+                raise RuntimeError(set(str(ex) for ex in exports_batch[1]))
+            if exports_batch[0]:
+                return exports_batch[0], offsets
+        if offsets:
+            return list(), offsets
+
+    def _store_offsets(self, offsets):
+        if self.__spool_offsets:
+            # offsets of spooled batches that are not on disk yet are stored first
+            self.__spool_offsets.append(offsets)
+            self._store_spool_offsets()
+            return
+        start = time.perf_counter() if self.__metrics else 0
+        if self.__offset_tracker:
+            self.__offset_tracker.store_offsets(offsets=offsets)
+        else:
+            self.__data_client.store_offsets()
+        if self.__metrics:
+            self.__metrics.offset_store.observe(time.perf_counter() - start)
+
+    def _handle_exception(self, ex):
+        if isinstance(ex, WriteRowsError):
+            util.logger.critical(f"handling exports: {ex.msg}", ex.args)
+        else:
+            util.logger.critical("handling exports", {"error": get_exception_str(ex)})
+        self.__stop = True
+
+    def _put_stage_item(self, stage_queue: queue.Queue, item):
+        while not self.__stop:
+            try:
+                stage_queue.put(item, timeout=self.__get_data_timeout)
+                return
+            except queue.Full:
+                pass
+
+    def _get_stage_item(self, stage_queue: queue.Queue):
+        try:
+            return stage_queue.get(timeout=self.__get_data_timeout)
+        except queue.Empty:
+            pass
+
+    def _consume_stage(self):
+        while not self.__stop:
+            try:
+                item = self._get_exports_batch()
+                if item:
+                    self._put_stage_item(self.__convert_queue, item)
+            except Exception as ex:
+                self._handle_exception(ex)
+
+    def _convert_stage(self):
+        while not self.__stop:
+            try:
+                item = self._get_stage_item(self.__convert_queue)
+                if item:
+                    self._put_stage_item(self.__write_queue, (self._convert(exports_batch=item[0]), item[1]))
+            except Exception as ex:
+                self._handle_exception(ex)
+
+    def _run_pipeline(self):
+        stage_threads = (
+            threading.Thread(target=self._consume_stage, name="consume-stage", daemon=True),
+            threading.Thread(target=self._convert_stage, name="convert-stage", daemon=True)
+        )
+        for thread in stage_threads:
+            thread.start()
+        while not self.__stop:
+            try:
+                if self.__spool:
+                    self._drain_spool()
+                    self._store_spool_offsets()
+                item = self._get_stage_item(self.__write_queue)
+                if item:
+                    self._submit_rows(rows_batch=item[0], offsets=item[1])
+                self._complete_batches(max_pending=self.__pipeline_size)
+            except Exception as ex:
+                self._handle_exception(ex)
+        self._close_spool()
+        for thread in stage_threads:
+            thread.join()
+
+    def _run_serial(self):
+        while not self.__stop:
+            try:
+                if self.__spool:
+                    self._drain_spool()
+                    self._store_spool_offsets()
+                item = self._get_exports_batch()
+                if item:
+                    self._submit_rows(rows_batch=self._convert(exports_batch=item[0]), offsets=item[1])
+                    self._complete_batches(max_pending=0)
+            except Exception as ex:
+                self._handle_exception(ex)
+        self._close_spool()
+
+    def _close_spool(self):
+        # offsets of spooled batches are stored before the consumer is closed
+        if self.__spool:
+            try:
+                self._store_spool_offsets(force=True)
+            except Exception as ex:
+                self._handle_exception(ex)
+
     def run(self):
         util.logger.info("waiting for filter synchronisation")
         self.__filter_sync_event.wait()
         if not self.__filter_sync_err:
             util.logger.info("starting export consumption")
-            while not self.__stop:
-                try:
-                    exports_batch = self.__data_client.get_exports_batch(
-                        timeout=self.__get_data_timeout,
-                        limit=self.__get_data_limit,
-                        data_ignore_missing_keys=True
-                    )
-                    if exports_batch:
-                        if exports_batch[1]:
-                            raise RuntimeError(set(str(ex) for ex in exports_batch[1]))
-                        if exports_batch[0]:
-                            self._write_rows(rows_batch=self._gen_rows_batch(exports_batch=exports_batch[0]))
-                            self.__data_client.store_offsets()
-                except WriteRowsError as ex:
-                    util.logger.critical(f"handling exports: {ex.msg}", ex.args)
-                    self.__stop = True
-                except Exception as ex:
-                    util.logger.critical("handling exports", {"error": get_exception_str(ex)})
-                    self.__stop = True
+            if self.__pipeline:
+                self._run_pipeline()
+            else:
+                self._run_serial()
         self.__stopped = True
 
 
+class LazyRowsBatch:
+    """
+    Rows batch that converts the results of a table only when its rows are first requested. Writer.write iterates
+    the tables one after another, so the results and rows of all tables are not held at once. The results of a
+    table are replaced by its rows, further iterations for dedup cache updates, retries or the spool yield the
+    same rows without converting again.
+    """
+    def __init__(self, groups: typing.Dict, gen_rows: typing.Callable):
+        self.__groups = groups
+        self.__gen_rows = gen_rows
+        self.__tables = list(groups)
+        self.__items = dict()
+
+    def items(self):
+        for table_name in self.__tables:
+            if table_name not in self.__items:
+                self.__items[table_name] = self.__gen_rows(table_name, self.__groups.pop(table_name))
+            item = self.__items[table_name]
+            if item:
+                yield table_name, item
+
+    def values(self):
+        for _, item in self.items():
+            yield item
+
+    def __len__(self):
+        return len(self.__tables)
+
+
 def remove_duplicates_from_batch(unique_col, data):
     time_set = set()
     new_batch = list()
@@ -155,3 +629,13 @@ def remove_duplicates_from_batch(unique_col, data):
             new_batch.append((row_cols, new_row_data))
     new_batch.reverse()
     return new_batch
+
+
+def coalesce_batch(data):
+    groups = dict()
+    for row_cols, row_data in data:
+        if row_cols in groups:
+            groups[row_cols].extend(row_data)
+        else:
+            groups[row_cols] = row_data
+    return list(groups.items())
@@ -0,0 +1,321 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("Writer", "WriterPool")
+
+from .util import *
+from .model import *
+from .metrics import *
+import util
+import threading
+import queue
+import logging
+import collections
+import functools
+import itertools
+import time
+import zlib
+import psycopg2
+import psycopg2.extras
+
+
+class Writer:
+    def __init__(self, db_conn: psycopg2._psycopg.connection, page_size: int = 100, write_mode: str = WriteMode.insert, stmt_cache_size: int = 1024, metrics: typing.Optional[Metrics] = None, connect: typing.Optional[typing.Callable[[], psycopg2._psycopg.connection]] = None):
+        self.__db_conn = db_conn
+        self.__connect = connect
+        self.__metrics = metrics
+        self.__page_size = page_size
+        self.__write_mode = write_mode
+        self.__stage_tables = set()
+        self.__stmt_cache_size = stmt_cache_size
+        self.__gen_insert_stmt = functools.lru_cache(maxsize=stmt_cache_size)(gen_insert_into_table_stmt)
+        self.__gen_copy_stmt = functools.lru_cache(maxsize=stmt_cache_size)(gen_copy_from_stdin_stmt)
+        self.__gen_merge_stmt = functools.lru_cache(maxsize=stmt_cache_size)(gen_merge_from_table_stmt)
+        self.__prepared_stmts = collections.OrderedDict()
+        self.__prepared_stmt_count = itertools.count()
+        self.__evict_tables = set()
+        self.__deallocate_all = False
+        self.__savepoint = "ew_table"
+        self.rolled_back_rows = 0
+
+    def _insert_rows(self, cursor, table_name, columns, unique_col, rows):
+        psycopg2.extras.execute_values(
+            cur=cursor,
+            sql=self.__gen_insert_stmt(table_name, columns, unique_col),
+            argslist=rows,
+            page_size=self.__page_size
+        )
+
+    def _get_prepared_stmt(self, cursor, table_name, columns, unique_col, row_count):
+        key = (table_name, columns, unique_col, row_count)
+        try:
+            self.__prepared_stmts.move_to_end(key)
+            return self.__prepared_stmts[key]
+        except KeyError:
+            while self.__prepared_stmts and len(self.__prepared_stmts) >= self.__stmt_cache_size:
+                cursor.execute(gen_deallocate_stmt(self.__prepared_stmts.popitem(last=False)[1]))
+            stmt_name = f"ew_insert_{next(self.__prepared_stmt_count)}"
+            cursor.execute(gen_prepare_insert_stmt(stmt_name=stmt_name, name=table_name, columns=columns, unique_col=unique_col, row_count=row_count))
+            self.__prepared_stmts[key] = stmt_name
+            return stmt_name
+
+    def _execute_prepared_rows(self, cursor, table_name, columns, unique_col, rows):
+        for pos in range(0, len(rows), self.__page_size):
+            page = rows[pos:pos + self.__page_size]
+            stmt_name = self._get_prepared_stmt(cursor=cursor, table_name=table_name, columns=columns, unique_col=unique_col, row_count=len(page))
+            cursor.execute(gen_execute_stmt(stmt_name=stmt_name, param_count=len(page) * len(columns)), tuple(itertools.chain.from_iterable(page)))
+
+    def _evict_tables(self, cursor):
+        # prepared statements and stage tables of evicted tables may not match the columns of the table anymore
+        if self.__deallocate_all:
+            cursor.execute(gen_deallocate_stmt())
+            self.__prepared_stmts.clear()
+            self.__evict_tables.clear()
+            self.__deallocate_all = False
+        while self.__evict_tables:
+            table_name = self.__evict_tables.pop()
+            for key in [key for key in self.__prepared_stmts if key[0] == table_name]:
+                cursor.execute(gen_deallocate_stmt(self.__prepared_stmts.pop(key)))
+            stage_name = gen_stage_table_name(name=table_name)
+            if stage_name in self.__stage_tables:
+                cursor.execute(gen_drop_stage_table_stmt(stage_name=stage_name))
+                self.__stage_tables.discard(stage_name)
+
+    def _reset(self):
+        # the transaction is lost, stage tables and prepared statements must be recreated
+        self.__stage_tables.clear()
+        self.__deallocate_all = True
+        if not self.__db_conn.closed:
+            try:
+                self.__db_conn.rollback()
+            except Exception:
+                pass
+
+    def _reconnect(self):
+        util.logger.info("reconnecting to database")
+        try:
+            self.__db_conn.close()
+        except Exception:
+            pass
+        self.__db_conn = self.__connect()
+        # a new session has no stage tables and prepared statements
+        self.__stage_tables.clear()
+        self.__prepared_stmts.clear()
+        self.__evict_tables.clear()
+        self.__deallocate_all = False
+
+    def _copy_rows(self, cursor, table_name, columns, unique_col, rows):
+        if unique_col:
+            stage_name = gen_stage_table_name(name=table_name)
+            if stage_name not in self.__stage_tables:
+                cursor.execute(gen_create_stage_table_stmt(name=table_name, stage_name=stage_name))
+                self.__stage_tables.add(stage_name)
+            cursor.copy_expert(sql=self.__gen_copy_stmt(stage_name, columns), file=gen_copy_buffer(rows))
+            cursor.execute(self.__gen_merge_stmt(table_name, stage_name, columns, unique_col))
+        else:
+            cursor.copy_expert(sql=self.__gen_copy_stmt(table_name, columns), file=gen_copy_buffer(rows))
+
+    def _split_batches(self, batches, unique_col):
+        # literal DEFAULT values are only possible in inserts, omitted columns also keep their values on conflict
+        if self.__write_mode == WriteMode.insert and not unique_col:
+            return batches
+        return [split for batch in batches for split in split_default_rows(*batch)]
+
+    def write(self, rows_batch: typing.Dict) -> typing.Set[str]:
+        """
+        Writes and commits the rows of a batch. Returns the names of tables whose rows have not been written.
+        """
+        if util.logger.level == logging.DEBUG:
+            rows_total = 0
+            for v in rows_batch.values():
+                for b in v[2]:
+                    rows_total += len(b[1])
+            util.logger.debug("writing rows", {"row_count": rows_total})
+        if self.__db_conn.closed and self.__connect:
+            try:
+                self._reconnect()
+            except psycopg2.OperationalError as ex:
+                raise WriteRowsError(0, None, ex)
+        failed_tables = set()
+        try:
+            cursor = self.__db_conn.cursor()
+        except (psycopg2.InterfaceError, psycopg2.OperationalError) as ex:
+            self._reset()
+            raise WriteRowsError(0, None, ex)
+        with cursor:
+            try:
+                self._evict_tables(cursor=cursor)
+            except (psycopg2.InterfaceError, psycopg2.OperationalError, psycopg2.InternalError) as ex:
+                self._reset()
+                raise WriteRowsError(0, None, ex)
+            release = False
+            for table_name, item in rows_batch.items():
+                try:
+                    # each table is written within a savepoint, a failing table only discards its own rows
+                    cursor.execute(gen_savepoint_stmt(name=self.__savepoint, release=release))
+                    release = True
+                    for columns, rows in self._split_batches(batches=item[2], unique_col=item[1]):
+                        start = time.perf_counter() if self.__metrics else 0
+                        if self.__write_mode == WriteMode.copy:
+                            self._copy_rows(cursor=cursor, table_name=table_name, columns=columns, unique_col=item[1], rows=rows)
+                        elif self.__write_mode == WriteMode.prepared:
+                            self._execute_prepared_rows(cursor=cursor, table_name=table_name, columns=columns, unique_col=item[1], rows=rows)
+                        else:
+                            self._insert_rows(cursor=cursor, table_name=table_name, columns=columns, unique_col=item[1], rows=rows)
+                        if self.__metrics:
+                            self.__metrics.write_stmt.observe(time.perf_counter() - start, (self.__write_mode, ))
+                except (psycopg2.InterfaceError, psycopg2.OperationalError, psycopg2.InternalError) as ex:
+                    self._reset()
+                    raise WriteRowsError(sum(len(b[1]) for b in item[2]), item[0], ex)
+                except Exception as ex:
+                    row_count = sum(len(b[1]) for b in item[2])
+                    util.logger.error("writing rows", {"error": get_exception_str(ex), "row_count": row_count, "export_id": item[0]})
+                    try:
+                        cursor.execute(gen_rollback_to_savepoint_stmt(name=self.__savepoint))
+                    except (psycopg2.InterfaceError, psycopg2.OperationalError, psycopg2.InternalError) as ex:
+                        self._reset()
+                        raise WriteRowsError(row_count, item[0], ex)
+                    # a stage table created within the savepoint is gone after the rollback
+                    self.__stage_tables.discard(gen_stage_table_name(name=table_name))
+                    failed_tables.add(table_name)
+                    self.rolled_back_rows += row_count
+                    if self.__metrics:
+                        self.__metrics.rolled_back_rows.inc(row_count, (table_name, ))
+        start = time.perf_counter() if self.__metrics else 0
+        try:
+            self.__db_conn.commit()
+        except (psycopg2.InterfaceError, psycopg2.OperationalError, psycopg2.InternalError) as ex:
+            self._reset()
+            raise WriteRowsError(0, None, ex)
+        if self.__metrics:
+            self.__metrics.commit.observe(time.perf_counter() - start)
+        if failed_tables:
+            util.logger.warning("rolled back table writes", {"tables": len(failed_tables), "rolled_back_rows_total": self.rolled_back_rows})
+        return failed_tables
+
+    def evict_table(self, table_name: str):
+        self.__evict_tables.add(table_name)
+
+    def close(self):
+        self.__db_conn.close()
+
+
+class BatchState:
+    def __init__(self, shards: int):
+        self.__pending = shards
+        self.__lock = threading.Lock()
+        self.__event = threading.Event()
+        self.error = None
+        self.failed_tables = set()
+        self.error_tables = set()
+        if not shards:
+            self.__event.set()
+
+    def set_done(self, error: typing.Optional[Exception] = None, failed_tables: typing.Optional[typing.Set[str]] = None, error_tables: typing.Optional[typing.Set[str]] = None):
+        """
+        Tables in failed_tables have been rolled back for good, tables in error_tables have not been committed
+        because of the error and must be written again.
+        """
+        with self.__lock:
+            if error and not self.error:
+                self.error = error
+            if failed_tables:
+                self.failed_tables.update(failed_tables)
+            if error_tables:
+                self.error_tables.update(error_tables)
+            self.__pending -= 1
+            if self.__pending <= 0:
+                self.__event.set()
+
+    def is_done(self) -> bool:
+        return self.__event.is_set()
+
+    def wait(self, timeout: typing.Optional[float] = None) -> bool:
+        return self.__event.wait(timeout=timeout)
+
+
+class WriterPool:
+    """
+    Shards tables by name across writers with their own connections. Every writer commits its share of a batch
+    independently, the returned batch state is done when all writers that received rows have committed.
+    A writer that fails with a connection error rejects all following batches until unblock is called, so rows
+    of a table are never committed ahead of earlier rows that have to be written again.
+    """
+    def __init__(self, db_conns: typing.List[psycopg2._psycopg.connection], page_size: int = 100, write_mode: str = WriteMode.insert, stmt_cache_size: int = 1024, metrics: typing.Optional[Metrics] = None, timeout: float = 1.0, connect: typing.Optional[typing.Callable[[], psycopg2._psycopg.connection]] = None):
+        self.__writers = [Writer(db_conn=db_conn, page_size=page_size, write_mode=write_mode, stmt_cache_size=stmt_cache_size, metrics=metrics, connect=connect) for db_conn in db_conns]
+        self.__queues = [queue.Queue() for _ in self.__writers]
+        self.__threads = [threading.Thread(target=self._run, args=(num, ), name=f"writer-{num}", daemon=True) for num in range(len(self.__writers))]
+        self.__blocked = [None] * len(self.__writers)
+        self.__timeout = timeout
+        self.__stop = False
+
+    def _run(self, shard: int):
+        writer, w_queue = self.__writers[shard], self.__queues[shard]
+        while not self.__stop:
+            try:
+                rows_batch, state = w_queue.get(timeout=self.__timeout)
+                if self.__blocked[shard]:
+                    state.set_done(error=self.__blocked[shard], error_tables=set(rows_batch))
+                    continue
+                try:
+                    state.set_done(failed_tables=writer.write(rows_batch=rows_batch))
+                except WriteRowsError as ex:
+                    self.__blocked[shard] = ex
+                    state.set_done(error=ex, error_tables=set(rows_batch))
+                except Exception as ex:
+                    state.set_done(error=ex)
+            except queue.Empty:
+                pass
+
+    def _get_shard(self, table_name: str) -> int:
+        return zlib.crc32(table_name.encode()) % len(self.__writers)
+
+    def submit(self, rows_batch: typing.Dict) -> BatchState:
+        shards = dict()
+        for table_name, item in rows_batch.items():
+            shard = self._get_shard(table_name)
+            if shard not in shards:
+                shards[shard] = dict()
+            shards[shard][table_name] = item
+        state = BatchState(len(shards))
+        for shard, shard_batch in shards.items():
+            self.__queues[shard].put((shard_batch, state))
+        return state
+
+    def unblock(self):
+        """
+        Lets writers blocked by a connection error accept batches again, must only be called while no batches are pending.
+        """
+        self.__blocked = [None] * len(self.__writers)
+
+    def evict_table(self, table_name: str):
+        self.__writers[self._get_shard(table_name)].evict_table(table_name)
+
+    def start(self):
+        for thread in self.__threads:
+            thread.start()
+
+    def stop(self):
+        self.__stop = True
+
+    def is_alive(self) -> bool:
+        return all(thread.is_alive() for thread in self.__threads)
+
+    def join(self):
+        for thread in self.__threads:
+            thread.join()
+        for writer in self.__writers:
+            writer.close()
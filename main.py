@@ -20,37 +20,68 @@ import ew_lib
 import cncr_wdg
 import confluent_kafka
 import psycopg2
+import functools
+import multiprocessing
+import os
 import signal
+import typing
 
 
-if __name__ == '__main__':
-    config = util.Config(prefix="conf")
-    util.init_logger(config.logger_level)
-    util.logger.info("starting export worker", util.read_git_commit("git_commit"))
-    util.logger.debug("export worker config", {"values": f"{config}"})
-    db_conn_ew = psycopg2.connect(
-        host=config.timescaledb.host,
-        port=config.timescaledb.port,
-        database=config.timescaledb.database,
-        user=config.timescaledb.username,
-        password=config.timescaledb.password
-    )
-    db_conn_tm = psycopg2.connect(
+def connect_db(config: util.Config):
+    return psycopg2.connect(
         host=config.timescaledb.host,
         port=config.timescaledb.port,
         database=config.timescaledb.database,
         user=config.timescaledb.username,
         password=config.timescaledb.password
     )
+
+
+def chain_callables(*callables):
+    def call(*args, **kwargs):
+        for func in callables:
+            func(*args, **kwargs)
+    return call
+
+
+def run_export_worker(config: util.Config, process_num: typing.Optional[int] = None):
+    """
+    Runs an export worker. Worker processes other than the first (process_num > 0) use their own filter consumer
+    group, so each holds a full filter snapshot, and leave table management to the first process.
+    """
+    # installed first, the default action of SIGUSR1/SIGUSR2 would terminate the process
+    if config.profiling.enabled:
+        ew.Profiler(
+            path=config.profiling.path,
+            mode=config.profiling.mode,
+            sample_interval=config.profiling.sample_interval,
+            tracemalloc_frames=config.profiling.tracemalloc_frames
+        ).install()
+    metrics = ew.Metrics() if config.metrics_server.enabled else None
+    json_codec = ew.get_json_codec(config.json_codec)
+    db_conn_ew = connect_db(config)
     kafka_filter_consumer_config = {
         "metadata.broker.list": config.kafka.metadata_broker_list,
-        "group.id": f"{config.kafka_filter_consumer_group_id}_{config.kafka.id_postfix}",
+        "group.id": f"{config.kafka_filter_consumer_group_id}_{config.kafka.id_postfix}" + (f"_{process_num}" if process_num else ""),
         "auto.offset.reset": "earliest",
     }
     util.logger.debug("kafka filter consumer config", {"values": f"{kafka_filter_consumer_config}"})
     kafka_filter_consumer_logger = util.logger.getChild("kafka_filter_consumer")
     kafka_filter_consumer_logger.propagate = False
     kafka_filter_consumer = confluent_kafka.Consumer(kafka_filter_consumer_config, logger=kafka_filter_consumer_logger)
+    filter_snapshot = None
+    filter_sync_delay = config.kafka_filter_client.sync_delay
+    if config.kafka_filter_client.snapshot_path:
+        os.makedirs(config.kafka_filter_client.snapshot_path, exist_ok=True)
+        filter_snapshot = ew.FilterSnapshot(
+            path=os.path.join(config.kafka_filter_client.snapshot_path, f"{process_num or 0}.snapshot"),
+            filter_topic=config.kafka_filter_client.filter_topic,
+            interval=config.kafka_filter_client.snapshot_interval
+        )
+        if filter_snapshot.load():
+            # replayed filters are already complete, no need to wait for further filter messages
+            filter_sync_delay = 0
+        kafka_filter_consumer = ew.SnapshotConsumer(kafka_consumer=kafka_filter_consumer, snapshot=filter_snapshot)
     filter_client = ew_lib.FilterClient(
         kafka_consumer=kafka_filter_consumer,
         filter_topic=config.kafka_filter_client.filter_topic,
@@ -71,57 +102,222 @@ if __name__ == '__main__':
     kafka_data_consumer_logger = util.logger.getChild("kafka_data_consumer")
     kafka_data_consumer_logger.propagate = False
     kafka_data_consumer = confluent_kafka.Consumer(kafka_data_consumer_config, logger=kafka_data_consumer_logger)
+    offset_tracker = ew.OffsetTracker(kafka_consumer=kafka_data_consumer)
     data_client = ew_lib.DataClient(
-        kafka_consumer=kafka_data_consumer,
+        kafka_consumer=offset_tracker,
         filter_client=filter_client,
         subscribe_interval=config.kafka_data_client.subscribe_interval,
-        handle_offsets=True,
+        handle_offsets=False,
         kafka_msg_err_ignore=[int(e) for e in config.kafka_data_client.kafka_msg_err_ignore.split(",")] if isinstance(config.kafka_data_client.kafka_msg_err_ignore, str) and config.kafka_data_client.kafka_msg_err_ignore else [config.kafka_data_client.kafka_msg_err_ignore],
         logger=util.logger
     )
-    export_worker = ew.ExportWorker(
-        db_conn=db_conn_ew,
-        data_client=data_client,
-        filter_client=filter_client,
-        get_data_timeout=config.get_data_timeout,
-        get_data_limit=config.get_data_limit,
-        page_size=config.page_size
-    )
+    ew.install_json_decoder(json_codec)
+    writer_pool = None
+    if config.engine == ew.Engine.asyncio:
+        writer_pool = ew.AsyncWriterPool(
+            connect_kwargs={
+                "host": config.timescaledb.host,
+                "port": config.timescaledb.port,
+                "database": config.timescaledb.database,
+                "user": config.timescaledb.username,
+                "password": config.timescaledb.password
+            },
+            pool_size=config.async_pool_size,
+            write_mode=config.write_mode,
+            metrics=metrics
+        )
+    elif config.writers > 1:
+        writer_pool = ew.WriterPool(
+            db_conns=[db_conn_ew] + [connect_db(config) for _ in range(config.writers - 1)],
+            page_size=config.page_size,
+            write_mode=config.write_mode,
+            stmt_cache_size=config.stmt_cache_size,
+            metrics=metrics,
+            connect=functools.partial(connect_db, config)
+        )
+    batch_controller = None
+    if config.batch_control.mode:
+        batch_controller = ew.BatchController(
+            mode=config.batch_control.mode,
+            limit=config.get_data_limit,
+            timeout=config.get_data_timeout,
+            min_limit=config.batch_control.min_limit,
+            max_limit=config.batch_control.max_limit,
+            min_timeout=config.batch_control.min_timeout,
+            max_timeout=config.batch_control.max_timeout,
+            target_latency=config.batch_control.target_latency
+        )
     kafka_metrics_producer = None
-    if config.table_manager.metrics:
+    if config.table_manager.metrics or config.error_reporting.dead_letter_topic:
         kafka_metrics_producer_config = {
             "metadata.broker.list": config.kafka.metadata_broker_list,
             "client.id": f"{config.kafka_metrics_producer.client_id}_{config.kafka.id_postfix}",
-            "auto.offset.reset": "earliest",
+            "linger.ms": config.kafka_metrics_producer.linger_ms
         }
         kafka_metrics_producer_logger = util.logger.getChild("kafka_metrics_producer")
         kafka_metrics_producer_logger.propagate = False
-        kafka_metrics_producer = confluent_kafka.Producer(kafka_filter_consumer_config, logger=kafka_metrics_producer_logger)
-    table_manager = ew.TableManager(
-        db_conn=db_conn_tm,
-        filter_client=filter_client,
+        kafka_metrics_producer = confluent_kafka.Producer(kafka_metrics_producer_config, logger=kafka_metrics_producer_logger)
+    error_reporter = ew.ErrorReporter(
+        log_interval=config.error_reporting.log_interval,
         kafka_producer=kafka_metrics_producer,
-        metrics_topic=config.kafka_metrics_producer.metrics_topic,
-        distributed_hypertables=config.timescaledb.distributed_hypertables,
-        hypertable_replication_factor=config.timescaledb.hypertable_replication_factor,
-        timeout=config.table_manager.timeout,
-        retries=config.table_manager.retries,
-        retry_delay=config.table_manager.retry_delay,
+        dead_letter_topic=config.error_reporting.dead_letter_topic,
+        metrics=metrics,
+        json_codec=json_codec
+    )
+    spool = None
+    if config.spool_path:
+        spool = ew.Spool(
+            path=os.path.join(config.spool_path, str(process_num or 0)),
+            max_size=config.spool_max_size,
+            segment_size=config.spool_segment_size,
+            sync_interval=config.spool_sync_interval
+        )
+    export_worker = ew.ExportWorker(
+        db_conn=db_conn_ew,
+        data_client=data_client,
+        filter_client=filter_client,
+        get_data_timeout=config.get_data_timeout,
+        get_data_limit=config.get_data_limit,
+        page_size=config.page_size,
+        write_mode=config.write_mode,
+        offset_tracker=offset_tracker,
+        pipeline=config.pipeline,
+        pipeline_size=config.pipeline_size,
+        writer_pool=writer_pool,
+        datetime_cache_size=config.datetime_cache_size,
+        stmt_cache_size=config.stmt_cache_size,
+        fill_missing_columns=config.fill_missing_columns,
+        dedup_window=config.dedup_window,
+        dedup_ttl=config.dedup_ttl,
+        metrics=metrics,
+        batch_controller=batch_controller,
+        error_reporter=error_reporter,
+        spool=spool,
+        spool_retry_interval=config.spool_retry_interval,
+        connect=functools.partial(connect_db, config),
+        reconnect_retries=config.reconnect_retries,
+        reconnect_delay=config.reconnect_delay,
+        reconnect_max_delay=config.reconnect_max_delay,
+        pause_partitions=config.pause_partitions,
+        batch_max_bytes=config.batch_max_bytes,
+        streaming=config.streaming
     )
-    filter_client.set_on_sync(callable=export_worker.set_filter_sync, sync_delay=config.kafka_filter_client.sync_delay)
-    filter_client.set_on_put(callable=table_manager.create_table)
-    filter_client.set_on_delete(callable=table_manager.drop_table)
+    table_manager = None
+    table_manager_db_conns = list()
+    if not process_num:
+        table_manager_db_conns = [connect_db(config) for _ in range(max(config.table_manager.workers, 1))]
+        table_manager = ew.TableManager(
+            db_conn=table_manager_db_conns[0],
+            filter_client=filter_client,
+            kafka_producer=kafka_metrics_producer if config.table_manager.metrics else None,
+            metrics_topic=config.kafka_metrics_producer.metrics_topic,
+            distributed_hypertables=config.timescaledb.distributed_hypertables,
+            hypertable_replication_factor=config.timescaledb.hypertable_replication_factor,
+            timeout=config.table_manager.timeout,
+            retries=config.table_manager.retries,
+            retry_delay=config.table_manager.retry_delay,
+            catalog_refresh_interval=config.table_manager.catalog_refresh_interval,
+            ddl_db_conns=table_manager_db_conns[1:],
+            hypertable_defaults={
+                ew.model.ExportArgs.chunk_time_interval: config.timescaledb.chunk_time_interval,
+                ew.model.ExportArgs.compress_after: config.timescaledb.compress_after,
+                ew.model.ExportArgs.drop_after: config.timescaledb.drop_after
+            },
+            aggregate_buckets=tuple(i.strip() for i in config.timescaledb.aggregate_buckets.split(",") if i.strip()),
+            metrics=metrics,
+            json_codec=json_codec
+        )
+    filter_client.set_on_sync(callable=export_worker.set_filter_sync, sync_delay=filter_sync_delay)
+    monitor_callables = [export_worker.is_alive, filter_client.is_alive, data_client.is_alive]
+    shutdown_callables = [export_worker.stop, data_client.stop, filter_client.stop]
+    join_callables = [data_client.join, filter_client.join, error_reporter.close, db_conn_ew.close, kafka_data_consumer.close, kafka_filter_consumer.close]
+    if table_manager:
+        filter_client.set_on_put(callable=chain_callables(export_worker.put_filter, table_manager.create_table))
+        filter_client.set_on_delete(callable=chain_callables(table_manager.drop_table, export_worker.delete_filter))
+        monitor_callables.append(table_manager.is_alive)
+        shutdown_callables.append(table_manager.stop)
+        join_callables.insert(2, table_manager.join)
+        join_callables.extend(db_conn.close for db_conn in table_manager_db_conns)
+    else:
+        filter_client.set_on_put(callable=export_worker.put_filter)
+        filter_client.set_on_delete(callable=export_worker.delete_filter)
+    if spool:
+        join_callables.append(spool.close)
+    if filter_snapshot:
+        join_callables.insert(2, filter_snapshot.save)
+    if writer_pool:
+        monitor_callables.append(writer_pool.is_alive)
+        shutdown_callables.append(writer_pool.stop)
+        join_callables.insert(3, writer_pool.join)
+    metrics_server = None
+    if metrics:
+        metrics_server = ew.MetricsServer(metrics=metrics, port=config.metrics_server.port + (process_num or 0))
+        shutdown_callables.append(metrics_server.stop)
+        join_callables.append(metrics_server.join)
     watchdog = cncr_wdg.Watchdog(
-        monitor_callables=[export_worker.is_alive, filter_client.is_alive, data_client.is_alive, table_manager.is_alive],
-        shutdown_callables=[export_worker.stop, data_client.stop, filter_client.stop, table_manager.stop],
-        join_callables=[data_client.join, filter_client.join, table_manager.join, db_conn_ew.close, db_conn_tm.close, kafka_data_consumer.close, kafka_filter_consumer.close],
+        monitor_callables=monitor_callables,
+        shutdown_callables=shutdown_callables,
+        join_callables=join_callables,
         shutdown_signals=[signal.SIGTERM, signal.SIGINT, signal.SIGABRT],
         monitor_delay=config.watchdog.monitor_delay,
         logger=util.logger
     )
     watchdog.start(delay=config.watchdog.start_delay)
-    table_manager.start()
+    if writer_pool:
+        writer_pool.start()
+    if metrics_server:
+        metrics_server.start()
+    if table_manager:
+        table_manager.start()
     filter_client.start()
     data_client.start()
     export_worker.run()
     watchdog.join()
+
+
+def run_process(process_num: int):
+    config = util.Config(prefix="conf")
+    util.init_logger(config.logger_level)
+    util.logger.info("starting export worker process", {"process_num": process_num})
+    run_export_worker(config=config, process_num=process_num)
+
+
+def forward_signal(processes: typing.List[multiprocessing.Process], signum, _):
+    for process in processes:
+        if process.pid and process.is_alive():
+            os.kill(process.pid, signum)
+
+
+def run_supervisor(config: util.Config):
+    """
+    Runs config.processes worker processes in the same consumer group. If a process exits, all processes are
+    shut down.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=run_process, args=(num, ), name=f"export-worker-{num}") for num in range(config.processes)]
+    watchdog = cncr_wdg.Watchdog(
+        monitor_callables=[process.is_alive for process in processes],
+        shutdown_callables=[process.terminate for process in processes],
+        join_callables=[process.join for process in processes],
+        shutdown_signals=[signal.SIGTERM, signal.SIGINT, signal.SIGABRT],
+        monitor_delay=config.watchdog.monitor_delay,
+        logger=util.logger
+    )
+    watchdog.start(delay=config.watchdog.start_delay)
+    if config.profiling.enabled:
+        signal.signal(signal.SIGUSR1, functools.partial(forward_signal, processes))
+        signal.signal(signal.SIGUSR2, functools.partial(forward_signal, processes))
+    for process in processes:
+        process.start()
+    watchdog.join()
+
+
+if __name__ == '__main__':
+    config = util.Config(prefix="conf")
+    util.init_logger(config.logger_level)
+    util.logger.info("starting export worker", util.read_git_commit("git_commit"))
+    util.logger.debug("export worker config", {"values": f"{config}"})
+    if config.processes > 1:
+        run_supervisor(config)
+    else:
+        run_export_worker(config)
@@ -15,3 +15,20 @@
 """
 
 from .test_export_worker import *
+from .test_util import *
+from .test_offset_tracker import *
+from .test_converter import *
+from .test_dedup import *
+from .test_metrics import *
+from .test_batch_control import *
+from .test_writer import *
+from .test_error_reporter import *
+from .test_table_catalog import *
+from .test_spool import *
+from .test_filter_snapshot import *
+from .test_json_codec import *
+from .test_profiler import *
+from .test_pipeline import *
+from .test_plan import *
+from .test_table_manager import *
+from .test_async_writer import *
@@ -15,6 +15,8 @@
 """
 
 import confluent_kafka
+import psycopg2
+import psycopg2.extensions
 import json
 import queue
 import typing
@@ -137,3 +139,175 @@ class MockKafkaConsumer(confluent_kafka.Consumer):
             else:
                 assert tp.offset == self.__offsets[key] + 1
             self.__offsets[key] = tp.offset
+
+
+class MockDBCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = -1
+        self.__rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def mogrify(self, query, vars=None):
+        if isinstance(query, str):
+            query = query.encode()
+        if vars is None:
+            return query
+        return query % tuple(psycopg2.extensions.adapt(item).getquoted() for item in vars)
+
+    def execute(self, query, vars=None):
+        statement = self.mogrify(query, vars)
+        self.connection.record(statement)
+        self.__rows = self.connection.get_result(statement)
+        self.rowcount = len(self.__rows) if self.__rows is not None else -1
+
+    def copy_expert(self, sql, file, size=8192):
+        self.connection.record(sql.encode() + b"\n" + file.read().encode())
+
+    def fetchall(self):
+        return self.__rows or list()
+
+
+class MockDBConnection:
+    encoding = "UTF8"
+    closed = 0
+
+    def __init__(self, record=True, fail_on=None, error=psycopg2.ProgrammingError, fail_count=None, results=None):
+        self.__results = results or dict()
+        self.__record = record
+        self.__fail_on = fail_on
+        self.__error = error
+        self.__fail_count = fail_count
+        self.statements = list()
+        self.statement_count = 0
+        self.statement_bytes = 0
+        self.commits = 0
+
+    def record(self, statement: bytes):
+        if self.__fail_on and self.__fail_on.encode() in statement and self.__fail_count != 0:
+            if self.__fail_count:
+                self.__fail_count -= 1
+            raise self.__error(f"mock error: {self.__fail_on}")
+        self.statement_count += 1
+        self.statement_bytes += len(statement)
+        if self.__record:
+            self.statements.append(statement.decode())
+
+    def get_result(self, statement: bytes):
+        for key, rows in self.__results.items():
+            if key.encode() in statement:
+                return rows
+
+    def cursor(self):
+        return MockDBCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def reset(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class MockFilterResult:
+    def __init__(self, data=None, filter_ids=None, ex=None):
+        self.data = data
+        self.filter_ids = filter_ids or list()
+        self.ex = ex
+
+
+class MockFilterHandler:
+    def __init__(self, filters):
+        self.filters = {item["payload"]["id"]: item["payload"] for item in filters if item["method"] == "put"}
+
+    def get_filter_args(self, id):
+        return self.filters[id]["args"]
+
+
+class MockFilterClient:
+    def __init__(self, filters):
+        self.handler = MockFilterHandler(filters)
+
+
+def gen_filter_results(filters, data, export_id):
+    """
+    Maps the messages that match the identifiers of an export like mf_lib does.
+    """
+    payload = MockFilterHandler(filters).filters[export_id]
+    results = list()
+    for message in data:
+        if all(message.get(item["key"]) == item["value"] for item in payload["identifiers"]):
+            values = {dst.split(":")[0]: message[src] for dst, src in payload["mappings"].items() if src in message}
+            results.append(MockFilterResult(data=values, filter_ids=[export_id]))
+    return results
+
+
+class MockDataClient:
+    def __init__(self, batches, offset_tracker=None, msg_count=None):
+        self.__batches = list(batches)
+        self.__offset_tracker = offset_tracker
+        self.__msg_count = msg_count
+        self.stored = 0
+
+    def get_exports_batch(self, timeout, limit, data_ignore_missing_keys=False):
+        if self.__batches:
+            batch = self.__batches.pop(0)
+            if self.__offset_tracker:
+                self.__offset_tracker.consumed(len(batch) if self.__msg_count is None else self.__msg_count)
+            return batch, list()
+        time.sleep(timeout)
+
+    def empty(self):
+        return not self.__batches
+
+    def store_offsets(self):
+        self.stored += 1
+
+
+class MockOffsetTracker:
+    """
+    Hands out one offset per consumed batch and records stored offsets together with the commits at that time.
+    """
+    def __init__(self, db_conn=None):
+        self.__db_conn = db_conn
+        self.__offset = 0
+        self.__popped = 0
+        self.messages = 0
+        self.bytes = 0
+        self.stored = list()
+
+    def consumed(self, msg_count):
+        self.__offset += 1
+        self.messages += msg_count
+
+    def pop_offsets(self):
+        if self.__offset == self.__popped:
+            return list()
+        self.__popped = self.__offset
+        return [self.__offset]
+
+    def store_offsets(self, offsets):
+        self.stored.append((offsets, self.__db_conn.commits if self.__db_conn else None))
+
+
+class MockBatchController:
+    def __init__(self, limit=10, timeout=0.05):
+        self.limit = limit
+        self.timeout = timeout
+        self.msg_counts = list()
+
+    def observe_batch(self, msg_count, limit):
+        self.msg_counts.append(msg_count)
+
+    def observe_write(self, duration):
+        pass
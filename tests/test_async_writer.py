@@ -0,0 +1,169 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+import unittest.mock
+import contextlib
+import datetime
+import types
+import zoneinfo
+import ew.async_writer
+import ew
+
+
+class MockPostgresConnectionError(Exception):
+    pass
+
+
+class MockParameter:
+    def __init__(self, name):
+        self.name = name
+
+
+class MockPreparedStatement:
+    def __init__(self, types):
+        self.__types = types
+
+    def get_parameters(self):
+        return tuple(MockParameter(name) for name in self.__types)
+
+
+class MockAsyncConnection:
+    """
+    Records executed statements, columns named 'time' are timestamptz, other columns bigint.
+    """
+    def __init__(self, pool):
+        self.__pool = pool
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def fetchval(self, query):
+        return self.__pool.timezone
+
+    async def prepare(self, stmt):
+        columns = stmt.split("(", 1)[1].split(")", 1)[0].split(", ")
+        return MockPreparedStatement(["timestamptz" if column == '"time"' else "int8" for column in columns])
+
+    def _check(self, table_name):
+        if table_name in self.__pool.fail_on:
+            raise self.__pool.fail_on[table_name]
+
+    async def executemany(self, stmt, rows, timeout=None):
+        self._check(stmt.split('"')[1])
+        self.__pool.calls.append(("executemany", stmt, list(rows)))
+
+    async def copy_records_to_table(self, table_name, records, columns, timeout=None):
+        self._check(table_name)
+        self.__pool.calls.append(("copy", table_name, tuple(columns), list(records)))
+
+
+class MockAsyncPool:
+    def __init__(self, timezone="UTC", fail_on=None):
+        self.timezone = timezone
+        self.fail_on = fail_on or dict()
+        self.calls = list()
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, timeout=None):
+        yield MockAsyncConnection(self)
+
+    async def close(self):
+        pass
+
+
+def gen_asyncpg(pool):
+    async def create_pool(**kwargs):
+        return pool
+
+    return types.SimpleNamespace(
+        create_pool=create_pool,
+        PostgresConnectionError=MockPostgresConnectionError,
+        InterfaceError=type("InterfaceError", (Exception, ), {}),
+        exceptions=types.SimpleNamespace(OperatorInterventionError=type("OperatorInterventionError", (Exception, ), {}))
+    )
+
+
+def gen_rows_batch(table_name, unique_col=None, val=1):
+    return {table_name: (f"export-{table_name}", unique_col, [(("time", "val"), [(datetime.datetime(2022, 1, 1), val)])])}
+
+
+class TestAsyncWriterPool(unittest.TestCase):
+    def _start_pool(self, pool, write_mode=ew.model.WriteMode.insert):
+        patch = unittest.mock.patch.object(ew.async_writer, "asyncpg", gen_asyncpg(pool))
+        patch.start()
+        self.addCleanup(patch.stop)
+        writer_pool = ew.AsyncWriterPool(connect_kwargs=dict(), write_mode=write_mode)
+        self.addCleanup(writer_pool.join)
+        self.addCleanup(writer_pool.stop)
+        writer_pool.start()
+        return writer_pool
+
+    def _write(self, writer_pool, rows_batch):
+        state = writer_pool.submit(rows_batch=rows_batch)
+        self.assertTrue(state.wait(timeout=5))
+        return state
+
+    def test_insert(self):
+        # naive datetimes are in the session time zone like psycopg2 timestamp literals
+        pool = MockAsyncPool(timezone="Europe/Berlin")
+        writer_pool = self._start_pool(pool)
+        state = self._write(writer_pool, gen_rows_batch("tab_1"))
+        self.assertIsNone(state.error)
+        self.assertEqual(pool.calls, [("executemany", 'INSERT INTO "tab_1" ("time", "val") VALUES ($1, $2)', [(datetime.datetime(2022, 1, 1, tzinfo=zoneinfo.ZoneInfo("Europe/Berlin")), 1)])])
+
+    def test_upsert(self):
+        pool = MockAsyncPool()
+        writer_pool = self._start_pool(pool, write_mode=ew.model.WriteMode.copy)
+        self._write(writer_pool, gen_rows_batch("tab_1", unique_col="time"))
+        self.assertEqual(pool.calls[0][0], "executemany")
+        self.assertIn('ON CONFLICT ("time") DO UPDATE SET "val"=EXCLUDED."val"', pool.calls[0][1])
+
+    def test_copy(self):
+        pool = MockAsyncPool()
+        writer_pool = self._start_pool(pool, write_mode=ew.model.WriteMode.copy)
+        self._write(writer_pool, {"tab_1": ("export-1", None, [(("time", "val"), [(datetime.datetime(2022, 1, 1), ew.util.DEFAULT), (datetime.datetime(2022, 1, 2), 2)])])})
+        # DEFAULT values are omitted
+        self.assertEqual(pool.calls, [
+            ("copy", "tab_1", ("time", ), [(datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc), )]),
+            ("copy", "tab_1", ("time", "val"), [(datetime.datetime(2022, 1, 2, tzinfo=datetime.timezone.utc), 2)])
+        ])
+
+    def test_failures(self):
+        pool = MockAsyncPool(fail_on={"tab_bad": ValueError("mock error"), "tab_lost": MockPostgresConnectionError("mock error")})
+        writer_pool = self._start_pool(pool)
+        rows_batch = dict(**gen_rows_batch("tab_1"), **gen_rows_batch("tab_bad"), **gen_rows_batch("tab_lost"))
+        state = self._write(writer_pool, rows_batch)
+        self.assertEqual(state.failed_tables, {"tab_bad"})
+        self.assertEqual(state.error_tables, {"tab_lost"})
+        self.assertIsInstance(state.error, ew.util.WriteRowsError)
+        # the table is rejected until the pool is unblocked
+        del pool.fail_on["tab_lost"]
+        state = self._write(writer_pool, gen_rows_batch("tab_lost", val=2))
+        self.assertEqual(state.error_tables, {"tab_lost"})
+        writer_pool.unblock()
+        state = self._write(writer_pool, gen_rows_batch("tab_lost", val=2))
+        self.assertIsNone(state.error)
+        self.assertEqual([call[1] for call in pool.calls if "tab_lost" in call[1]], ['INSERT INTO "tab_lost" ("time", "val") VALUES ($1, $2)'])
+
+    def test_unknown_timezone(self):
+        with self.assertRaises(RuntimeError):
+            self._start_pool(MockAsyncPool(timezone="Nowhere/Unknown"))
+
+
+if __name__ == '__main__':
+    unittest.main()
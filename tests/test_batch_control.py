@@ -0,0 +1,53 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+import ew
+
+
+class TestBatchController(unittest.TestCase):
+    def test_latency_mode(self):
+        batch_controller = ew.BatchController(mode="latency", limit=1000, timeout=5.0, min_limit=100, max_limit=4000, min_timeout=0.1, max_timeout=10.0, target_latency=2.0)
+        batch_controller.observe_write(0.5)
+        self.assertEqual(batch_controller.timeout, 1.5)
+        batch_controller.observe_batch(msg_count=1000, limit=1000)
+        self.assertEqual(batch_controller.limit, 2000)
+        batch_controller.observe_batch(msg_count=2000, limit=2000)
+        batch_controller.observe_batch(msg_count=4000, limit=4000)
+        self.assertEqual(batch_controller.limit, 4000)
+        batch_controller.observe_write(6.5)
+        self.assertEqual(batch_controller.timeout, 0.1)
+        self.assertEqual(batch_controller.limit, 1739)
+        batch_controller.observe_batch(msg_count=1739, limit=1739)
+        self.assertEqual(batch_controller.limit, 1739)
+
+    def test_throughput_mode(self):
+        batch_controller = ew.BatchController(mode="throughput", limit=1000, timeout=2.0, min_limit=100, max_limit=4000, min_timeout=0.1, max_timeout=4.0)
+        batch_controller.observe_batch(msg_count=100, limit=1000)
+        self.assertEqual(batch_controller.timeout, 3.0)
+        batch_controller.observe_batch(msg_count=100, limit=1000)
+        self.assertEqual(batch_controller.timeout, 4.0)
+        batch_controller.observe_batch(msg_count=950, limit=1000)
+        self.assertEqual(batch_controller.limit, 2000)
+        self.assertAlmostEqual(batch_controller.timeout, 4.0 / 1.5)
+        for _ in range(10):
+            batch_controller.observe_batch(msg_count=batch_controller.limit, limit=batch_controller.limit)
+        self.assertEqual(batch_controller.limit, 4000)
+        self.assertEqual(batch_controller.timeout, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
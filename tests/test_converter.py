@@ -0,0 +1,76 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+import datetime
+import ew.converter
+
+
+formats = (
+    "%Y-%m-%dT%H:%M:%S.%fZ",
+    "%Y-%m-%dT%H:%M:%SZ",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S%z",
+    "%Y-%m-%dT%H:%M:%S.%f%z",
+    "%Y-%m-%d",
+    "%A, %d-%b-%y %H:%M:%S UTC"
+)
+
+values = (
+    "2022-02-09T10:01:01.781Z",
+    "2022-02-09T10:01:01Z",
+    "2022-02-09 10:01:01",
+    "2022-02-09T10:01:01+01:00",
+    "2022-02-09T10:01:01.123456-05:30",
+    "2022-02-09",
+    "Monday, 07-Mar-22 14:22:07 UTC",
+    "2022-2-9T10:01:01.781Z",
+    "2022-02-09T24:00:00",
+    "2022-02-09T10:01:01.7+01Z",
+    "2022-02-09t10:01:01z",
+    "2022-02-09T10:01:01.1234567Z",
+    "2022-02-09T10:01:01,781Z",
+    "2022-02-09T10:01:01+0100",
+    "2022-02-30",
+    "",
+    None
+)
+
+
+class TestConverter(unittest.TestCase):
+    def _parse(self, func, val):
+        try:
+            time_obj = func(val)
+            return time_obj, time_obj.tzinfo
+        except Exception as ex:
+            return type(ex)
+
+    def test_get_datetime_parser(self):
+        for fmt in formats:
+            parser = ew.converter.get_datetime_parser(fmt)
+            cached_parser = ew.converter.get_datetime_parser(fmt, cache_size=4)
+            for val in values:
+                with self.subTest(fmt=fmt, val=val):
+                    result = self._parse(lambda v: datetime.datetime.strptime(v, fmt), val)
+                    self.assertEqual(self._parse(parser, val), result)
+                    self.assertEqual(self._parse(cached_parser, val), result)
+
+    def test_to_datetime_unix(self):
+        self.assertEqual(ew.converter.to_datetime(1646145513, "unix"), datetime.datetime.fromtimestamp(1646145513))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+import ew
+
+
+class TestDedupCache(unittest.TestCase):
+    def test_filter(self):
+        dedup_cache = ew.DedupCache(window_size=2)
+        rows_batch = {"tab_1": ("export-1", "time", [(("time", "val"), [(1, 1), (2, 2), (3, 3)])])}
+        dedup_cache.update(rows_batch=rows_batch)
+        self.assertEqual(
+            dedup_cache.filter("tab_1", "time", [(("time", "val"), [(1, 1), (2, 2), (3, 3), (3, 4)]), (("time", ), [(2, )])]),
+            [(("time", "val"), [(1, 1), (3, 4)]), (("time", ), [(2, )])]
+        )
+        self.assertEqual(dedup_cache.hits, 2)
+        self.assertEqual(dedup_cache.misses, 3)
+
+    def test_update_failed_tables(self):
+        dedup_cache = ew.DedupCache(window_size=10)
+        rows_batch = {"tab_1": ("export-1", "time", [(("time", "val"), [(1, 1)])])}
+        dedup_cache.update(rows_batch=rows_batch, failed_tables={"tab_1"})
+        self.assertEqual(dedup_cache.filter("tab_1", "time", rows_batch["tab_1"][2]), rows_batch["tab_1"][2])
+        dedup_cache.update(rows_batch=rows_batch)
+        self.assertEqual(dedup_cache.filter("tab_1", "time", rows_batch["tab_1"][2]), [])
+        dedup_cache.evict_table("tab_1")
+        self.assertEqual(dedup_cache.filter("tab_1", "time", rows_batch["tab_1"][2]), rows_batch["tab_1"][2])
+
+    def test_hash_collision(self):
+        self.assertEqual(hash(-1), hash(-2))
+        dedup_cache = ew.DedupCache(window_size=10)
+        dedup_cache.update(rows_batch={"tab_1": ("export-1", "time", [(("time", "val"), [(1, -1)])])})
+        self.assertEqual(dedup_cache.filter("tab_1", "time", [(("time", "val"), [(1, -2)])]), [(("time", "val"), [(1, -2)])])
+        self.assertEqual(dedup_cache.filter("tab_1", "time", [(("time", "val"), [(1, -1)])]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
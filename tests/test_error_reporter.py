@@ -0,0 +1,88 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+import unittest.mock
+import json
+import threading
+import sys
+import util
+import ew
+
+
+class MockKafkaProducer:
+    def __init__(self):
+        self.messages = list()
+
+    def produce(self, topic, value=None, key=None, on_delivery=None, *args, **kwargs):
+        self.messages.append((topic, key, json.loads(value)))
+
+    def poll(self, timeout=None):
+        return 0
+
+    def flush(self, timeout=None):
+        return 0
+
+
+class TestErrorReporter(unittest.TestCase):
+    def test_report(self):
+        kafka_producer = MockKafkaProducer()
+        metrics = ew.Metrics()
+        error_reporter = ew.ErrorReporter(log_interval=60, kafka_producer=kafka_producer, dead_letter_topic="dead-letters", metrics=metrics)
+        for _ in range(3):
+            error_reporter.report("export-1", ValueError("bad timestamp"), {"time": "x"})
+        error_reporter.report("export-2", KeyError("val"))
+        self.assertEqual(error_reporter.dead_letter_count, 4)
+        self.assertEqual(kafka_producer.messages[0][:2], ("dead-letters", "export-1"))
+        self.assertEqual(kafka_producer.messages[0][2]["data"], {"time": "x"})
+        self.assertEqual(kafka_producer.messages[-1][2]["error_type"], "KeyError")
+        self.assertIn('ew_conversion_errors_total{error_type="ValueError"} 3', metrics.collect())
+        error_reporter.close()
+
+    def test_no_dead_letter_topic(self):
+        kafka_producer = MockKafkaProducer()
+        error_reporter = ew.ErrorReporter(log_interval=0, kafka_producer=kafka_producer)
+        error_reporter.report("export-1", ValueError("bad timestamp"))
+        self.assertEqual(kafka_producer.messages, [])
+
+    def test_concurrent_report(self):
+        error_reporter = ew.ErrorReporter(log_interval=60)
+        counts = list()
+        done = threading.Event()
+
+        def report():
+            for _ in range(2000):
+                error_reporter.report("export-1", ValueError("bad timestamp"))
+
+        def log():
+            while not done.is_set():
+                error_reporter.log()
+
+        # frequent thread switches to provoke races
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+        with unittest.mock.patch.object(util.logger, "error", lambda msg, kwargs: counts.append(kwargs["count"])):
+            log_thread = threading.Thread(target=log)
+            log_thread.start()
+            threads = [threading.Thread(target=report) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            done.set()
+            log_thread.join()
+            error_reporter.log()
+        self.assertEqual(sum(counts), 8000)
@@ -0,0 +1,76 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from ._util import *
+import unittest
+import tempfile
+import json
+import os
+import confluent_kafka
+import ew
+
+
+def gen_filter_msg(method, export_id, num=0):
+    return {"method": method, "payload": {"id": export_id, "num": num}, "timestamp": 1646145513 + num}
+
+
+class MockAssignConsumer(MockKafkaConsumer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.assigned = None
+        self.on_assign = None
+
+    def subscribe(self, topics, on_assign=None, *args, **kwargs):
+        self.on_assign = on_assign
+
+    def assign(self, partitions):
+        self.assigned = partitions
+
+
+class TestFilterSnapshot(unittest.TestCase):
+    def test_snapshot(self):
+        messages = [gen_filter_msg("put", "a"), gen_filter_msg("put", "b", 1), gen_filter_msg("put", "a", 2), gen_filter_msg("delete", "b", 3), gen_filter_msg("put", "c", 4)]
+        with tempfile.TemporaryDirectory() as path:
+            snapshot = ew.FilterSnapshot(path=os.path.join(path, "snapshot"), filter_topic="filters")
+            consumer = ew.SnapshotConsumer(kafka_consumer=MockKafkaConsumer(data=messages, sources=False), snapshot=snapshot)
+            self.assertEqual(len(consumer.consume(num_messages=10, timeout=0.1)), 5)
+            snapshot.save()
+            snapshot = ew.FilterSnapshot(path=os.path.join(path, "snapshot"), filter_topic="filters")
+            self.assertTrue(snapshot.load())
+            self.assertEqual(len(snapshot), 2)
+            kafka_consumer = MockAssignConsumer(data=[gen_filter_msg("put", "d", 5)], sources=False)
+            consumer = ew.SnapshotConsumer(kafka_consumer=kafka_consumer, snapshot=snapshot)
+            consumer.subscribe(["filters"], on_assign=lambda c, partitions: None)
+            kafka_consumer.on_assign(kafka_consumer, [confluent_kafka.TopicPartition("filters", 0, confluent_kafka.OFFSET_BEGINNING)])
+            self.assertEqual(kafka_consumer.assigned[0].offset, 5)
+            self.assertIs(consumer.assigned, kafka_consumer.assigned)
+            replayed = [consumer.poll(timeout=0.1) for _ in range(2)]
+            self.assertEqual([msg.offset() for msg in replayed], [2, 4])
+            self.assertEqual(json.loads(replayed[0].value()), gen_filter_msg("put", "a", 2))
+            self.assertEqual(consumer.poll(timeout=0.1).offset(), 0)
+            self.assertIsNone(consumer.poll(timeout=0.1))
+
+    def test_corrupt(self):
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, "snapshot"), "wb") as file:
+                file.write(b"\x00\x01\x02\x03\x04")
+            snapshot = ew.FilterSnapshot(path=os.path.join(path, "snapshot"), filter_topic="filters")
+            self.assertFalse(snapshot.load())
+            self.assertEqual(len(snapshot), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+import json
+import os
+import sys
+import tempfile
+import types
+import ew
+
+
+class TestJSONCodec(unittest.TestCase):
+    def test_codecs(self):
+        with open("tests/resources/data.json") as file:
+            items = json.load(file)
+        for name in ("json", "orjson", "auto"):
+            codec = ew.get_json_codec(name)
+            for item in items:
+                payload = json.dumps(item)
+                self.assertEqual(codec.loads(payload), item)
+                self.assertEqual(codec.loads(payload.encode()), item)
+                self.assertEqual(json.loads(codec.dumps(item)), item)
+            self.assertEqual(codec.loads('{"val": NaN, "big": 123456789012345678901234567890}')["big"], 123456789012345678901234567890)
+            with self.assertRaises(json.JSONDecodeError):
+                codec.loads("{")
+        with self.assertRaises(ValueError):
+            ew.get_json_codec("test")
+
+    def test_install_json_decoder(self):
+        calls = list()
+        codec = ew.JSONCodec(name="test", loads=lambda data: calls.append(data) or json.loads(data), dumps=json.dumps)
+        module = types.ModuleType("test_pkg.client")
+        module.json = json
+        module.loads = json.loads
+        sys.modules["test_pkg"] = types.ModuleType("test_pkg")
+        sys.modules["test_pkg.client"] = module
+        try:
+            self.assertEqual(ew.install_json_decoder(codec, package="test_pkg"), 1)
+            self.assertEqual(module.json.loads("[1]"), [1])
+            self.assertEqual(module.loads("[2]"), [2])
+            self.assertEqual(module.json.loads("[3]", parse_int=str), ["3"])
+            self.assertIs(module.json.JSONDecodeError, json.JSONDecodeError)
+            self.assertEqual(calls, ["[1]", "[2]"])
+        finally:
+            del sys.modules["test_pkg"]
+            del sys.modules["test_pkg.client"]
+
+    def test_install_json_decoder_import(self):
+        codec = ew.JSONCodec(name="test", loads=lambda data: json.loads(data), dumps=json.dumps)
+        with tempfile.TemporaryDirectory() as path:
+            os.makedirs(os.path.join(path, "test_pkg_disk"))
+            with open(os.path.join(path, "test_pkg_disk", "__init__.py"), "w") as file:
+                file.write("")
+            with open(os.path.join(path, "test_pkg_disk", "client.py"), "w") as file:
+                file.write("import json\n")
+            with open(os.path.join(path, "test_pkg_disk", "other.py"), "w") as file:
+                file.write("")
+            sys.path.insert(0, path)
+            try:
+                self.assertEqual(ew.install_json_decoder(codec, package="test_pkg_disk"), 1)
+                self.assertIsNot(sys.modules["test_pkg_disk.client"].json, json)
+                self.assertIs(sys.modules["test_pkg_disk.other"].__dict__.get("json"), None)
+                with self.assertLogs("ew", level="WARNING"):
+                    self.assertEqual(ew.install_json_decoder(codec, package="test_pkg_disk.other"), 0)
+            finally:
+                sys.path.remove(path)
+                for name in ("test_pkg_disk", "test_pkg_disk.client", "test_pkg_disk.other"):
+                    sys.modules.pop(name, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
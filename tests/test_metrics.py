@@ -0,0 +1,61 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+import socket
+import threading
+import urllib.request
+import ew
+
+
+class TestMetrics(unittest.TestCase):
+    def test_collect(self):
+        metrics = ew.Metrics()
+        metrics.commit.observe(0.003)
+        metrics.commit.observe(50)
+        metrics.table_rows.inc(5, ("tab_\"1", ))
+        metrics.add_gauge("ew_test", "Test gauge.", lambda: 0.5)
+        lines = metrics.collect().splitlines()
+        self.assertIn("ew_commit_seconds_bucket{le=\"0.0025\"} 0", lines)
+        self.assertIn("ew_commit_seconds_bucket{le=\"0.005\"} 1", lines)
+        self.assertIn("ew_commit_seconds_bucket{le=\"+Inf\"} 2", lines)
+        self.assertIn("ew_commit_seconds_count 2", lines)
+        self.assertIn("ew_table_rows_total{table=\"tab_\\\"1\"} 5", lines)
+        self.assertIn("ew_test 0.5", lines)
+
+    def test_server(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        metrics = ew.Metrics()
+        metrics_server = ew.MetricsServer(metrics=metrics, port=port, host="127.0.0.1")
+        metrics_server.start()
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            self.assertEqual(response.read().decode(), metrics.collect())
+        metrics_server.stop()
+        metrics_server.join()
+
+    def test_server_not_started(self):
+        # e.g. startup failed before the server has been started
+        metrics_server = ew.MetricsServer(metrics=ew.Metrics(), port=0, host="127.0.0.1")
+        thread = threading.Thread(target=lambda: (metrics_server.stop(), metrics_server.join()), daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
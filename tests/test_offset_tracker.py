@@ -0,0 +1,81 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from ._util import *
+import unittest
+import json
+import confluent_kafka
+import ew
+
+
+class MockRebalanceConsumer(MockKafkaConsumer):
+    def __init__(self, data, error_code=None):
+        super().__init__(data=data)
+        self.assigned = {(topic, 0) for topic in data}
+        self.stored = list()
+        self.error_code = error_code
+
+    def assignment(self):
+        return [confluent_kafka.TopicPartition(topic, partition) for topic, partition in self.assigned]
+
+    def store_offsets(self, offsets):
+        if self.error_code is not None:
+            raise confluent_kafka.KafkaException(confluent_kafka.KafkaError(self.error_code))
+        for tp in offsets:
+            if (tp.topic, tp.partition) not in self.assigned:
+                raise confluent_kafka.KafkaException(confluent_kafka.KafkaError(confluent_kafka.KafkaError._STATE))
+        self.stored.extend((tp.topic, tp.offset) for tp in offsets)
+
+
+class TestOffsetTracker(unittest.TestCase):
+    def test_pop_offsets(self):
+        offset_tracker = ew.OffsetTracker(kafka_consumer=MockKafkaConsumer(data={"t1": [{"a": 1}, {"a": 2}], "t2": [{"a": 3}]}, msg_error=True))
+        msg_objs = offset_tracker.consume(num_messages=3, timeout=0.1)
+        self.assertEqual(len(msg_objs), 3)
+        offsets = {(tp.topic, tp.partition): tp.offset for tp in offset_tracker.pop_offsets()}
+        self.assertEqual(offsets, {("t1", 0): 2})
+        self.assertEqual(offset_tracker.pop_offsets(), [])
+        offset_tracker.consume(num_messages=10, timeout=0.1)
+        offsets = {(tp.topic, tp.partition): tp.offset for tp in offset_tracker.pop_offsets()}
+        self.assertEqual(offsets, {("t2", 0): 1})
+        self.assertTrue(offset_tracker.empty())
+
+    def test_count_bytes(self):
+        messages = [{"a": 1}, {"a": "value"}]
+        offset_tracker = ew.OffsetTracker(kafka_consumer=MockKafkaConsumer(data={"t1": messages}, msg_error=True))
+        offset_tracker.consume(num_messages=10, timeout=0.1)
+        self.assertEqual(offset_tracker.messages, 2)
+        self.assertEqual(offset_tracker.bytes, sum(len(json.dumps(msg)) for msg in messages))
+
+    def test_store_revoked_offsets(self):
+        consumer = MockRebalanceConsumer(data={"t1": [{"a": 1}], "t2": [{"a": 2}]})
+        offset_tracker = ew.OffsetTracker(kafka_consumer=consumer)
+        offset_tracker.consume(num_messages=2, timeout=0.1)
+        offsets = offset_tracker.pop_offsets()
+        # t2 is revoked while the batch is pending
+        consumer.assigned.discard(("t2", 0))
+        offset_tracker.store_offsets(offsets)
+        self.assertEqual(consumer.stored, [("t1", 1)])
+        # revoked after the assignment has been checked
+        consumer.error_code = confluent_kafka.KafkaError._STATE
+        offset_tracker.store_offsets(offsets)
+        consumer.error_code = 1
+        with self.assertRaises(confluent_kafka.KafkaException):
+            offset_tracker.store_offsets(offsets)
+
+
+if __name__ == '__main__':
+    unittest.main()
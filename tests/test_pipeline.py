@@ -0,0 +1,213 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from ._util import *
+import unittest
+import threading
+import confluent_kafka
+import json
+import re
+import tempfile
+import psycopg2
+import ew
+
+
+with open("tests/resources/data.json") as file:
+    data: list = json.load(file)
+
+with open("tests/resources/filters.json") as file:
+    filters: list = json.load(file)
+
+
+def gen_batches(batch_size=2):
+    results = gen_filter_results(filters, data, "export-1")
+    return [results[pos:pos + batch_size] for pos in range(0, len(results), batch_size)]
+
+
+def run_worker(export_worker, data_client, offset_tracker, batch_count, timeout=5):
+    export_worker.set_filter_sync(err=False)
+    thread = threading.Thread(target=export_worker.run)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while len(offset_tracker.stored) < batch_count and time.monotonic() < deadline and export_worker.is_alive():
+        time.sleep(0.01)
+    export_worker.stop()
+    thread.join()
+
+
+class MockConsumingDataClient(MockDataClient):
+    """
+    Consumes one message of the offset tracker per batch and calls on_consume with the number of consumed messages.
+    """
+    def __init__(self, batches, offset_tracker, on_consume):
+        super().__init__(batches=batches)
+        self.__offset_tracker = offset_tracker
+        self.__on_consume = on_consume
+        self.__consumed = 0
+
+    def get_exports_batch(self, timeout, limit, data_ignore_missing_keys=False):
+        if not self.empty() and self.__offset_tracker.consume(num_messages=1, timeout=0):
+            self.__consumed += 1
+            self.__on_consume(self.__consumed)
+        return super().get_exports_batch(timeout=timeout, limit=limit, data_ignore_missing_keys=data_ignore_missing_keys)
+
+
+class TestPipeline(unittest.TestCase):
+    def test_order(self):
+        batches = gen_batches()
+        db_conn = MockDBConnection()
+        offset_tracker = MockOffsetTracker(db_conn=db_conn)
+        data_client = MockDataClient(batches=batches, offset_tracker=offset_tracker)
+        export_worker = ew.ExportWorker(db_conn=db_conn, data_client=data_client, filter_client=MockFilterClient(filters), get_data_timeout=0.05, offset_tracker=offset_tracker, pipeline=True, pipeline_size=2)
+        run_worker(export_worker, data_client, offset_tracker, len(batches))
+        # offsets are stored in batch order and each only after the commit of its batch
+        self.assertEqual([offsets for offsets, _ in offset_tracker.stored], [[num] for num in range(1, len(batches) + 1)])
+        self.assertEqual([commits for _, commits in offset_tracker.stored], list(range(1, len(batches) + 1)))
+        times = [time_val for stmt in db_conn.statements for time_val in re.findall(r"'(\d{4}-[^']+)'::timestamp", stmt)]
+        self.assertEqual(len(times), sum(len(batch) for batch in batches))
+        self.assertEqual(times, sorted(times))
+
+    def test_partial_failure(self):
+        # tab_1 and tab_4 are written by different writers, the writer of tab_1 loses its connection once
+        results = [gen_filter_results(filters, data, export_id) for export_id in ("export-1", "export-4")]
+        batches = [results[0][pos:pos + 2] + results[1][pos:pos + 2] for pos in range(0, len(results[0]), 2)]
+        db_conns = [MockDBConnection(), MockDBConnection(fail_on="tab_1", error=psycopg2.OperationalError, fail_count=1)]
+        writer_pool = ew.WriterPool(db_conns=db_conns, timeout=0.05)
+        writer_pool.start()
+        offset_tracker = MockOffsetTracker()
+        data_client = MockDataClient(batches=batches, offset_tracker=offset_tracker)
+        export_worker = ew.ExportWorker(db_conn=None, data_client=data_client, filter_client=MockFilterClient(filters), get_data_timeout=0.05, offset_tracker=offset_tracker, pipeline=True, pipeline_size=2, writer_pool=writer_pool, reconnect_retries=3, reconnect_delay=0.01)
+        run_worker(export_worker, data_client, offset_tracker, len(batches))
+        writer_pool.stop()
+        writer_pool.join()
+        self.assertEqual([offsets for offsets, _ in offset_tracker.stored], [[num] for num in range(1, len(batches) + 1)])
+        # rows of the writer that has committed are not written again and rows of each table stay in order
+        for db_conn, table_name in zip(db_conns, ("tab_4", "tab_1")):
+            times = [time_val for stmt in db_conn.statements if table_name in stmt for time_val in re.findall(r"'(\d{4}-[^']+)'::timestamp", stmt)]
+            self.assertEqual(len(times), len(results[0]))
+            self.assertEqual(times, sorted(times))
+
+    def test_batch_controller_msg_count(self):
+        # messages that match no filter are consumed but yield no results
+        batches = gen_batches()
+        offset_tracker = MockOffsetTracker()
+        data_client = MockDataClient(batches=batches, offset_tracker=offset_tracker, msg_count=5)
+        batch_controller = MockBatchController()
+        export_worker = ew.ExportWorker(db_conn=MockDBConnection(), data_client=data_client, filter_client=MockFilterClient(filters), get_data_timeout=0.05, offset_tracker=offset_tracker, batch_controller=batch_controller)
+        run_worker(export_worker, data_client, offset_tracker, len(batches))
+        self.assertEqual(batch_controller.msg_counts[:len(batches)], [5] * len(batches))
+
+    def test_spool_offsets(self):
+        # offsets of spooled batches are stored once the spool has been synced
+        batches = gen_batches()
+        db_conn = MockDBConnection(fail_on="INSERT", error=psycopg2.OperationalError)
+        offset_tracker = MockOffsetTracker()
+        data_client = MockDataClient(batches=batches, offset_tracker=offset_tracker)
+        with tempfile.TemporaryDirectory() as path:
+            spool = ew.Spool(path=path, sync_interval=3600)
+            export_worker = ew.ExportWorker(db_conn=db_conn, data_client=data_client, filter_client=MockFilterClient(filters), get_data_timeout=0.05, offset_tracker=offset_tracker, spool=spool)
+            export_worker.set_filter_sync(err=False)
+            thread = threading.Thread(target=export_worker.run)
+            thread.start()
+            deadline = time.monotonic() + 5
+            while not data_client.empty() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.1)
+            self.assertEqual(offset_tracker.stored, [])
+            export_worker.stop()
+            thread.join()
+            self.assertEqual([offsets for offsets, _ in offset_tracker.stored], [[num] for num in range(1, len(batches) + 1)])
+            self.assertFalse(spool.is_empty())
+            spool.close()
+
+    def test_streaming(self):
+        # lazy rows batches write the same rows as converted batches
+        statements = list()
+        for streaming in (False, True):
+            batches = gen_batches(batch_size=5)
+            db_conn = MockDBConnection()
+            offset_tracker = MockOffsetTracker(db_conn=db_conn)
+            data_client = MockDataClient(batches=batches, offset_tracker=offset_tracker)
+            export_worker = ew.ExportWorker(db_conn=db_conn, data_client=data_client, filter_client=MockFilterClient(filters), get_data_timeout=0.05, offset_tracker=offset_tracker, pipeline=True, streaming=streaming)
+            run_worker(export_worker, data_client, offset_tracker, len(batches))
+            self.assertEqual(offset_tracker.stored, [([num], num) for num in range(1, len(batches) + 1)])
+            statements.append(db_conn.statements)
+        self.assertTrue(any("INSERT" in stmt for stmt in statements[1]))
+        self.assertEqual(statements[1], statements[0])
+
+    def test_spool_full(self):
+        # the spool holds one batch, further batches wait until the spool has been drained
+        batches = gen_batches()
+        db_conn = MockDBConnection(fail_on="INSERT", error=psycopg2.OperationalError, fail_count=3)
+        offset_tracker = MockOffsetTracker()
+        data_client = MockDataClient(batches=batches, offset_tracker=offset_tracker)
+        with tempfile.TemporaryDirectory() as path:
+            max_size = len(ew.spool.encode_batch(ew.ExportWorker(db_conn=None, data_client=None, filter_client=MockFilterClient(filters))._gen_rows_batch(batches[0]))) + 8
+            spool = ew.Spool(path=path, max_size=max_size, sync_interval=0)
+            export_worker = ew.ExportWorker(db_conn=db_conn, data_client=data_client, filter_client=MockFilterClient(filters), get_data_timeout=0.05, offset_tracker=offset_tracker, spool=spool, spool_retry_interval=0.01, reconnect_delay=0.01)
+            run_worker(export_worker, data_client, offset_tracker, len(batches))
+            self.assertEqual([offsets for offsets, _ in offset_tracker.stored], [[num] for num in range(1, len(batches) + 1)])
+            spool.close()
+
+    def test_store_offsets_error(self):
+        batches = gen_batches()
+        db_conn = MockDBConnection()
+        offset_tracker = MockOffsetTracker(db_conn=db_conn)
+
+        def store_offsets(offsets):
+            raise RuntimeError("test")
+
+        offset_tracker.store_offsets = store_offsets
+        data_client = MockDataClient(batches=batches, offset_tracker=offset_tracker)
+        export_worker = ew.ExportWorker(db_conn=db_conn, data_client=data_client, filter_client=MockFilterClient(filters), get_data_timeout=0.05, offset_tracker=offset_tracker, pipeline=True)
+        run_worker(export_worker, data_client, offset_tracker, len(batches))
+        self.assertFalse(export_worker.is_alive())
+        self.assertEqual(db_conn.commits, 1)
+
+    def test_revoked_partition(self):
+        # the partition of the first batch is revoked while the batch is pending
+        batches = gen_batches()
+        consumer = MockKafkaConsumer(data={f"t{num}": [{"num": num}] for num in range(len(batches))})
+        consumer.assigned = {f"t{num}" for num in range(len(batches))}
+        consumer.assignment = lambda: [confluent_kafka.TopicPartition(topic, 0) for topic in consumer.assigned]
+        stored = list()
+
+        def store_offsets(offsets):
+            for tp in offsets:
+                if tp.topic not in consumer.assigned:
+                    raise confluent_kafka.KafkaException(confluent_kafka.KafkaError(confluent_kafka.KafkaError._STATE))
+            stored.extend(tp.topic for tp in offsets)
+
+        consumer.store_offsets = store_offsets
+        db_conn = MockDBConnection()
+        offset_tracker = ew.OffsetTracker(kafka_consumer=consumer)
+        data_client = MockConsumingDataClient(batches=batches, offset_tracker=offset_tracker, on_consume=lambda count: count == 2 and consumer.assigned.discard("t0"))
+        export_worker = ew.ExportWorker(db_conn=db_conn, data_client=data_client, filter_client=MockFilterClient(filters), get_data_timeout=0.05, offset_tracker=offset_tracker, pipeline=True, pipeline_size=2)
+        export_worker.set_filter_sync(err=False)
+        thread = threading.Thread(target=export_worker.run)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while len(stored) < len(batches) - 1 and time.monotonic() < deadline and export_worker.is_alive():
+            time.sleep(0.01)
+        alive = export_worker.is_alive()
+        export_worker.stop()
+        thread.join()
+        self.assertTrue(alive)
+        self.assertEqual(stored[-(len(batches) - 1):], [f"t{num}" for num in range(1, len(batches))])
+
+
+if __name__ == '__main__':
+    unittest.main()
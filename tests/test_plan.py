@@ -0,0 +1,76 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from ._util import *
+import unittest
+import copy
+import json
+import ew
+
+
+with open("tests/resources/data.json") as file:
+    data: list = json.load(file)
+
+with open("tests/resources/filters.json") as file:
+    filters: list = json.load(file)
+
+
+class TestConversionPlan(unittest.TestCase):
+    def test_gen_row(self):
+        filter_client = MockFilterClient(filters)
+        for export_id, payload in filter_client.handler.filters.items():
+            args = payload["args"]
+            plan = ew.plan.ConversionPlan(export_id=export_id, export_args=args)
+            for result in gen_filter_results(filters, data, export_id):
+                with self.subTest(export_id=export_id, data=result.data):
+                    row_cols, row_data = plan.gen_row(result.data)
+                    self.assertEqual(row_cols, tuple(i[0] for i in args["table_columns"] if i[0] in result.data))
+                    self.assertEqual(row_data, ew.util.gen_row(result.data, args["table_columns"], args.get("time_format")))
+                    full_cols, full_data = plan.gen_full_row(result.data)
+                    self.assertEqual(tuple(val for col, val in zip(full_cols, full_data) if col in row_cols), row_data)
+
+
+class TestPlanCache(unittest.TestCase):
+    def test_invalidate(self):
+        filter_client = MockFilterClient(copy.deepcopy(filters))
+        plan_cache = ew.plan.PlanCache(filter_client=filter_client)
+        plan = plan_cache.get("export-1")
+        self.assertIs(plan_cache.get("export-1"), plan)
+        filter_client.handler.filters["export-1"]["args"]["table_name"] = "tab_new"
+        self.assertIs(plan_cache.get("export-1"), plan)
+        plan_cache.invalidate("export-1")
+        self.assertEqual(plan_cache.get("export-1").table_name, "tab_new")
+
+    def test_invalidate_while_building(self):
+        filter_client = MockFilterClient(copy.deepcopy(filters))
+        plan_cache = ew.plan.PlanCache(filter_client=filter_client)
+        get_filter_args = filter_client.handler.get_filter_args
+
+        def update_filter_args(id):
+            # the filter is updated after its old args have been read for a new plan
+            args = copy.deepcopy(get_filter_args(id))
+            filter_client.handler.filters[id]["args"]["table_name"] = "tab_new"
+            filter_client.handler.get_filter_args = get_filter_args
+            plan_cache.invalidate(id)
+            return args
+
+        filter_client.handler.get_filter_args = update_filter_args
+        self.assertEqual(plan_cache.get("export-1").table_name, "tab_1")
+        self.assertEqual(plan_cache.get("export-1").table_name, "tab_new")
+
+
+if __name__ == '__main__':
+    unittest.main()
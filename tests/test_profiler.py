@@ -0,0 +1,74 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+import tempfile
+import threading
+import tracemalloc
+import signal
+import os
+import time
+import ew
+
+
+def list_files(path, prefix):
+    return [name for name in os.listdir(path) if name.startswith(prefix)]
+
+
+class TestProfiler(unittest.TestCase):
+    def test_sampling(self):
+        with tempfile.TemporaryDirectory() as path:
+            profiler = ew.Profiler(path=path, sample_interval=0.001)
+            stop = threading.Event()
+            thread = threading.Thread(target=stop.wait, name="test-thread")
+            thread.start()
+            profiler.start_profile()
+            time.sleep(0.1)
+            profiler.stop_profile()
+            stop.set()
+            thread.join()
+            with open(os.path.join(path, list_files(path, "samples-")[0])) as file:
+                self.assertTrue(any(line.startswith("test-thread;") for line in file))
+
+    def test_cprofile(self):
+        with tempfile.TemporaryDirectory() as path:
+            profiler = ew.Profiler(path=path, mode="cprofile")
+            profiler.toggle_profile()
+            sum(range(1000))
+            profiler.toggle_profile()
+            self.assertEqual(len(list_files(path, "profile-")), 1)
+
+    def test_signals(self):
+        with tempfile.TemporaryDirectory() as path:
+            profiler = ew.Profiler(path=path)
+            handlers = signal.getsignal(signal.SIGUSR1), signal.getsignal(signal.SIGUSR2)
+            profiler.install()
+            try:
+                os.kill(os.getpid(), signal.SIGUSR2)
+                time.sleep(0.1)
+                self.assertTrue(tracemalloc.is_tracing())
+                os.kill(os.getpid(), signal.SIGUSR2)
+                time.sleep(0.2)
+                self.assertEqual(len(list_files(path, "stacks-")), 2)
+                self.assertEqual(len(list_files(path, "tracemalloc-")), 1)
+            finally:
+                signal.signal(signal.SIGUSR1, handlers[0])
+                signal.signal(signal.SIGUSR2, handlers[1])
+                tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+import tempfile
+import datetime
+import os
+import zlib
+import ew
+
+
+def gen_rows_batch(num):
+    return {"tab_1": ("export-1", None, [(("time", "val"), [(datetime.datetime(2022, 1, 1, 0, 0, num), num)])])}
+
+
+class TestSpool(unittest.TestCase):
+    def test_order(self):
+        with tempfile.TemporaryDirectory() as path:
+            spool = ew.Spool(path=path, segment_size=100)
+            for num in range(5):
+                spool.append(gen_rows_batch(num))
+            self.assertGreater(len(os.listdir(path)), 1)
+            for num in range(3):
+                self.assertEqual(spool.peek(), gen_rows_batch(num))
+                self.assertEqual(spool.peek(), gen_rows_batch(num))
+                spool.pop()
+            spool.append(gen_rows_batch(5))
+            for num in range(3, 6):
+                self.assertEqual(spool.peek(), gen_rows_batch(num))
+                spool.pop()
+            self.assertIsNone(spool.peek())
+            self.assertTrue(spool.is_empty())
+            self.assertEqual(os.listdir(path), [])
+            spool.close()
+
+    def test_reopen(self):
+        with tempfile.TemporaryDirectory() as path:
+            spool = ew.Spool(path=path)
+            spool.append(gen_rows_batch(0))
+            spool.append(gen_rows_batch(1))
+            spool.close()
+            with open(os.path.join(path, os.listdir(path)[0]), "ab") as file:
+                file.write(b"\x10\x00")
+            spool = ew.Spool(path=path)
+            self.assertFalse(spool.is_empty())
+            spool.append(gen_rows_batch(2))
+            batches = list()
+            while spool.peek() is not None:
+                batches.append(spool.peek())
+                spool.pop()
+            self.assertEqual(batches, [gen_rows_batch(num) for num in range(3)])
+            spool.close()
+
+    def test_corrupt_records(self):
+        # records in the middle of a segment that fail the checksum or can't be decoded don't discard later records
+        with tempfile.TemporaryDirectory() as path:
+            spool = ew.Spool(path=path)
+            spool.append(gen_rows_batch(0))
+            spool.append(gen_rows_batch(1))
+            spool.close()
+            seg_path = os.path.join(path, os.listdir(path)[0])
+            with open(seg_path, "r+b") as file:
+                data = bytearray(file.read())
+                data[-1] ^= 0xFF
+                file.seek(0)
+                file.write(data)
+            with open(seg_path, "ab") as file:
+                for payload in (b"\x7f", ew.spool.encode_batch(gen_rows_batch(2))):
+                    file.write(ew.spool._header.pack(len(payload), zlib.crc32(payload)) + payload)
+            spool = ew.Spool(path=path)
+            batches = list()
+            while spool.peek() is not None:
+                batches.append(spool.peek())
+                spool.pop()
+            self.assertEqual(batches, [gen_rows_batch(0), gen_rows_batch(2)])
+            spool.close()
+
+    def test_encoding(self):
+        rows_batch = {
+            "tab_1": ("export-1", "time", [
+                (("time", "a", "b", "c", "d"), [
+                    (datetime.datetime(2022, 1, 1, 0, 0, 0, 1), 1, 1.5, "one", True),
+                    (datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone(datetime.timedelta(hours=-5, minutes=-30))), -2 ** 63, float("inf"), "", False),
+                    (datetime.datetime(1900, 1, 1, tzinfo=datetime.timezone.utc), 2 ** 64, -0.0, "ü\n\t", None)
+                ]),
+                (("time", "a"), [(datetime.datetime(2022, 1, 1), ew.util.DEFAULT)])
+            ]),
+            "tab_2": (None, None, [])
+        }
+        decoded = ew.spool.decode_batch(ew.spool.encode_batch(rows_batch))
+        self.assertEqual(decoded, rows_batch)
+        self.assertEqual([row[0].utcoffset() for row in decoded["tab_1"][2][0][1]], [row[0].utcoffset() for row in rows_batch["tab_1"][2][0][1]])
+        self.assertIs(decoded["tab_1"][2][1][1][0][1], ew.util.DEFAULT)
+        with self.assertRaises(TypeError):
+            ew.spool.encode_batch({"tab_1": ("export-1", None, [(("val", ), [(object(), )])])})
+
+    def test_sync_interval(self):
+        with tempfile.TemporaryDirectory() as path:
+            spool = ew.Spool(path=path, sync_interval=3600)
+            self.assertFalse(spool.append(gen_rows_batch(0)))
+            self.assertFalse(spool.sync())
+            self.assertTrue(spool.sync(force=True))
+            self.assertTrue(spool.sync())
+            spool.close()
+            spool = ew.Spool(path=path, sync_interval=0)
+            self.assertTrue(spool.append(gen_rows_batch(1)))
+            spool.close()
+
+    def test_max_size(self):
+        with tempfile.TemporaryDirectory() as path:
+            spool = ew.Spool(path=path, max_size=100)
+            with self.assertRaises(ew.SpoolFullError):
+                for num in range(10):
+                    spool.append(gen_rows_batch(num))
+            spool.close()
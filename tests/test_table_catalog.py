@@ -0,0 +1,56 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+import ew
+
+
+class TestTableCatalog(unittest.TestCase):
+    def test_catalog(self):
+        catalog = ew.TableCatalog()
+        catalog.load([("tab_1", True, ["time", "val"]), ("tab_2", False, None)])
+        self.assertTrue(catalog.exists("tab_1"))
+        self.assertTrue(catalog.get("tab_1").hypertable)
+        self.assertEqual(catalog.get("tab_1").columns, ("time", "val"))
+        self.assertEqual(catalog.get("tab_2").columns, ())
+        catalog.add("tab_3", True, (i for i in ("time", )))
+        catalog.remove("tab_1")
+        self.assertFalse(catalog.exists("tab_1"))
+        self.assertEqual(catalog.get("tab_3").columns, ("time", ))
+        catalog.load(None)
+        self.assertEqual(len(catalog), 0)
+
+    def test_load_version(self):
+        catalog = ew.TableCatalog()
+        catalog.load([("tab_1", True, ["time"]), ("tab_2", True, ["time"])])
+        version = catalog.version
+        # changes made while the rows were queried are retained
+        catalog.add("tab_3", True, ("time", ))
+        catalog.remove("tab_2")
+        catalog.load([("tab_1", True, ["time"]), ("tab_2", True, ["time"])], version=version)
+        self.assertTrue(catalog.exists("tab_1"))
+        self.assertFalse(catalog.exists("tab_2"))
+        self.assertTrue(catalog.exists("tab_3"))
+        catalog.load([("tab_1", True, ["time"])], version=catalog.version)
+        self.assertFalse(catalog.exists("tab_3"))
+
+    def test_merge(self):
+        catalog = ew.TableCatalog()
+        catalog.add("tab_1", True, ("time", ), options={"drop_after": "1 day"})
+        catalog.merge([("tab_1", True, ["time", "val"]), ("tab_2", False, ["time"])])
+        self.assertEqual(catalog.get("tab_1").columns, ("time", "val"))
+        self.assertEqual(catalog.get("tab_1").options, {"drop_after": "1 day"})
+        self.assertTrue(catalog.exists("tab_2"))
@@ -0,0 +1,103 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from ._util import *
+import unittest
+import json
+import copy
+import datetime
+import psycopg2.errors
+import ew
+
+
+with open("tests/resources/filters.json") as file:
+    filters: list = json.load(file)
+
+
+def run_table_manager(table_manager, db_conn, until, timeout=5):
+    table_manager.start()
+    deadline = time.monotonic() + timeout
+    while not any(until in stmt for stmt in db_conn.statements) and time.monotonic() < deadline and table_manager.is_alive():
+        time.sleep(0.01)
+    alive = table_manager.is_alive()
+    table_manager.stop()
+    table_manager.join()
+    return alive
+
+
+class TestTableManager(unittest.TestCase):
+    def test_duplicate_table(self):
+        # tab_1 has been created by another instance after the catalog has been loaded
+        db_conn = MockDBConnection(fail_on="CREATE TABLE", error=psycopg2.errors.DuplicateTable, results={"t.tablename = 'tab_1'": [("tab_1", True, ["time", "val"])]})
+        table_manager = ew.TableManager(db_conn=db_conn, filter_client=MockFilterClient(filters), retries=2, retry_delay=0, timeout=0.05)
+        table_manager.create_table("export-1")
+        self.assertTrue(run_table_manager(table_manager, db_conn, until="t.tablename = 'tab_1'"))
+        self.assertEqual(sum("t.tablename = 'tab_1'" in stmt for stmt in db_conn.statements), 1)
+
+    def test_table_order(self):
+        # export-2 shares tab_1 with export-1, all statements of tab_1 are executed by one DDL worker in order
+        shared_filters = copy.deepcopy(filters)
+        for item in shared_filters:
+            if item["payload"]["id"] == "export-2":
+                item["payload"]["args"]["table_name"] = "tab_1"
+        db_conns = [MockDBConnection() for _ in range(4)]
+        table_manager = ew.TableManager(db_conn=db_conns[0], ddl_db_conns=db_conns[1:], filter_client=MockFilterClient(shared_filters), timeout=0.05)
+        table_manager.create_table("export-1")
+        table_manager.drop_table("export-2")
+        table_manager.create_table("export-2")
+        for export_id in ("export-3", "export-4", "export-5", "export-6"):
+            table_manager.create_table(export_id)
+        table_manager.start()
+        deadline = time.monotonic() + 5
+        while sum(stmt.startswith("CREATE TABLE") for db_conn in db_conns for stmt in db_conn.statements) < 6 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        table_manager.stop()
+        table_manager.join()
+        tab_1_conns = [db_conn for db_conn in db_conns if any('"tab_1"' in stmt for stmt in db_conn.statements)]
+        self.assertEqual(len(tab_1_conns), 1)
+        stmts = [stmt.split(" ")[0] for stmt in tab_1_conns[0].statements if '"tab_1"' in stmt and "FROM pg_tables" not in stmt]
+        self.assertEqual(stmts, ["CREATE", "DROP", "CREATE"])
+        # other tables are spread across workers
+        self.assertGreater(sum(1 for db_conn in db_conns if any(stmt.startswith("CREATE TABLE") for stmt in db_conn.statements)), 1)
+
+    def _test_reconcile(self, settings, **kwargs):
+        # tab_1 exists with settings of a previous run, tab_2 is created after tab_1 has been reconciled
+        db_conn = MockDBConnection(results={"FROM pg_tables": [("tab_1", True, ["time", "val"]) + settings], "SELECT INTERVAL": [(datetime.timedelta(days=1), datetime.timedelta(days=7))]}, **kwargs)
+        table_manager = ew.TableManager(db_conn=db_conn, filter_client=MockFilterClient(filters), hypertable_defaults={"compress_after": "1 day", "compress_segmentby": "val", "drop_after": "1 week"}, retries=2, retry_delay=0, timeout=0.05)
+        table_manager.create_table("export-1")
+        table_manager.create_table("export-2")
+        self.assertTrue(run_table_manager(table_manager, db_conn, until='CREATE TABLE "tab_2"'))
+        return [stmt for stmt in db_conn.statements if '"tab_1"' in stmt]
+
+    def test_reconcile_unchanged(self):
+        settings = (None, None, None, ["val"], ["time DESC"], datetime.timedelta(days=1), datetime.timedelta(days=7), None)
+        self.assertEqual(self._test_reconcile(settings), [])
+
+    def test_reconcile_changed(self):
+        # the retention policy differs, compression settings of tables with compressed chunks can't be altered
+        settings = (None, None, None, ["time"], ["time DESC"], datetime.timedelta(days=1), datetime.timedelta(days=30), None)
+        stmts = self._test_reconcile(settings, fail_on='"tab_1" SET', error=psycopg2.errors.FeatureNotSupported)
+        self.assertEqual(stmts, [ew.util.gen_remove_retention_policy_stmt(name="tab_1") + " " + ew.util.gen_add_retention_policy_stmt(name="tab_1", drop_after="1 week")])
+
+    def test_invalid_defaults(self):
+        with self.assertRaises(ValueError):
+            ew.TableManager(db_conn=MockDBConnection(), filter_client=MockFilterClient(filters), hypertable_defaults={"compress_after": "one week"})
+        with self.assertRaises(ValueError):
+            ew.TableManager(db_conn=MockDBConnection(), filter_client=MockFilterClient(filters), aggregate_buckets=("1 minute", "hourly"))
+
+
+if __name__ == '__main__':
+    unittest.main()
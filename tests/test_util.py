@@ -0,0 +1,148 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+import datetime
+import ew.util
+import ew.worker
+
+
+class TestUtil(unittest.TestCase):
+    def test_gen_copy_buffer(self):
+        rows = [
+            (datetime.datetime(2022, 2, 9, 10, 1, 1, 781000), 1, 1.0, "one\ttwo\\", True),
+            (datetime.datetime(2022, 2, 9, 10, 1, 2), None, 2.5, "line\nbreak", False)
+        ]
+        self.assertEqual(
+            ew.util.gen_copy_buffer(rows).getvalue(),
+            "2022-02-09T10:01:01.781000\t1\t1.0\tone\\ttwo\\\\\tt\n2022-02-09T10:01:02\t\\N\t2.5\tline\\nbreak\tf\n"
+        )
+
+    def test_gen_create_hypertable_stmt(self):
+        self.assertEqual(
+            ew.util.gen_create_hypertable_stmt(name="tab_1", time_column="time", is_distributed=False),
+            "SELECT create_hypertable('\"tab_1\"', 'time');"
+        )
+        self.assertEqual(
+            ew.util.gen_create_hypertable_stmt(name="tab_1", time_column="time", is_distributed=True, chunk_time_interval="1 day", partition_column="device", partition_count=4),
+            "SELECT create_distributed_hypertable('\"tab_1\"', 'time', partitioning_column => 'device', number_partitions => 4, chunk_time_interval => INTERVAL '1 day');"
+        )
+
+    def test_gen_set_compression_stmt(self):
+        self.assertEqual(
+            ew.util.gen_set_compression_stmt(name="tab_1", segmentby=["device"], orderby="time DESC"),
+            "ALTER TABLE \"tab_1\" SET (timescaledb.compress, timescaledb.compress_segmentby = '\"device\"', timescaledb.compress_orderby = '\"time\" DESC');"
+        )
+        self.assertEqual(
+            ew.util.gen_set_compression_stmt(name="tab_1", segmentby="dev'ice", orderby=["time desc nulls first", '"v""al"']),
+            "ALTER TABLE \"tab_1\" SET (timescaledb.compress, timescaledb.compress_segmentby = '\"dev''ice\"', timescaledb.compress_orderby = '\"time\" DESC NULLS FIRST, \"v\"\"al\"');"
+        )
+
+    def test_gen_create_aggregate_stmt(self):
+        self.assertEqual(
+            ew.util.gen_create_aggregate_stmt(name="tab_1", bucket="1 hour", time_column="time", columns=[["time", "TIMESTAMP"], ["val", "integer"], ["txt", "text"]]),
+            "CREATE MATERIALIZED VIEW IF NOT EXISTS \"tab_1_1hour\" WITH (timescaledb.continuous) AS SELECT time_bucket(INTERVAL '1 hour', \"time\") AS \"time\", "
+            "avg(\"val\") AS \"val_avg\", min(\"val\") AS \"val_min\", max(\"val\") AS \"val_max\", last(\"val\", \"time\") AS \"val_last\" FROM \"tab_1\" GROUP BY 1 WITH NO DATA; "
+            "SELECT add_continuous_aggregate_policy('\"tab_1_1hour\"', start_offset => INTERVAL '1 hour' * 10, end_offset => INTERVAL '1 hour', schedule_interval => INTERVAL '1 hour', if_not_exists => true);"
+        )
+
+    def test_gen_merge_from_table_stmt(self):
+        self.assertEqual(
+            ew.util.gen_merge_from_table_stmt(name="tab_1", source="stage", columns=("time", "val"), unique_col="time"),
+            "INSERT INTO \"tab_1\" (\"time\", \"val\") SELECT \"time\", \"val\" FROM \"stage\" ON CONFLICT (\"time\") DO UPDATE SET \"val\"=EXCLUDED.\"val\"; TRUNCATE \"stage\";"
+        )
+
+    def test_gen_prepare_insert_stmt(self):
+        self.assertEqual(
+            ew.util.gen_prepare_insert_stmt(stmt_name="stmt", name="tab_1", columns=("time", "val"), unique_col="time", row_count=2),
+            "PREPARE \"stmt\" AS INSERT INTO \"tab_1\" (\"time\", \"val\") VALUES ($1, $2), ($3, $4) ON CONFLICT (\"time\") DO UPDATE SET \"val\"=EXCLUDED.\"val\""
+        )
+        self.assertEqual(
+            ew.util.gen_prepare_insert_stmt(stmt_name="stmt", name="tab_1", columns=("time", ), unique_col="time", row_count=1),
+            "PREPARE \"stmt\" AS INSERT INTO \"tab_1\" (\"time\") VALUES ($1) ON CONFLICT (\"time\") DO NOTHING"
+        )
+
+    def test_gen_placeholders(self):
+        self.assertEqual(
+            ew.util.gen_insert_into_table_stmt(name="tab_1", columns=("time", "a"), unique_col="time", values=ew.util.gen_placeholders(2)),
+            "INSERT INTO \"tab_1\" (\"time\", \"a\") VALUES ($1, $2) ON CONFLICT (\"time\") DO UPDATE SET \"a\"=EXCLUDED.\"a\""
+        )
+
+    def test_coalesce_batch(self):
+        data = [
+            (("time", "a", "b"), [(1, 1, 1), (2, 2, 2)]),
+            (("time", "a"), [(3, 3)]),
+            (("time", "a", "b"), [(4, 4, 4)]),
+            (("time", "a"), [(2, 5)])
+        ]
+        self.assertEqual(
+            ew.worker.coalesce_batch(ew.worker.remove_duplicates_from_batch("time", data)),
+            [(("time", "a", "b"), [(1, 1, 1), (4, 4, 4)]), (("time", "a"), [(3, 3), (2, 5)])]
+        )
+
+    def test_lazy_rows_batch(self):
+        calls = list()
+
+        def gen_rows(table_name, group):
+            calls.append(table_name)
+            return ("export-1", None, [(("time", "val"), [(1, group)])]) if group else None
+
+        rows_batch = ew.LazyRowsBatch(groups={"tab_1": 1, "tab_2": None, "tab_3": 3}, gen_rows=gen_rows)
+        self.assertEqual(len(rows_batch), 3)
+        items = list(rows_batch.items())
+        self.assertEqual([table_name for table_name, _ in items], ["tab_1", "tab_3"])
+        # later iterations yield the same rows without converting again
+        self.assertEqual(list(rows_batch.items()), items)
+        self.assertEqual(dict(rows_batch.items()), dict(items))
+        self.assertEqual(calls, ["tab_1", "tab_2", "tab_3"])
+
+    def test_split_default_rows(self):
+        rows = [(1, 1, ew.util.DEFAULT), (2, ew.util.DEFAULT, 2), (3, 3, ew.util.DEFAULT)]
+        self.assertEqual(
+            ew.util.split_default_rows(("time", "a", "b"), rows),
+            [(("time", "a"), [(1, 1), (3, 3)]), (("time", "b"), [(2, 2)])]
+        )
+        self.assertEqual(ew.util.split_default_rows(("time", "a"), [(1, None)]), [(("time", "a"), [(1, None)])])
+
+    def test_validate_hypertable_args(self):
+        cols = ["time", "device", "val"]
+        self.assertTrue(ew.util.validate_hypertable_args({"chunk_time_interval": "1 day", "partition_column": "device", "partition_count": 4, "compress_segmentby": ["device"], "compress_orderby": "time DESC NULLS LAST", "compress_after": "7d", "drop_after": "1 year 2 mons", "aggregates": ["1 minute", "1 hour"]}, cols))
+        self.assertTrue(ew.util.validate_hypertable_args({"chunk_time_interval": "01:00:00", "aggregates": True}, cols))
+        for args in (
+            {"partition_column": "device"},
+            {"partition_column": "device", "partition_count": "4"},
+            {"partition_column": "other", "partition_count": 4},
+            {"partition_count": 0},
+            {"chunk_time_interval": "1 fortnight"},
+            {"compress_after": "1 day'; DROP TABLE x; --"},
+            {"drop_after": True},
+            {"compress_segmentby": ["other"]},
+            {"compress_orderby": "time DESC, val; DROP TABLE x"},
+            {"compress_orderby": "other"},
+            {"compress_orderby": 1},
+            {"aggregates": ["1 minute", "hourly"]}
+        ):
+            with self.subTest(args=args):
+                self.assertFalse(ew.util.validate_hypertable_args(args, cols))
+
+    def test_normalize_orderby(self):
+        self.assertEqual(ew.util.normalize_orderby('"time" DESC, val asc nulls last'), ("time DESC", "val"))
+        self.assertEqual(ew.util.normalize_orderby(["time desc nulls last", "val NULLS FIRST"]), ("time DESC NULLS LAST", "val NULLS FIRST"))
+        self.assertIsNone(ew.util.normalize_orderby(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
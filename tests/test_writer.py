@@ -0,0 +1,127 @@
+"""
+   Copyright 2022 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from ._util import *
+import unittest
+import psycopg2
+import ew
+
+
+rows_batch = {
+    "tab_1": ("export-1", None, [(("time", "val"), [("2022-01-01T00:00:00Z", 1), ("2022-01-01T00:00:01Z", 2)])]),
+    "tab_bad": ("export-2", None, [(("time", "val"), [("2022-01-01T00:00:00Z", 3)])]),
+    "tab_2": ("export-3", None, [(("time", "val"), [("2022-01-01T00:00:00Z", 4)])])
+}
+
+
+class TestWriter(unittest.TestCase):
+    def _test_savepoints(self, write_mode):
+        db_conn = MockDBConnection(fail_on="tab_bad")
+        writer = ew.Writer(db_conn=db_conn, write_mode=write_mode)
+        self.assertEqual(writer.write(rows_batch=rows_batch), {"tab_bad"})
+        self.assertEqual(writer.rolled_back_rows, 1)
+        self.assertEqual(db_conn.commits, 1)
+        self.assertEqual(db_conn.statements[0], 'SAVEPOINT "ew_table"')
+        self.assertIn('ROLLBACK TO SAVEPOINT "ew_table"', db_conn.statements)
+        self.assertTrue(any("tab_2" in stmt for stmt in db_conn.statements))
+
+    def test_savepoints_insert(self):
+        self._test_savepoints(ew.model.WriteMode.insert)
+
+    def test_savepoints_copy(self):
+        self._test_savepoints(ew.model.WriteMode.copy)
+
+    def test_savepoints_prepared(self):
+        self._test_savepoints(ew.model.WriteMode.prepared)
+
+    def test_reconnect(self):
+        db_conn = MockDBConnection()
+        db_conn.close()
+        new_db_conn = MockDBConnection()
+        writer = ew.Writer(db_conn=db_conn, connect=lambda: new_db_conn)
+        self.assertEqual(writer.write(rows_batch={"tab_1": rows_batch["tab_1"]}), set())
+        self.assertEqual(db_conn.statement_count, 0)
+        self.assertEqual(new_db_conn.commits, 1)
+
+    def test_default_values(self):
+        default_batch = {"tab_1": ("export-1", None, [(("time", "val"), [("2022-01-01T00:00:00Z", ew.util.DEFAULT)])])}
+        db_conn = MockDBConnection()
+        ew.Writer(db_conn=db_conn).write(rows_batch=default_batch)
+        self.assertIn("""INSERT INTO "tab_1" ("time", "val") VALUES ('2022-01-01T00:00:00Z',DEFAULT)""", db_conn.statements)
+        db_conn = MockDBConnection()
+        ew.Writer(db_conn=db_conn, write_mode=ew.model.WriteMode.copy).write(rows_batch=default_batch)
+        self.assertIn("""COPY "tab_1" ("time") FROM STDIN\n2022-01-01T00:00:00Z\n""", db_conn.statements)
+
+    def test_evict_stage_table(self):
+        unique_batch = {"tab_1": ("export-1", "time", rows_batch["tab_1"][2])}
+        stage_name = ew.util.gen_stage_table_name(name="tab_1")
+        db_conn = MockDBConnection()
+        writer = ew.Writer(db_conn=db_conn, write_mode=ew.model.WriteMode.copy)
+        writer.write(rows_batch=unique_batch)
+        writer.write(rows_batch=unique_batch)
+        self.assertEqual(sum("CREATE TEMP TABLE" in stmt for stmt in db_conn.statements), 1)
+        # the table has been re-created with other columns
+        writer.evict_table("tab_1")
+        writer.write(rows_batch=unique_batch)
+        self.assertIn(ew.util.gen_drop_stage_table_stmt(stage_name=stage_name), db_conn.statements)
+        self.assertEqual(sum("CREATE TEMP TABLE" in stmt for stmt in db_conn.statements), 2)
+        self.assertEqual(db_conn.commits, 3)
+
+
+def gen_rows_batch(*table_names, val=0):
+    return {table_name: (f"export-{table_name}", None, [(("time", "val"), [("2022-01-01T00:00:00Z", val)])]) for table_name in table_names}
+
+
+class TestWriterPool(unittest.TestCase):
+    def _start_pool(self, db_conns):
+        writer_pool = ew.WriterPool(db_conns=db_conns, timeout=0.05)
+        writer_pool.start()
+        self.addCleanup(writer_pool.join)
+        self.addCleanup(writer_pool.stop)
+        return writer_pool
+
+    def test_sharding(self):
+        # tab_1 is written by the second writer, tab_4 by the first
+        db_conns = [MockDBConnection(), MockDBConnection()]
+        writer_pool = self._start_pool(db_conns)
+        state = writer_pool.submit(rows_batch=gen_rows_batch("tab_1", "tab_4"))
+        self.assertTrue(state.wait(timeout=5))
+        self.assertIsNone(state.error)
+        self.assertEqual([db_conn.commits for db_conn in db_conns], [1, 1])
+        self.assertTrue(any("tab_4" in stmt for stmt in db_conns[0].statements))
+        self.assertFalse(any("tab_1" in stmt for stmt in db_conns[0].statements))
+        self.assertTrue(any("tab_1" in stmt for stmt in db_conns[1].statements))
+        self.assertFalse(any("tab_4" in stmt for stmt in db_conns[1].statements))
+
+    def test_partial_failure(self):
+        db_conns = [MockDBConnection(), MockDBConnection(fail_on="tab_1", error=psycopg2.OperationalError, fail_count=1)]
+        writer_pool = self._start_pool(db_conns)
+        state_1 = writer_pool.submit(rows_batch=gen_rows_batch("tab_1", "tab_4", val=1))
+        state_2 = writer_pool.submit(rows_batch=gen_rows_batch("tab_1", "tab_4", val=2))
+        self.assertTrue(state_1.wait(timeout=5) and state_2.wait(timeout=5))
+        # only the tables of the failed writer have to be written again
+        self.assertIsInstance(state_1.error, ew.util.WriteRowsError)
+        self.assertEqual(state_1.error_tables, {"tab_1"})
+        self.assertEqual(db_conns[0].commits, 2)
+        # the failed writer rejects later batches until it is unblocked
+        self.assertIsInstance(state_2.error, ew.util.WriteRowsError)
+        self.assertEqual(state_2.error_tables, {"tab_1"})
+        self.assertEqual(db_conns[1].commits, 0)
+        writer_pool.unblock()
+        state_3 = writer_pool.submit(rows_batch=gen_rows_batch("tab_1", val=1))
+        self.assertTrue(state_3.wait(timeout=5))
+        self.assertIsNone(state_3.error)
+        self.assertEqual(db_conns[1].commits, 1)
@@ -33,6 +33,7 @@ class KafkaDataConsumerConfig(sevm.Config):
 class KafkaMetricsProducerConfig(sevm.Config):
     client_id = None
     metrics_topic = None
+    linger_ms = 100
 
 
 class KafkaDataClientConfig(sevm.Config):
@@ -46,6 +47,8 @@ class KafkaFilterClientConfig(sevm.Config):
     sync_delay = 30
     time_format = None
     utc = True
+    snapshot_path = None
+    snapshot_interval = 60
 
 
 class TimescaleDBConfig(sevm.Config):
@@ -56,6 +59,10 @@ class TimescaleDBConfig(sevm.Config):
     database = None
     distributed_hypertables = False
     hypertable_replication_factor = 2
+    chunk_time_interval = None
+    compress_after = None
+    drop_after = None
+    aggregate_buckets = "1 minute,1 hour"
 
 
 class TableManagerConfig(sevm.Config):
@@ -63,6 +70,35 @@ class TableManagerConfig(sevm.Config):
     retries = 2
     retry_delay = 2
     metrics = False
+    catalog_refresh_interval = 0
+    workers = 1
+
+
+class ErrorReportingConfig(sevm.Config):
+    log_interval = 10
+    dead_letter_topic = None
+
+
+class BatchControlConfig(sevm.Config):
+    mode = None
+    min_limit = 100
+    max_limit = 50000
+    min_timeout = 0.1
+    max_timeout = 10.0
+    target_latency = 2.0
+
+
+class MetricsServerConfig(sevm.Config):
+    enabled = False
+    port = 9100
+
+
+class ProfilingConfig(sevm.Config):
+    enabled = False
+    path = "/tmp/ew-profiling"
+    mode = "sampling"
+    sample_interval = 0.01
+    tracemalloc_frames = 25
 
 
 class WatchdogConfig(sevm.Config):
@@ -74,7 +110,31 @@ class Config(sevm.Config):
     logger_level = "warning"
     get_data_timeout = 5.0
     get_data_limit = 1000
+    batch_max_bytes = 0
+    streaming = False
     page_size = 100
+    write_mode = "insert"
+    pipeline = False
+    pipeline_size = 2
+    writers = 1
+    processes = 1
+    engine = "threaded"
+    json_codec = "auto"
+    async_pool_size = 4
+    datetime_cache_size = 0
+    stmt_cache_size = 1024
+    fill_missing_columns = False
+    dedup_window = 0
+    dedup_ttl = 0
+    spool_path = None
+    spool_max_size = 1073741824
+    spool_segment_size = 67108864
+    spool_sync_interval = 1.0
+    spool_retry_interval = 5
+    reconnect_retries = 5
+    reconnect_delay = 0.5
+    reconnect_max_delay = 30
+    pause_partitions = False
     kafka = KafkaConfig
     kafka_data_client = KafkaDataClientConfig
     kafka_data_consumer = KafkaDataConsumerConfig
@@ -82,5 +142,9 @@ class Config(sevm.Config):
     kafka_filter_consumer_group_id = None
     kafka_metrics_producer = KafkaMetricsProducerConfig
     watchdog = WatchdogConfig
+    metrics_server = MetricsServerConfig
+    profiling = ProfilingConfig
+    batch_control = BatchControlConfig
+    error_reporting = ErrorReportingConfig
     timescaledb = TimescaleDBConfig
     table_manager = TableManagerConfig